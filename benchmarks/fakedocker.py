@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlparse
+
+API_VERSION = "1.41"
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+
+
+class FakeDocker(object):
+    """
+    Serves just enough of the docker engine API over a unix socket for
+    portinus to check services and record images: 'containers' healthy
+    containers spread evenly over the compose 'projects'
+    """
+
+    def __init__(self, socket_path, projects, containers):
+        self.socket_path = socket_path
+        self.containers = {}
+        for i in range(containers):
+            project = projects[i % len(projects)]
+            container_id = hashlib.sha256("{}-{}".format(project, i).encode()).hexdigest()
+            self.containers[container_id] = {
+                "Id": container_id,
+                "Names": ["/{project}_web_{i}".format(project=project, i=i)],
+                "Labels": {PROJECT_LABEL: project, SERVICE_LABEL: "web"},
+                "State": "running",
+                "Status": "Up 2 hours (healthy)",
+            }
+        self._listings = {}
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            docker = fake
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.remove(self.socket_path)
+
+    def list_containers(self, filters):
+        """
+        Returns the encoded container listing for 'filters', which is only
+        worked out once for each set of filters
+        """
+        key = json.dumps(filters, sort_keys=True)
+        if key not in self._listings:
+            containers = self.containers.values()
+            for label in filters.get("label", []):
+                name, _, value = label.partition("=")
+                containers = [x for x in containers if name in x["Labels"] and (not value or x["Labels"][name] == value)]
+            if "health" in filters:
+                containers = [x for x in containers if "({})".format(filters["health"][0]) in x["Status"]]
+            self._listings[key] = json.dumps(list(containers)).encode()
+        return self._listings[key]
+
+    def inspect_container(self, container_id):
+        container = self.containers.get(container_id)
+        if container is None:
+            return None
+        return {
+            "Id": container_id,
+            "Name": container["Names"][0],
+            "State": {"Status": "running", "Health": {"Status": "healthy"}},
+            "Config": {"Labels": container["Labels"]},
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    docker = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        query = parse_qs(url.query)
+        if path == "/_ping":
+            return self._send(200, b"OK", "text/plain")
+        if path == "/version":
+            return self._send_json({"ApiVersion": API_VERSION, "Version": "24.0.0", "MinAPIVersion": "1.12"})
+        if path == "/containers/json":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            return self._send(200, self.docker.list_containers(filters))
+
+        match = re.match(r"^/containers/([^/]+)/json$", path)
+        if match:
+            container = self.docker.inspect_container(match.group(1))
+            if container is None:
+                return self._send_json({"message": "No such container"}, 404)
+            return self._send_json(container)
+
+        match = re.match(r"^/images/(.+)/json$", path)
+        if match:
+            name = unquote(match.group(1))
+            image_id = name if name.startswith("sha256:") else "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+            return self._send_json({"Id": image_id, "RepoTags": [name]})
+        self._send_json({"message": "Not found"}, 404)
+
+    def do_POST(self):
+        self._discard_body()
+        if re.match(r"^(/v[0-9.]+)?/images/.+/tag", self.path):
+            return self._send(201, b"")
+        self._send_json({"message": "Not found"}, 404)
+
+    def do_DELETE(self):
+        self._discard_body()
+        self._send_json([])
+
+    def log_message(self, format, *args):
+        pass
+
+    def _discard_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _send_json(self, body, code=200):
+        self._send(code, json.dumps(body).encode())
+
+    def _send(self, code, body, content_type="application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,35 @@
+"""
+Runs 'portinus' or 'portinus-monitor' against the sandbox that run.py sets
+up, instead of the host's services and systemd units
+"""
+import os
+import pathlib
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import portinus  # noqa: E402
+
+SERVICE_DIR_ENVVAR = "PORTINUS_BENCHMARK_SERVICE_DIR"
+UNIT_DIR_ENVVAR = "PORTINUS_BENCHMARK_UNIT_DIR"
+
+
+def configure():
+    """
+    Point portinus at the sandbox named by the environment
+    """
+    portinus.service_dir = pathlib.Path(os.environ[SERVICE_DIR_ENVVAR])
+    portinus.template_override_dir = portinus.service_dir.joinpath(".templates")
+    portinus.systemd.UNIT_DIR = os.environ[UNIT_DIR_ENVVAR]
+
+
+if __name__ == "__main__":
+    configure()
+    command = sys.argv.pop(1)
+    if command == "portinus":
+        from portinus.cli import task
+    elif command == "portinus-monitor":
+        from portinus.monitor.cli import task
+    else:
+        sys.exit("Unknown command {}".format(command))
+    task(prog_name=command)
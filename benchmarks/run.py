@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Benchmarks portinus offline, against stub systemctl and docker-compose
+executables and a fake docker API socket, at fleet sizes from 1 app with 1
+container up to 1,000 apps with 10,000 containers. The results are compared
+with the baselines in baselines.json, and any that are more than --tolerance
+times slower fail the run.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --max-apps 100
+    python benchmarks/run.py --update-baselines
+"""
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import launcher  # noqa: E402
+from fakedocker import FakeDocker  # noqa: E402
+
+import portinus  # noqa: E402
+from portinus import fleet  # noqa: E402
+
+BASELINES_PATH = os.path.join(BENCHMARK_DIR, "baselines.json")
+STUB_DIR = os.path.join(BENCHMARK_DIR, "bin")
+LAUNCHER_PATH = os.path.join(BENCHMARK_DIR, "launcher.py")
+
+# (apps, containers)
+FLEET_SIZES = ((1, 1), (10, 100), (100, 1000), (1000, 10000))
+IMPORTS = ("portinus", "portinus.cli", "portinus.monitor.cli")
+SOURCE_FILES = 20
+# Calibration is cheap, so it is always run at least this many times
+CALIBRATION_REPEAT = 20
+
+COMPOSE_FILE = """\
+version: "2.4"
+services:
+  web:
+    build: .
+    healthcheck:
+      test: ["CMD", "true"]
+  cache:
+    image: redis:7
+"""
+
+
+class Sandbox(object):
+    """
+    A temporary services folder, systemd unit folder and docker socket, and
+    the environment that points portinus at them
+    """
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix="portinus-benchmark-")
+        self.service_dir = os.path.join(self.path, "services")
+        self.unit_dir = os.path.join(self.path, "units")
+        self.source_dir = os.path.join(self.path, "sources")
+        self.socket_path = os.path.join(self.path, "docker.sock")
+        for path in (self.service_dir, self.unit_dir, self.source_dir):
+            os.mkdir(path)
+        self.apps = []
+        self.environment = dict(os.environ,
+                                PATH=STUB_DIR + os.pathsep + os.environ.get("PATH", ""),
+                                DOCKER_HOST="unix://" + self.socket_path,
+                                PORTINUS_SYSTEMD_BACKEND="systemctl",
+                                PYTHONDONTWRITEBYTECODE="1")
+        self.environment[launcher.SERVICE_DIR_ENVVAR] = self.service_dir
+        self.environment[launcher.UNIT_DIR_ENVVAR] = self.unit_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutil.rmtree(self.path)
+
+    def get_source(self, name):
+        return os.path.join(self.source_dir, name)
+
+    def grow(self, apps):
+        """
+        Deploy apps until there are 'apps' of them
+        """
+        os.environ.update(self.environment)
+        launcher.configure()
+        new_apps = []
+        for i in range(len(self.apps), apps):
+            name = "app{:04d}".format(i + 1)
+            _write_source(self.get_source(name))
+            new_apps.append({"name": name, "source": self.get_source(name)})
+        results = fleet.apply(new_apps, workers=8)
+        failed = [str(x) for x in results if x.failed]
+        if failed:
+            raise RuntimeError("Unable to set up the fleet: {}".format(", ".join(failed)))
+        self.apps += [x["name"] for x in new_apps]
+
+    def run(self, command, *args):
+        subprocess.check_call([sys.executable, LAUNCHER_PATH, command] + list(args),
+                              env=self.environment, stdout=subprocess.DEVNULL)
+
+
+def _write_source(path):
+    os.makedirs(os.path.join(path, "app"), exist_ok=True)
+    with open(os.path.join(path, "docker-compose.yml"), "w") as f:
+        f.write(COMPOSE_FILE)
+    with open(os.path.join(path, "Dockerfile"), "w") as f:
+        f.write("FROM python:3\nCOPY app /app\n")
+    for i in range(SOURCE_FILES):
+        with open(os.path.join(path, "app", "module{}.py".format(i)), "w") as f:
+            f.write("VALUE = {}\n".format(i) * 50)
+
+
+def measure(function, repeat, setup=None, summary=statistics.median):
+    """
+    Returns the median time, in seconds, of 'repeat' calls to 'function'. An
+    extra warm-up call is made first and not counted, as it pays for the
+    deferred imports and cold caches that later calls do not
+    """
+    timings = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return summary(timings[1:])
+
+
+def calibrate(repeat):
+    """
+    Returns how long this machine takes to start an interpreter plus a fixed
+    amount of pure python work, so that baselines recorded on one machine
+    can be scaled to another. Each is timed on its own and the fastest of at
+    least CALIBRATION_REPEAT runs is used. The garbage collector is paused
+    for the pure python work, as otherwise its cost depends on what else this
+    process has loaded
+    """
+    def work():
+        gc.disable()
+        try:
+            json.loads(json.dumps([{"key": str(x)} for x in range(20000)]))
+        finally:
+            gc.enable()
+
+    repeat = max(repeat, CALIBRATION_REPEAT)
+    return (measure(lambda: subprocess.check_call([sys.executable, "-S", "-c", "pass"]), repeat, summary=min) +
+            measure(work, repeat, summary=min))
+
+
+def run_imports(sandbox, repeat):
+    results = {}
+    for module in IMPORTS:
+        command = [sys.executable, "-c", "import {}".format(module)]
+        results["import {}".format(module)] = measure(
+            lambda: subprocess.check_call(command, env=sandbox.environment), repeat)
+    return results
+
+
+def run_fleet(sandbox, apps, containers, repeat):
+    """
+    Returns the timings of every command with 'apps' deployed and
+    'containers' running
+    """
+    with FakeDocker(sandbox.socket_path, ["app{:04d}".format(x + 1) for x in range(apps)], containers):
+        portinus.monitor.checker._client = None
+        sandbox.grow(apps)
+        target = sandbox.apps[0]
+        source = sandbox.get_source(target)
+        changed_path = os.path.join(source, "app", "changed.py")
+
+        def change(i):
+            with open(changed_path, "w") as f:
+                f.write("VALUE = {}\n".format(time.time()))
+
+        commands = (
+            ("portinus list", None, ("portinus", "list")),
+            ("portinus list --long", None, ("portinus", "list", "--long")),
+            ("portinus ensure (unchanged)", None, ("portinus", "ensure", target, "--source", source)),
+            ("portinus ensure (changed)", change, ("portinus", "ensure", target, "--source", source)),
+            ("portinus compose ps", None, ("portinus", "compose", target, "ps")),
+            ("portinus-monitor check --name", None, ("portinus-monitor", "check", "--name", target)),
+            ("portinus-monitor check --all", None, ("portinus-monitor", "check", "--all")),
+        )
+        results = {}
+        for name, setup, args in commands:
+            results[name] = measure(lambda: sandbox.run(*args), repeat, setup)
+
+        results["Application() for every app"] = measure(lambda: [portinus.Application(x) for x in sandbox.apps], repeat)
+        results["ComposeSource.stage (unchanged)"] = measure(
+            lambda: portinus.Application(target, source=source).service._source.stage(), repeat)
+        results["checker.run_all"] = measure(portinus.monitor.checker.run_all, repeat)
+        portinus.monitor.checker._client = None
+
+    label = " [{apps} apps, {containers} containers]".format(apps=apps, containers=containers)
+    return {name + label: seconds for name, seconds in results.items()}
+
+
+def compare(results, baselines, scale, tolerance, slack):
+    """
+    Returns the names of the results that are slower than their baseline,
+    scaled to this machine, by more than 'tolerance' times plus 'slack'
+    seconds
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        baseline = baselines.get(name)
+        if baseline is None:
+            status = "new"
+        else:
+            allowed = baseline * scale * tolerance + slack
+            status = "{:+.0%}".format(seconds / (baseline * scale) - 1)
+            if seconds > allowed:
+                status += " REGRESSION"
+                regressions.append(name)
+        click.echo("{seconds:10.4f}s  {status:<18} {name}".format(seconds=seconds, status=status, name=name))
+    return regressions
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"calibration": None, "results": {}}
+
+
+def save_baselines(calibration, results):
+    baselines = load_baselines()
+    baselines["calibration"] = calibration
+    baselines["python"] = platform.python_version()
+    baselines["results"].update(results)
+    with open(BASELINES_PATH, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+@click.command()
+@click.option('--max-apps', type=click.IntRange(min=1), default=FLEET_SIZES[-1][0], show_default=True, help="Skip the fleet sizes with more apps than this")
+@click.option('--repeat', type=click.IntRange(min=1), default=5, show_default=True, help="How many times to run each benchmark, after one warm-up run. The median is used")
+@click.option('--tolerance', type=click.FloatRange(min=1), default=1.5, show_default=True, help="How many times slower than its baseline a benchmark may be")
+@click.option('--slack', type=click.FloatRange(min=0), default=0.005, show_default=True, help="Seconds a benchmark may be slower than its baseline on top of --tolerance, to absorb noise in fast benchmarks")
+@click.option('--update-baselines', is_flag=True, help="Record the results as the new baselines instead of comparing with them")
+def main(max_apps, repeat, tolerance, slack, update_baselines):
+    logging.basicConfig(level=logging.ERROR)
+    baselines = load_baselines()
+    # Calibrated between every group of benchmarks, as the speed of a shared
+    # machine drifts over the course of a run
+    calibrations = [calibrate(repeat)]
+    results = {}
+    with Sandbox() as sandbox:
+        results.update(run_imports(sandbox, repeat))
+        calibrations.append(calibrate(repeat))
+        for apps, containers in FLEET_SIZES:
+            if apps > max_apps:
+                continue
+            click.echo("Benchmarking {apps} apps with {containers} containers".format(apps=apps, containers=containers))
+            results.update(run_fleet(sandbox, apps, containers, repeat))
+            calibrations.append(calibrate(repeat))
+
+    calibration = statistics.median(calibrations)
+    scale = calibration / baselines["calibration"] if baselines["calibration"] else 1.0
+    click.echo("Calibration: {:.4f}s (x{:.2f} the baseline machine)".format(calibration, scale))
+
+    if update_baselines:
+        save_baselines(calibration, results)
+        compare(results, {}, scale, tolerance, slack)
+        click.echo("Saved the baselines to {}".format(BASELINES_PATH))
+        return
+
+    regressions = compare(results, baselines["results"], scale, tolerance, slack)
+    if regressions:
+        click.echo("{} benchmarks regressed".format(len(regressions)), err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
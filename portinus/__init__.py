@@ -1,19 +1,27 @@
+import hashlib
+import json
 import logging
+import os
+import threading
 from operator import attrgetter
 
 import pathlib
-from jinja2 import Template
 
-from .cli import task
-from . import restart, monitor
+from . import restart, monitor, sync, ignore, systemd, buildcache, releases, fleet, inventory
 from .environmentfile import EnvironmentFile
 from .composesource import ComposeSource
 from .service import Service
 
+__version__ = "1.0.17"
+
 _script_dir = pathlib.Path(__file__).resolve().parent
 template_dir = _script_dir.joinpath("templates")
+template_override_dir = pathlib.Path("/etc/portinus/templates")
 service_dir = pathlib.Path("/usr/local/portinus-services")
 
+_template_environment = None
+_template_environment_lock = threading.Lock()
+
 
 def list():
     """
@@ -21,9 +29,18 @@ def list():
     """
     _ensure_service_dir()
     print("Available portinus services:")
-    for i in sorted(service_dir.iterdir()):
-        if i.is_dir():
-            print(i.name)
+    for name in get_service_names():
+        print(name)
+
+
+def get_service_names():
+    """
+    Returns the names of all the installed services
+    """
+    try:
+        return sorted(i.name for i in service_dir.iterdir() if i.is_dir() and not i.name.startswith("."))
+    except FileNotFoundError:
+        return []
 
 
 def get_instance_dir(name):
@@ -35,13 +52,31 @@ def get_instance_dir(name):
 
 def get_template(file_name):
     """
-    Returns the named template
+    Returns the named template. A file of the same name in
+    /etc/portinus/templates overrides the one shipped with portinus.
+    Templates are compiled once per process, and again only if their file
+    changes or an override for them is added
     """
-    template_file = template_dir.joinpath(file_name)
-    with template_file.open() as f:
-        template_contents = f.read()
+    return get_template_environment().get_template(file_name)
+
 
-    return Template(template_contents)
+def get_template_environment():
+    """
+    Returns the jinja environment shared by every template. Compiled
+    templates are also kept in jinja's bytecode cache, so that other portinus
+    processes do not have to compile them again
+    """
+    global _template_environment
+    with _template_environment_lock:
+        if _template_environment is None:
+            import jinja2
+            from .templateloader import TemplateLoader
+            _template_environment = jinja2.Environment(
+                loader=TemplateLoader([str(template_override_dir), str(template_dir)]),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(),
+                auto_reload=True,
+                )
+        return _template_environment
 
 
 def _ensure_service_dir():
@@ -60,31 +95,114 @@ class Application(object):
 
     log = logging.getLogger()
 
-    def __init__(self, name, source=None, environment_file=None, restart_schedule=None):
+    def __init__(self, name, source=None, environment_file=None, restart_schedule=None, monitor_settings=None, snapshot=None, keep_releases=None, exclude=()):
         self.name = name
+        self.fingerprint_path = pathlib.Path("{}.fingerprint".format(get_instance_dir(name)))
         self.environment_file = EnvironmentFile(name, environment_file)
-        self.service = Service(name, source)
+        self.service = Service(name, source, snapshot=snapshot, keep_releases=keep_releases, exclude=exclude)
         self.restart_timer = restart.Timer(name, restart_schedule=restart_schedule)
+        self.monitor_policy = monitor.Policy(name, **(monitor_settings or {}))
         self.monitor_service = monitor.Service(name)
 
     def exists(self):
         return self.service.exists()
 
-    def ensure(self):
+    def fingerprint(self):
         """
-        Ensure all the application components are in the correct state
+        Returns a digest of everything that goes into a deployment: the
+        source tree less its excluded paths, environment file, restart schedule, monitor policy,
+        rendered unit files and service script and the portinus version
         """
+        digest = hashlib.sha256()
+
+        def add(label, value):
+            digest.update("{label}\0{value}\0".format(label=label, value=value).encode())
+
+        add("version", __version__)
+        add("source", sync.tree_fingerprint(self.service.source, ignore=self.service.get_ignore_rules()))
+        add("exclude", json.dumps(self.service.exclude))
+        if self.environment_file:
+            add("environment_file", sync.file_hash(str(self.environment_file.source)))
+        add("snapshot", self.service.snapshot)
+        add("restart_schedule", self.restart_timer.restart_schedule)
+        add("monitor_policy", json.dumps(self.monitor_policy.settings, sort_keys=True))
+        add("service_unit", self.service._generate_service_file())
+        add("service_script", self.service._generate_service_script())
+        if self.restart_timer:
+            add("restart_service_unit", self.restart_timer._generate_service_file())
+            add("restart_timer_unit", self.restart_timer._generate_timer_file())
+        add("monitor_service_unit", self.monitor_service._generate_service_file())
+        # Rendered with the configured interval rather than the adaptive one,
+        # which changes without anything being redeployed
+        add("monitor_timer_unit", self.monitor_service._generate_timer_file(self.monitor_policy.interval))
+        return digest.hexdigest()
+
+    def deployed_fingerprint(self):
+        """
+        Returns the fingerprint of the last successful deployment, if any
+        """
+        try:
+            with self.fingerprint_path.open() as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def ensure(self, force=False):
+        """
+        Ensure all the application components are in the correct state. This
+        is skipped if nothing has changed since the last deployment, unless
+        'force' is set, which also rebuilds every image. Returns True if
+        anything was deployed. Once the service has been switched over to the
+        new release it is started again even if a later step fails
+        """
+        fingerprint = self.fingerprint()
+        if not force and self.exists() and fingerprint == self.deployed_fingerprint():
+            self.log.info("Nothing has changed for {name} since it was last deployed. Skipping".format(name=self.name))
+            return False
+
         _ensure_service_dir()
-        self.environment_file.ensure()
-        self.service.ensure()
-        self.restart_timer.ensure()
-        self.monitor_service.ensure()
+        with systemd.Transaction() as transaction:
+            self.service.ensure(transaction, rebuild=force, environment_file=self.environment_file)
+            try:
+                self.restart_timer.ensure(transaction)
+                self.monitor_policy.ensure()
+                self.monitor_service.record_deploy()
+                self.monitor_service.ensure(transaction)
+            except Exception:
+                self.log.error("Failed to deploy {name}, starting its service on the new release anyway".format(name=self.name))
+                transaction.commit()
+                raise
+
+        with self.fingerprint_path.open("w") as f:
+            f.write(fingerprint + "\n")
+        return True
+
+    def rollback(self):
+        """
+        Switch the service back to the release before the active one. The
+        next ensure redeploys even if nothing has changed. Returns the ID of
+        the release that is now active
+        """
+        release = self.service.rollback()
+        self._remove_fingerprint()
+        return release
 
-    def remove(self):
+    def remove(self, transaction=None):
         """
-        Remove all the application components
+        Remove all the application components. The systemd units are removed
+        as part of 'transaction' if one is given
         """
-        self.service.remove()
-        self.environment_file.remove()
-        self.restart_timer.remove()
-        self.monitor_service.remove()
+        with systemd.transaction(transaction) as t:
+            self.service.remove(t)
+            self.environment_file.remove()
+            self.restart_timer.remove(t)
+            self.monitor_service.remove(t)
+        self.monitor_policy.remove()
+        monitor.State(self.name).remove()
+        self._remove_fingerprint()
+
+    def _remove_fingerprint(self):
+        try:
+            os.remove(str(self.fingerprint_path))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+
+import portinus
+from .ignore import IgnoreRules
+
+log = logging.getLogger(__name__)
+
+COMPOSE_FILE = "docker-compose.yml"
+# Compose files that docker-compose merges into COMPOSE_FILE by default
+OVERRIDE_FILES = ("docker-compose.override.yml", "docker-compose.override.yaml")
+DOCKERIGNORE_FILE = ".dockerignore"
+DEFAULT_DOCKERFILE = "Dockerfile"
+# The file in the project directory that docker-compose reads variables from
+DOTENV_FILE = ".env"
+
+
+class BuildCache(object):
+    """
+    The build hash of every compose service as of its last successful build,
+    so that services whose build inputs have not changed are not rebuilt
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = pathlib.Path("{}.build-cache".format(portinus.get_instance_dir(name)))
+
+    def load(self):
+        try:
+            with self.path.open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning("Ignoring the corrupt build cache at {path}".format(path=self.path))
+            return {}
+
+    def save(self, hashes):
+        temporary_path = "{path}.tmp".format(path=self.path)
+        with open(temporary_path, "w") as f:
+            json.dump(hashes, f, indent=2, sort_keys=True)
+        os.replace(temporary_path, str(self.path))
+
+    def remove(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def get_build_hashes(compose_dir, environment_file=None):
+    """
+    Returns a hash of the build inputs of every compose service in
+    'compose_dir' that is built rather than pulled: its build settings, its
+    Dockerfile, every file in its build context that .dockerignore does not
+    exclude and the values of the build args it takes from the environment,
+    so that changing any other variable rebuilds nothing.
+
+    Returns None if the build contexts cannot be worked out, including when
+    an override file or COMPOSE_FILE means that docker-compose.yml is not the
+    only compose file, in which case every service should be built
+    """
+    compose_dir = str(compose_dir)
+    services = _load_services(compose_dir, environment_file)
+    if services is None:
+        return None
+
+    environment = None
+    hashes = {}
+    for service, settings in services.items():
+        build = settings.get("build") if isinstance(settings, dict) else None
+        if build is None:
+            continue
+        if isinstance(build, str):
+            build = {"context": build}
+        if not isinstance(build, dict) or "$" in json.dumps(build):
+            log.debug("Unable to work out the build context of {service}".format(service=service))
+            return None
+
+        context = os.path.normpath(os.path.join(compose_dir, build.get("context", ".")))
+        dockerfile = os.path.join(context, build.get("dockerfile", DEFAULT_DOCKERFILE))
+        if not os.path.isdir(context):
+            return None
+
+        names = _get_environment_args(build)
+        if names and environment is None:
+            environment = _load_environment(compose_dir, environment_file)
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps(build, sort_keys=True).encode())
+        digest.update(json.dumps({x: environment.get(x) for x in names} if names else {}, sort_keys=True).encode())
+        digest.update(_get_file_hash(dockerfile).encode())
+        digest.update(hash_context(context).encode())
+        hashes[service] = digest.hexdigest()
+    return hashes
+
+
+def get_image_names(compose_dir, project_name, environment_file=None):
+    """
+    Returns the name of the image that docker-compose tags for every compose
+    service in 'compose_dir' that is built rather than pulled. This is its
+    'image' setting if it has one, otherwise '<project>_<service>'. Returns
+    None if the compose files cannot be read
+    """
+    services = _load_services(str(compose_dir), environment_file)
+    if services is None:
+        return None
+
+    images = {}
+    for service, settings in services.items():
+        if not isinstance(settings, dict) or settings.get("build") is None:
+            continue
+        image = settings.get("image") or "{project}_{service}".format(project=project_name, service=service)
+        if "$" not in str(image):
+            images[service] = str(image)
+    return images
+
+
+def hash_context(context):
+    """
+    Returns a hash of the names, modes and contents of every file in the build
+    context that is not excluded by its .dockerignore
+    """
+    rules = IgnoreRules.load(os.path.join(context, DOCKERIGNORE_FILE))
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(context):
+        relative_root = os.path.relpath(root, context)
+        if not rules.has_exceptions:
+            dirs[:] = [x for x in dirs if not rules.ignored(os.path.join(relative_root, x))]
+        dirs.sort()
+        for name in sorted(files + [x for x in dirs if os.path.islink(os.path.join(root, x))]):
+            relative_path = os.path.normpath(os.path.join(relative_root, name))
+            if rules.ignored(relative_path):
+                continue
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                details = "link {target}".format(target=os.readlink(path))
+            else:
+                details = "file {mode:o} {hash}".format(mode=os.stat(path).st_mode, hash=_get_file_hash(path))
+            digest.update("{path}\0{details}\n".format(path=relative_path, details=details).encode())
+    return digest.hexdigest()
+
+
+def _get_environment_args(build):
+    """
+    Returns the names of the build args that are listed without a value, and
+    so take their value from the environment
+    """
+    args = build.get("args") or {}
+    if isinstance(args, dict):
+        return sorted(str(k) for k, v in args.items() if v is None)
+    if isinstance(args, list):
+        return sorted(str(x) for x in args if "=" not in str(x))
+    return []
+
+
+def _load_environment(compose_dir, environment_file):
+    """
+    Returns the variables docker-compose sees when the service script runs
+    it: the project's .env file, overridden by the environment, overridden
+    by the environment file the script sources
+    """
+    environment = portinus.environmentfile.read_file(os.path.join(compose_dir, DOTENV_FILE)) or {}
+    environment.update(os.environ)
+    if environment_file:
+        environment.update(portinus.environmentfile.read_file(environment_file) or {})
+    return environment
+
+
+def _get_file_hash(path):
+    try:
+        return portinus.sync.file_hash(path)
+    except FileNotFoundError:
+        return ""
+
+
+def _load_services(compose_dir, environment_file=None):
+    """
+    Returns the services from the compose file in 'compose_dir', in either the
+    version 1 or the 'services' format, or None if it cannot be read. Other
+    compose files are not merged in, so None is also returned if docker-compose
+    would read any: an override file, or COMPOSE_FILE set in 'environment_file'
+    or the environment
+    """
+    import yaml
+
+    variables = {}
+    if environment_file:
+        variables = portinus.environmentfile.read_file(environment_file) or {}
+    if variables.get("COMPOSE_FILE") or os.environ.get("COMPOSE_FILE"):
+        log.debug("COMPOSE_FILE is set for {path}, so its compose files are not read".format(path=compose_dir))
+        return None
+    for name in OVERRIDE_FILES:
+        if os.path.exists(os.path.join(compose_dir, name)):
+            log.debug("Found {name} in {path}, so its compose files are not read".format(name=name, path=compose_dir))
+            return None
+
+    try:
+        with open(os.path.join(compose_dir, COMPOSE_FILE)) as f:
+            compose = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        log.warning("Unable to read the compose file in {path}: {error}".format(path=compose_dir, error=e))
+        return None
+
+    if not isinstance(compose, dict):
+        return None
+    services = compose.get("services") if "version" in compose or "services" in compose else compose
+    if not isinstance(services, dict):
+        return None
+    return services
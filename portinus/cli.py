@@ -2,9 +2,13 @@
 
 import click
 import logging
+import subprocess
 import sys
 
 import portinus
+from portinus.fleet import DEFAULT_WORKERS
+from portinus.monitor.policy import REMEDIATIONS
+from portinus.sync import SNAPSHOT_MODES
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -42,15 +46,75 @@ def remove(name):
 @click.option('--source', type=click.Path(exists=True), required=True, help="A path to a folder containg a docker-compose.yml")
 @click.option('--env', help="A file containing the list of environment variables to use")
 @click.option('--restart', help="Provide a systemd 'OnCalender' scheduling string to force a restart of the service on the specified interval (e.g. 'weekly' or 'daily')")
-def ensure(name, source, env, restart):
+@click.option('--remediation', type=click.Choice(REMEDIATIONS), help="What the monitor does about unhealthy containers: restart the whole 'stack' (default), or 'service' restart/'recreate' only the unhealthy compose services")
+@click.option('--escalate-after', type=click.IntRange(min=0), help="How many checks in a row a compose service may fail before the whole stack is restarted (default 3)")
+@click.option('--max-restarts', type=click.IntRange(min=1), help="How many times the monitor may restart the service within --restart-window before pausing restarts (default 3)")
+@click.option('--restart-window', type=click.IntRange(min=1), help="The window, in seconds, that --max-restarts applies to (default 3600)")
+@click.option('--restart-backoff', type=click.IntRange(min=1), help="How long, in seconds, the monitor first pauses restarts for. Doubles each time restarts resume without fixing the service (default 900)")
+@click.option('--max-restart-backoff', type=click.IntRange(min=1), help="The longest, in seconds, the monitor will pause restarts for (default 86400)")
+@click.option('--monitor-interval', type=click.IntRange(min=1), help="How often, in seconds, the monitor checks the service (default 300)")
+@click.option('--adaptive-monitor/--no-adaptive-monitor', default=None, help="Check more often right after a deploy or a failure, and less often once the service has been stable for a day")
+@click.option('--force', is_flag=True, help="Redeploy and rebuild every image even if nothing has changed since the last deployment")
+@click.option('--snapshot', type=click.Choice(SNAPSHOT_MODES), help="How the source is copied: 'copy' (default) copies changed files, as reflinks where the filesystem supports it, and 'link' also hardlinks identical files so they are only stored once. Files from a 'link' snapshot must never be modified in place")
+@click.option('--keep-releases', type=click.IntRange(min=2), help="How many releases to keep for 'portinus rollback' (default 3)")
+@click.option('--exclude', multiple=True, help="A gitignore style pattern of source paths to leave out of the deployment, in addition to those in the source's .portinusignore file. Can be given more than once")
+def ensure(name, source, env, restart, remediation, escalate_after, max_restarts, restart_window, restart_backoff, max_restart_backoff, monitor_interval, adaptive_monitor, force, snapshot, keep_releases, exclude):
+    monitor_settings = dict(remediation=remediation, escalate_after=escalate_after,
+                            max_restarts=max_restarts, restart_window=restart_window,
+                            restart_backoff=restart_backoff, max_restart_backoff=max_restart_backoff,
+                            interval=monitor_interval, adaptive=adaptive_monitor)
     application = portinus.Application(name, source=source,
                                        environment_file=env,
-                                       restart_schedule=restart)
+                                       restart_schedule=restart,
+                                       monitor_settings=monitor_settings,
+                                       snapshot=snapshot,
+                                       keep_releases=keep_releases,
+                                       exclude=exclude)
     try:
-        application.ensure()
+        if not application.ensure(force=force):
+            click.echo("Nothing has changed for {name} since it was last deployed".format(name=name))
     except PermissionError:
         click.echo("Failed to create the application due to a permissions error")
         sys.exit(1)
+    except subprocess.CalledProcessError:
+        click.echo("Failed to build {name}, the running deployment was left as it is".format(name=name))
+        sys.exit(1)
+
+
+@task.command()
+@click.argument('name', required=True)
+def rollback(name):
+    application = portinus.Application(name)
+    try:
+        release = application.rollback()
+    except ValueError as e:
+        click.echo(str(e))
+        sys.exit(1)
+    except PermissionError:
+        click.echo("Failed to roll back the application due to a permissions error")
+        sys.exit(1)
+    except subprocess.CalledProcessError:
+        click.echo("Failed to rebuild the images of the previous release of {name}".format(name=name))
+        sys.exit(1)
+    click.echo("Rolled {name} back to release {release}".format(name=name, release=release))
+
+
+@task.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=click.IntRange(min=1), default=DEFAULT_WORKERS, show_default=True, help="How many apps to deploy at once")
+@click.option('--prune', is_flag=True, help="Remove installed services that are not in the manifest")
+@click.option('--force', is_flag=True, help="Redeploy and rebuild every app even if nothing has changed since the last deployment")
+def apply(manifest, workers, prune, force):
+    try:
+        apps = portinus.fleet.load_manifest(manifest)
+    except ValueError as e:
+        click.echo("Invalid manifest: {}".format(e))
+        sys.exit(1)
+    results = portinus.fleet.apply(apps, workers=workers, prune=prune, force=force)
+    for result in results:
+        click.echo(str(result))
+    if any(x.failed for x in results):
+        sys.exit(1)
 
 
 @task.command()
@@ -83,18 +147,35 @@ def ps(name):
 @click.argument('name', required=True)
 def status(name):
     application = portinus.Application(name)
+    click.echo("Monitor: {}".format(portinus.monitor.State.load(name).describe()))
     application.service.compose(['ps'])
 
 @task.command()
-def list():
+@click.option('-l', '--long', is_flag=True, help="Show the state of each service's systemd units, its last monitor result and when it was deployed")
+@click.option('--json', 'as_json', is_flag=True, help="Show the same as --long, as JSON")
+def list(long, as_json):
+    if not long and not as_json:
+        try:
+            portinus.list()
+        except FileNotFoundError:
+            pass
+        return
+
     try:
-        portinus.list()
-    except FileNotFoundError:
-        pass
+        statuses = portinus.inventory.get_statuses()
+    except (FileNotFoundError, portinus.systemd.SystemdError) as e:
+        click.echo("Unable to get the state of the services from systemd: {error}".format(error=e), err=True)
+        sys.exit(1)
+    if as_json:
+        click.echo(portinus.inventory.format_json(statuses))
+    else:
+        click.echo(portinus.inventory.format_table(statuses))
 
 @task.command()
+@click.option('-l', '--long', is_flag=True, help="Show the state of each service's systemd units, its last monitor result and when it was deployed")
+@click.option('--json', 'as_json', is_flag=True, help="Show the same as --long, as JSON")
 @click.pass_context
-def ls(ctx):
+def ls(ctx, long, as_json):
     ctx.forward(list)
 
 
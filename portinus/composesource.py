@@ -1,19 +1,29 @@
 from operator import attrgetter
 import logging
 import os
-import shutil
+import re
 
 import portinus
 
 log = logging.getLogger(__name__)
 
+IGNORE_FILE = ".portinusignore"
+
 class ComposeSource(object):
 
-    def __init__(self, name, source=None):
+    def __init__(self, name, source=None, snapshot=portinus.sync.COPY, keep_releases=portinus.releases.DEFAULT_KEEP, exclude=()):
+        if snapshot not in portinus.sync.SNAPSHOT_MODES:
+            raise ValueError("Invalid snapshot mode '{}'".format(snapshot))
         self.name = name
         self.source = source
+        self.snapshot = snapshot
+        self.exclude = tuple(exclude)
         self.path = portinus.get_instance_dir(name)
+        self.releases = portinus.releases.Releases(name, keep=keep_releases)
+        self.staging_path = self.releases.staging_path
+        self.object_store = portinus.sync.ObjectStore(self.path.parent.joinpath(".objects"))
         self.service_script = self.path.joinpath(name)
+        self.project_name = re.sub(r'[^a-z0-9]', '', name.lower())
         log.debug("Initialized ComposeSource for '{name}' from source: '{source}'".format(name=name, source=source))
 
     source = property(attrgetter('_source'))
@@ -29,25 +39,75 @@ class ComposeSource(object):
                 raise(e)
         self._source = value
 
-    def _ensure_service_script(self):
-        service_script_template = portinus.template_dir.joinpath("service-script")
-        shutil.copy(str(service_script_template), str(self.service_script))
-        os.chmod(str(self.service_script), 0o755)
+    def get_ignore_rules(self):
+        """
+        Returns the paths of the source that are left out of the deployment:
+        the gitignore style patterns in its .portinusignore file, followed by
+        the 'exclude' patterns
+        """
+        rules = portinus.ignore.IgnoreRules(self.exclude, gitignore=True)
+        if self.source:
+            rules = portinus.ignore.IgnoreRules.load(os.path.join(self.source, IGNORE_FILE), gitignore=True) + rules
+        return rules
 
-    def ensure(self):
+    def _generate_service_script(self):
+        template = portinus.get_template("service-script")
+        return template.render(project_name=self.project_name)
+
+    def _ensure_service_script(self, path):
+        service_script = path.joinpath(self.service_script.name)
+        # Written to a new file and moved into place, as the old one may be
+        # hardlinked from the object store
+        temporary_path = path.joinpath(".portinus-script-" + self.service_script.name)
+        with temporary_path.open("w") as f:
+            f.write(self._generate_service_script())
+        os.chmod(str(temporary_path), 0o755)
+        os.replace(str(temporary_path), str(service_script))
+        return service_script
+
+    def stage(self):
+        """
+        Sync the source files into a staging directory next to the live one,
+        so they can be built without touching the running deployment. Returns
+        the path to the staged service script
+        """
         if not self.source:
             log.error("No valid source specified")
             raise(IOError("No valid source specified"))
-        log.info("Copying source files for '{self.name}' to '{self.path}'")
-        self.remove()
-        shutil.copytree(str(self.source), str(self.path), symlinks=True, copy_function=shutil.copy)
-        self._ensure_service_script()
-        log.debug("Successfully copied source files")
+        migrated = self.releases.migrate()
+        if migrated is not None:
+            self._ensure_service_script(self.releases.path.joinpath(migrated))
+        self.releases.prepare_staging()
+        log.info("Syncing source files for '{name}' to '{path}'".format(name=self.name, path=self.staging_path))
+        stats = portinus.sync.sync_tree(self.source, self.staging_path,
+                                        keep=[self.service_script.name],
+                                        snapshot=self.snapshot, object_dir=self.object_store.path,
+                                        ignore=self.get_ignore_rules())
+        log.debug("Successfully synced source files: {stats}".format(stats=stats))
+        return self._ensure_service_script(self.staging_path)
+
+    def switch(self, metadata=None):
+        """
+        Make the staged source files a new release and atomically switch the
+        instance directory over to it. Returns the ID of the new release
+        """
+        log.info("Switching '{path}' to the staged source files".format(path=self.path))
+        release = self.releases.commit(metadata)
+        self._collect_objects()
+        return release
+
+    def ensure(self):
+        self.stage()
+        self.switch()
 
     def remove(self):
         log.info("Removing source files for '{name}' from '{path}'".format(name=self.name, path=self.path))
-        try:
-            shutil.rmtree(str(self.path))
+        if self.releases.remove():
             log.debug("Successfully removed source files")
-        except FileNotFoundError:
+        else:
             log.debug("No source files found")
+        self._collect_objects()
+
+    def _collect_objects(self):
+        if os.path.isdir(self.object_store.path):
+            self.object_store.collect()
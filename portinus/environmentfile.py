@@ -9,11 +9,19 @@ log = logging.getLogger(__name__)
 
 
 class EnvironmentFile(object):
+    """
+    The environment file of a service. Each release keeps its own copy next
+    to it, outside of the build context, so a failed build never changes the
+    environment of the running release and a rollback brings back the
+    environment the release was deployed with. The installed path is a
+    symlink to the copy of the active release
+    """
 
     def __init__(self, name, source_environment_file=None):
         self.name = name
         self._source_environment_file = source_environment_file
         self.path = pathlib.Path("{}.environment".format(portinus.get_instance_dir(self.name)))
+        self._releases = portinus.releases.Releases(name)
         log.debug("Initialized EnvironmentFile for '{name}' from source: '{source_environment_file}'".format(name=name, source_environment_file=source_environment_file))
 
         if source_environment_file:
@@ -24,15 +32,63 @@ class EnvironmentFile(object):
                 log.error("Unable to access the specified environment file ({source_environment_file})".format(source_environment_file=source_environment_file))
                 raise(e)
 
+    @property
+    def source(self):
+        return self._source_environment_file
+
     def __bool__(self):
         return bool(self._source_environment_file)
 
-    def ensure(self):
+    def read(self, path=None):
+        """
+        Returns the variables defined in the installed environment file, or
+        the one at 'path'
+        """
+        variables = read_file(path or self.path)
+        if variables is None:
+            log.debug("No environment file found for {name}".format(name=self.name))
+        return variables or {}
+
+    def stage(self):
+        """
+        Copy the environment file next to the staged release, or remove the
+        staged copy if there is none. The installed environment file is left
+        as it is. Returns the path of the staged copy
+        """
+        staged_path = self._releases.staging_environment_path
         if self:
-            log.info("Creating/updating environment file for '{name}' at '{path}'".format(name=self.name, path=self.path))
-            shutil.copy(str(self._source_environment_file), str(self.path))
+            log.info("Staging environment file for '{name}' at '{path}'".format(name=self.name, path=staged_path))
+            staged_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = staged_path.with_name(staged_path.name + ".tmp")
+            shutil.copy(str(self._source_environment_file), str(temporary_path))
+            os.replace(str(temporary_path), str(staged_path))
         else:
-            self.remove()
+            try:
+                os.remove(str(staged_path))
+            except FileNotFoundError:
+                pass
+        return staged_path
+
+    def ensure(self):
+        """
+        Point the installed environment file at the copy of the active
+        release, or remove it if that release has none
+        """
+        release = self._releases.active()
+        release_path = self._releases.get_environment_path(release) if release else None
+        if release_path is None or not release_path.exists():
+            if os.path.islink(str(self.path)):
+                self.remove()
+            return
+        target = os.path.relpath(str(release_path), str(self.path.parent))
+        if os.path.islink(str(self.path)) and os.readlink(str(self.path)) == target:
+            return
+        log.info("Linking environment file for '{name}' at '{path}'".format(name=self.name, path=self.path))
+        temporary_path = self.path.with_name(self.path.name + ".link")
+        if os.path.lexists(str(temporary_path)):
+            os.remove(str(temporary_path))
+        os.symlink(target, str(temporary_path))
+        os.replace(str(temporary_path), str(self.path))
 
     def remove(self):
         log.info("Removing environment file for {name}".format(name=self.name))
@@ -41,3 +97,22 @@ class EnvironmentFile(object):
             log.debug("Sucessfully removed environment file")
         except FileNotFoundError:
             log.debug("No environment file found")
+
+
+def read_file(path):
+    """
+    Returns the variables defined in the environment file at 'path', or None
+    if there is no such file
+    """
+    variables = {}
+    try:
+        with open(str(path)) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                variables[key.strip()] = value.strip().strip("'\"")
+    except FileNotFoundError:
+        return None
+    return variables
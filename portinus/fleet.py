@@ -0,0 +1,150 @@
+import logging
+import os
+import time
+
+import portinus
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+APP_KEYS = ("name", "source", "env", "restart", "monitor", "snapshot", "keep_releases", "exclude")
+
+
+class AppResult(object):
+    """
+    The outcome of applying a single app from a manifest
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.action = None
+        self.error = None
+        self.duration = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def __str__(self):
+        if self.error is not None:
+            status = "failed ({error})".format(error=self.error)
+        else:
+            status = self.action
+        if self.duration is not None:
+            status += " in {duration:.2f}s".format(duration=self.duration)
+        return "{name}: {status}".format(name=self.name, status=status)
+
+
+def load_manifest(path):
+    """
+    Returns the apps listed in a fleet manifest. Relative source and env paths
+    are resolved against the directory the manifest is in. For example:
+
+        apps:
+          - name: foo
+            source: ./foo
+            env: ./foo.env
+            restart: daily
+            snapshot: link
+            keep_releases: 5
+            exclude:
+              - .git/
+              - node_modules/
+            monitor:
+              remediation: service
+    """
+    import yaml
+
+    with open(path) as f:
+        try:
+            manifest = yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(str(e))
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("apps"), list):
+        raise ValueError("The manifest must contain a list of 'apps'")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    apps = []
+    names = set()
+    for app in manifest["apps"]:
+        if not isinstance(app, dict) or not app.get("name"):
+            raise ValueError("Every app needs a 'name': {app}".format(app=app))
+        unknown = sorted(set(app) - set(APP_KEYS))
+        if unknown:
+            raise ValueError("Unknown settings for {name}: {unknown}".format(name=app["name"], unknown=", ".join(unknown)))
+        if app["name"] in names:
+            raise ValueError("{name} is listed more than once".format(name=app["name"]))
+        if not app.get("source"):
+            raise ValueError("No source specified for {name}".format(name=app["name"]))
+        if not isinstance(app.get("exclude", []), list):
+            raise ValueError("'exclude' must be a list of patterns for {name}".format(name=app["name"]))
+        names.add(app["name"])
+
+        app = dict(app)
+        for key in ("source", "env"):
+            if app.get(key):
+                app[key] = os.path.normpath(os.path.join(base_dir, os.path.expanduser(app[key])))
+        apps.append(app)
+    return apps
+
+
+def apply(apps, workers=DEFAULT_WORKERS, prune=False, force=False):
+    """
+    Ensure every app from a manifest with at most 'workers' deployments
+    running at once. A failing app is reported in its result instead of
+    stopping the others. With 'prune', installed services that are not in
+    the manifest are removed. Returns the results in manifest order, followed
+    by any pruned services.
+
+    Each app is deployed in its own systemd transaction, so that a service is
+    never left stopped while the rest of the fleet builds. Pruned services
+    share one transaction
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    prune_transaction = portinus.systemd.Transaction()
+    try:
+        futures = [executor.submit(_timed, app["name"], _ensure, app, force) for app in apps]
+        if prune:
+            names = set(x["name"] for x in apps)
+            futures += [executor.submit(_timed, x, _remove, x, prune_transaction) for x in portinus.get_service_names() if x not in names]
+        results = [x.result() for x in futures]
+    finally:
+        executor.shutdown(wait=True)
+    prune_transaction.commit()
+    return results
+
+
+def _ensure(app, force):
+    application = portinus.Application(app["name"],
+                                        source=app["source"],
+                                        environment_file=app.get("env"),
+                                        restart_schedule=app.get("restart"),
+                                        monitor_settings=app.get("monitor"),
+                                        snapshot=app.get("snapshot"),
+                                        keep_releases=app.get("keep_releases"),
+                                        exclude=app.get("exclude", ()))
+    if application.ensure(force=force):
+        return "deployed"
+    return "unchanged"
+
+
+def _remove(name, transaction):
+    portinus.Application(name).remove(transaction)
+    return "removed"
+
+
+def _timed(name, function, *args):
+    result = AppResult(name)
+    start = time.monotonic()
+    try:
+        result.action = function(*args)
+    except Exception as e:
+        log.exception("Failed to apply {name}".format(name=name))
+        result.error = e
+    result.duration = time.monotonic() - start
+    log.info(str(result))
+    return result
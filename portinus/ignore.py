@@ -0,0 +1,110 @@
+import os
+import re
+
+
+class IgnoreRules(object):
+    """
+    Path patterns in the .dockerignore format. Patterns are relative to the
+    root of the tree, '*' and '?' do not match '/', '**' matches any number of
+    directories and a line starting with '!' re-includes paths excluded by an
+    earlier pattern. When several patterns match a path the last one wins,
+    and a pattern that matches a directory also matches everything in it.
+
+    With 'gitignore', patterns follow .gitignore instead: a pattern without a
+    '/' matches at any depth, a leading '/' anchors it to the root and a
+    trailing '/' only matches directories
+    """
+
+    def __init__(self, patterns=(), gitignore=False):
+        self._rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            exception = pattern.startswith("!")
+            if exception:
+                pattern = pattern[1:].strip()
+            directory_only = gitignore and pattern.endswith("/")
+            if gitignore and "/" not in pattern.rstrip("/"):
+                pattern = "**/" + pattern
+            pattern = os.path.normpath(pattern).lstrip("/")
+            if pattern and pattern != ".":
+                self._rules.append((_translate(pattern), exception, directory_only))
+
+    @classmethod
+    def load(cls, path, gitignore=False):
+        """
+        Returns the rules from the file at 'path', or no rules if it does not
+        exist
+        """
+        try:
+            with open(str(path)) as f:
+                return cls(f.read().splitlines(), gitignore=gitignore)
+        except FileNotFoundError:
+            return cls()
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def __add__(self, other):
+        rules = IgnoreRules()
+        rules._rules = self._rules + other._rules
+        return rules
+
+    @property
+    def has_exceptions(self):
+        """
+        Whether any pattern re-includes paths, in which case an ignored
+        directory may still contain paths that are not ignored
+        """
+        return any(exception for regex, exception, directory_only in self._rules)
+
+    def ignored(self, path, is_dir=False):
+        """
+        Returns True if 'path', relative to the root of the tree, is ignored.
+        'is_dir' says whether 'path' is a directory
+        """
+        path = os.path.normpath(path)
+        parents = [path]
+        while os.path.dirname(parents[-1]):
+            parents.append(os.path.dirname(parents[-1]))
+
+        ignored = False
+        for regex, exception, directory_only in self._rules:
+            candidates = parents if is_dir or not directory_only else parents[1:]
+            if any(regex.match(x) for x in candidates):
+                ignored = not exception
+        return ignored
+
+
+def _translate(pattern):
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        character = pattern[i]
+        if character == "*":
+            if pattern[i + 1:i + 2] == "*":
+                i += 1
+                if pattern[i + 1:i + 2] == "/":
+                    i += 1
+                    regex += "(.*/)?"
+                else:
+                    regex += ".*"
+            else:
+                regex += "[^/]*"
+        elif character == "?":
+            regex += "[^/]"
+        elif character == "[" and pattern.find("]", i + 1) != -1:
+            end = pattern.find("]", i + 1)
+            characters = pattern[i + 1:end].replace("\\", "\\\\")
+            if characters.startswith(("!", "^")):
+                characters = "^" + characters[1:]
+            regex += "[" + characters + "]"
+            i = end
+        elif character == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(character)
+        i += 1
+    return re.compile("^" + regex + "$")
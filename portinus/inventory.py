@@ -0,0 +1,127 @@
+import json
+import logging
+import time
+
+import portinus
+
+log = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+COLUMNS = (
+    ("NAME", "name"),
+    ("SERVICE", "service"),
+    ("ENABLED", "enabled"),
+    ("RESTART TIMER", "restart_timer"),
+    ("MONITOR", "monitor"),
+    ("LAST CHECK", "last_check"),
+    ("RELEASE", "release"),
+    ("DEPLOYED", "deployed"),
+)
+
+
+class ServiceStatus(object):
+    """
+    What systemd, the monitor and the releases say about an installed service
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.service = None
+        self.enabled = None
+        self.restart_timer = None
+        self.monitor = None
+        self.monitor_result = None
+        self.monitor_result_since = None
+        self.release = None
+        self.deployed = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "service": self.service,
+            "enabled": self.enabled,
+            "restart_timer": self.restart_timer,
+            "monitor": self.monitor,
+            "monitor_result": self.monitor_result,
+            "monitor_result_since": self.monitor_result_since,
+            "release": self.release,
+            "deployed": self.deployed,
+        }
+
+    def to_row(self):
+        """
+        Returns the value of each of the COLUMNS as text
+        """
+        values = dict(self.to_dict(), deployed=_format_time(self.deployed), last_check=None)
+        if self.monitor_result:
+            values["last_check"] = "{result} since {since}".format(result=self.monitor_result, since=_format_time(self.monitor_result_since))
+        return [values[key] or "-" for title, key in COLUMNS]
+
+
+def get_unit_names(name):
+    """
+    Returns the names of the service, restart timer and monitor timer units
+    of the named service
+    """
+    service_name = portinus.service.get_service_name(name)
+    return service_name + ".service", service_name + "-restart.timer", service_name + "-monitor.timer"
+
+
+def get_statuses(names=None):
+    """
+    Returns a ServiceStatus for each of the named services, or every
+    installed service. The state of all of their systemd units is fetched in
+    one query
+    """
+    if names is None:
+        names = portinus.get_service_names()
+    host_monitor_units = (portinus.monitor.daemon_name + ".service", "portinus-monitor.timer")
+    unit_names = [x for name in names for x in get_unit_names(name)] + list(host_monitor_units)
+    units = portinus.systemd.get_backend().get_unit_states(unit_names)
+    host_monitor = any(units[x]["load"] == "loaded" for x in host_monitor_units)
+
+    statuses = []
+    for name in names:
+        status = ServiceStatus(name)
+        service, restart_timer, monitor_timer = (units[x] for x in get_unit_names(name))
+        if service["load"] == "loaded":
+            status.service = "{active} ({sub})".format(active=service["active"], sub=service["sub"])
+            status.enabled = service["enabled"]
+        else:
+            status.service = service["load"]
+        if restart_timer["load"] == "loaded":
+            status.restart_timer = restart_timer["active"]
+        if monitor_timer["load"] == "loaded":
+            status.monitor = monitor_timer["active"]
+        elif host_monitor:
+            status.monitor = "host"
+
+        state = portinus.monitor.State.load(name)
+        status.monitor_result = state.result
+        status.monitor_result_since = state.result_since
+
+        releases = portinus.releases.Releases(name)
+        status.release = releases.active()
+        if status.release is not None:
+            status.deployed = releases.load_metadata(status.release).get("deployed")
+        statuses.append(status)
+    return statuses
+
+
+def format_table(statuses):
+    """
+    Returns the statuses as a table with a column for each of the COLUMNS
+    """
+    rows = [[title for title, key in COLUMNS]] + [x.to_row() for x in statuses]
+    widths = [max(len(x[i]) for x in rows) for i in range(len(COLUMNS))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def format_json(statuses):
+    return json.dumps([x.to_dict() for x in statuses], indent=2, sort_keys=True)
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return None
+    return time.strftime(TIME_FORMAT, time.localtime(timestamp))
@@ -1,46 +1,223 @@
+import hashlib
 import logging
-from subprocess import check_output
+import os
+import shutil
+from functools import lru_cache
 
 import portinus
-
-import systemd_unit
-from . import checker
+from . import checker, daemon, engine, metrics
+from .policy import DEFAULTS, Policy
+from .state import State
 
 log = logging.getLogger(__name__)
 
+daemon_name = "portinus-monitor-daemon"
+
+# Each check is delayed by up to this fraction of the interval so that
+# services sharing an offset still do not fire together
+RANDOMIZED_DELAY_FACTOR = 10
+
+
+@lru_cache(maxsize=None)
+def get_portinus_monitor_path():
+    """
+    Returns the full path to the portinus-monitor executable. It is only
+    looked up once per process
+    """
+    portinus_monitor_path = shutil.which("portinus-monitor")
+    if portinus_monitor_path is None:
+        raise FileNotFoundError("Unable to find portinus-monitor in the PATH")
+    return portinus_monitor_path
+
+
+def host_monitor_installed():
+    """
+    Returns True if all services are monitored from a single host-wide unit,
+    either the monitor daemon or the host monitor timer
+    """
+    return Daemon().exists() or Service().exists()
+
+
+def enable_daemon(interval=300):
+    """
+    Install the monitor daemon and remove the per-service monitor timers that
+    it replaces
+    """
+    Daemon(interval).ensure()
+    _remove_service_timers()
+
+
+def disable_daemon():
+    """
+    Remove the monitor daemon and restore the per-service monitor timers
+    """
+    Daemon().remove()
+    _restore_service_timers()
+
+
+def enable_host_timer(interval=None):
+    """
+    Install a single timer that checks every service in one pass and remove
+    the per-service monitor timers that it replaces
+    """
+    Service(interval=interval).ensure()
+    _remove_service_timers()
+
+
+def disable_host_timer():
+    """
+    Remove the host monitor timer and restore the per-service monitor timers
+    """
+    Service().remove()
+    _restore_service_timers()
+
+
+def _remove_service_timers():
+    with portinus.systemd.Transaction() as transaction:
+        for name in portinus.get_service_names():
+            Service(name).remove(transaction)
+
+
+def _restore_service_timers():
+    with portinus.systemd.Transaction() as transaction:
+        for name in portinus.get_service_names():
+            Service(name).ensure(transaction)
+
+
+class Daemon(object):
+
+    def __init__(self, interval=300):
+        self.interval = interval
+        self._systemd_service = portinus.systemd.Unit(daemon_name)
+
+    def exists(self):
+        return os.path.exists(str(self._systemd_service.service_file_path))
+
+    def _generate_service_file(self):
+        template = portinus.get_template("monitor-daemon.service")
+
+        return template.render(
+                interval=self.interval,
+                portinus_monitor_path=get_portinus_monitor_path()
+                )
+
+    def ensure(self):
+        log.info("Creating/updating the monitor daemon")
+        self._systemd_service.ensure(content=self._generate_service_file())
+
+    def remove(self):
+        log.info("Removing the monitor daemon")
+        self._systemd_service.remove()
+
 
 class Service(object):
+    """
+    The monitor timer for the named service. Without a name this is the host
+    monitor timer, which checks every service at once every 'interval'
+    seconds. Named services are checked as often as their Policy says
+    """
 
-    def __init__(self, name):
+    def __init__(self, name=None, interval=None):
         self.name = name
-        systemd_service_name = portinus.Service(name).service_name
-        self._systemd_service = systemd_unit.Unit(systemd_service_name + "-monitor")
-        self._systemd_timer = systemd_unit.Unit(systemd_service_name + "-monitor", type="timer")
-        pass
+        self.interval = interval
+        if name:
+            systemd_service_name = portinus.service.get_service_name(name)
+        else:
+            systemd_service_name = "portinus"
+        self._systemd_service = portinus.systemd.Unit(systemd_service_name + "-monitor")
+        self._systemd_timer = portinus.systemd.Unit(systemd_service_name + "-monitor", type="timer")
+
+    def exists(self):
+        return os.path.exists(str(self._systemd_timer.service_file_path))
 
     def _generate_service_file(self):
         template = portinus.get_template("monitor.service")
-        portinus_monitor_path = check_output(["which", "portinus-monitor"])
-        portinus_monitor_path = portinus_monitor_path.decode().strip("\n")
 
         return template.render(
                 name=self.name,
-                portinus_monitor_path=portinus_monitor_path
+                portinus_monitor_path=get_portinus_monitor_path()
                 )
 
-    def _generate_timer_file(self):
+    def get_interval(self, state=None):
+        """
+        Returns how often, in seconds, the monitor timer should fire
+        """
+        if not self.name:
+            return self.interval or DEFAULTS["interval"]
+        state = state or State.load(self.name)
+        return Policy.load(self.name).get_interval(state)
+
+    def get_offset(self, interval):
+        """
+        Returns how long, in seconds, the timer waits before its first check.
+        This is derived from the name so that every service's checks land at
+        a different, but stable, point in the interval
+        """
+        if not self.name:
+            return interval
+        digest = hashlib.sha1(self.name.encode()).hexdigest()
+        return 1 + int(digest, 16) % interval
+
+    def _generate_timer_file(self, interval=None):
         template = portinus.get_template("monitor.timer")
+        interval = interval or self.get_interval()
 
         return template.render(
                 name=self.name,
+                interval=interval,
+                offset=self.get_offset(interval),
+                randomized_delay=interval // RANDOMIZED_DELAY_FACTOR,
                 )
 
-    def ensure(self):
+    def _ensure_timer(self, transaction, state=None):
+        interval = self.get_interval(state)
+        transaction.ensure(self._systemd_timer, content=self._generate_timer_file(interval))
+        return interval
+
+    def record_deploy(self):
+        """
+        Record that the service has just been deployed, so that adaptive
+        scheduling checks it more often for a while
+        """
+        state = State.load(self.name)
+        state.record_event()
+        state.save()
+
+    def reschedule(self):
+        """
+        Rewrite the monitor timer if the service's check interval has changed
+        since the timer was last written. Returns True if it was rewritten
+        """
+        if not self.exists():
+            return False
+        state = State.load(self.name)
+        interval = self.get_interval(state)
+        if interval == state.scheduled_interval:
+            return False
+
+        log.info("Rescheduling {name} monitor timer to every {interval} seconds".format(name=self.name, interval=interval))
+        with portinus.systemd.Transaction() as transaction:
+            state.scheduled_interval = self._ensure_timer(transaction, state)
+        state.save()
+        return True
+
+    def ensure(self, transaction=None):
+        if self.name and host_monitor_installed():
+            log.info("A host-wide monitor is installed. Removing any existing {name} monitor timer".format(name=self.name))
+            self.remove(transaction)
+            return
         log.info("Creating/updating {name} monitor timer".format(name=self.name))
-        self._systemd_service.ensure(content=self._generate_service_file(), restart=False, enable=False)
-        self._systemd_timer.ensure(content=self._generate_timer_file())
+        with portinus.systemd.transaction(transaction) as t:
+            t.ensure(self._systemd_service, content=self._generate_service_file(), restart=False, enable=False)
+            if not self.name:
+                self._ensure_timer(t)
+                return
+            state = State.load(self.name)
+            state.scheduled_interval = self._ensure_timer(t, state)
+        state.save()
 
-    def remove(self):
+    def remove(self, transaction=None):
         log.info("Removing {name} monitor timer".format(name=self.name))
-        self._systemd_timer.remove()
-        self._systemd_service.remove()
+        with portinus.systemd.transaction(transaction) as t:
+            t.remove(self._systemd_timer)
+            t.remove(self._systemd_service)
@@ -1,27 +1,190 @@
-import docker
 import logging
 import os
+import re
 import subprocess
 import sys
+import time
 
 import portinus
+from . import engine
+from .policy import Policy
+from .result import CheckResult
+from .state import State
 
 log = logging.getLogger(__name__)
 
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+# Seconds a docker API call may take, so that a check stuck on an
+# unresponsive daemon eventually ends even after the engine gives up on it
+DOCKER_TIMEOUT = 30
+
+_client = None
+
+
+def get_client():
+    """
+    Returns a docker client shared by every check made from this process
+    """
+    global _client
+    if _client is None:
+        import docker
+        _client = docker.from_env(timeout=DOCKER_TIMEOUT)
+    return _client
+
+
+def get_project_name(name, environment_file_path=None):
+    """
+    Returns the docker-compose project name for the named service. This is
+    COMPOSE_PROJECT_NAME from the installed environment file, or the one at
+    'environment_file_path', if set, otherwise the instance directory name
+    normalised the same way docker-compose does it
+    """
+    project_name = portinus.EnvironmentFile(name).read(environment_file_path).get("COMPOSE_PROJECT_NAME")
+    if not project_name:
+        project_name = portinus.get_instance_dir(name).name
+    return re.sub(r'[^a-z0-9]', '', project_name.lower())
+
 
 def run(name):
-    service = portinus.Service(name)
+    return run_one(name).healthy
+
+
+def run_one(name):
+    """
+    Check the named service on its own. Returns its CheckResult
+    """
+    import docker
+
+    start = time.monotonic()
     monitored_compose_containers = get_monitored_compose_containers(name)
+    result = check(name, monitored_compose_containers)
+    try:
+        result.containers = len(get_project_container_ids(name))
+    except docker.errors.DockerException as e:
+        log.debug("Unable to count the containers for {name}: {error}".format(name=name, error=e))
+    result.duration = time.monotonic() - start
+    if result.healthy:
+        print("No unhealthy containers found")
+    portinus.monitor.Service(name).reschedule()
+    return result
+
 
-    for container in monitored_compose_containers:
+def run_all(concurrency=engine.DEFAULT_CONCURRENCY, timeout=engine.DEFAULT_TIMEOUT):
+    """
+    Check every installed service using a single container listing from the
+    docker daemon. Services are checked concurrently and any restarts run
+    alongside the remaining checks. Returns a CheckResult for each service
+    """
+    client = get_client()
+    projects = {}
+    for container in client.api.containers(filters={"label": PROJECT_LABEL}):
+        projects.setdefault(container["Labels"][PROJECT_LABEL], []).append(container)
+
+    def check_service(name):
+        containers = projects.get(get_project_name(name), [])
+        unhealthy_containers = [client.containers.get(x["Id"]) for x in containers if "(unhealthy)" in x["Status"]]
+        result = inspect(name, unhealthy_containers)
+        result.containers = len(containers)
+        if result.healthy:
+            record_healthy(name)
+        return result
+
+    return engine.run(portinus.get_service_names(), check_service, remediate,
+                      concurrency=concurrency, timeout=timeout)
+
+
+def check(name, containers):
+    """
+    Restart the named service if any of the given containers are unhealthy
+    """
+    result = inspect(name, containers)
+    if result.unhealthy:
+        remediate(result)
+    else:
+        record_healthy(name)
+    return result
+
+
+def inspect(name, containers):
+    """
+    Returns a CheckResult listing which of the given containers are unhealthy
+    """
+    result = CheckResult(name)
+    result.containers = len(containers)
+
+    for container in containers:
         log.debug("Checking container {container_id}, name: '{name}'".format(container_id=container.id, name=container.attrs['Name']))
         if not check_container_health(container):
-            log.info("Container {container_id}, name: '{container_name}'. Restarting stack for {name}".format(container_id=container.id, container_name=container.attrs['Name'], name=name))
-            print("Container '{container_name} found unhealthy. Restarting the {name} stack...".format(container_name=container.attrs['Name'], name=name))
-            service.restart()
-            return False
-    print("No unhealthy containers found")
-    return True
+            result.unhealthy.append(container.attrs['Name'])
+            labels = container.attrs.get('Config', {}).get('Labels') or {}
+            compose_service = labels.get(SERVICE_LABEL)
+            if compose_service and compose_service not in result.unhealthy_services:
+                result.unhealthy_services.append(compose_service)
+    return result
+
+
+def remediate(result):
+    """
+    Act on an unhealthy service according to its monitor policy. Unless the
+    policy is to restart the whole stack, only the unhealthy compose services
+    are restarted or recreated, escalating to a stack restart once they have
+    failed more than 'escalate_after' checks in a row. Nothing is restarted
+    while the restart circuit breaker is open
+    """
+    policy = Policy.load(result.name)
+    state = State.load(result.name)
+    service = portinus.Service(result.name)
+    state.record_event()
+    state.record_result("unhealthy ({containers})".format(containers=", ".join(result.unhealthy)))
+
+    if not state.allow_restart(policy):
+        log.warning("Not restarting {name}: {description}".format(name=result.name, description=state.describe()))
+        print("Unhealthy containers found in {name}, but {description}".format(name=result.name, description=state.describe()))
+        result.action = "nothing, restarts are paused"
+        state.save()
+        return
+
+    state.record_restart(policy)
+    if policy.remediation != "stack" and result.unhealthy_services:
+        failures = state.record_failures(result.unhealthy_services)
+        if failures <= policy.escalate_after:
+            if _remediate_compose_services(service, policy.remediation, result.unhealthy_services) == 0:
+                state.save()
+                result.restarted = True
+                result.action = "{remediation} {services}".format(remediation=policy.remediation, services=", ".join(result.unhealthy_services))
+                return
+            log.warning("Failed to {remediation} {services} for {name}".format(remediation=policy.remediation, services=result.unhealthy_services, name=result.name))
+        else:
+            log.info("{services} for {name} failed {failures} checks in a row".format(services=result.unhealthy_services, name=result.name, failures=failures))
+        state.failures = {}
+
+    state.save()
+    log.info("Containers {containers} are unhealthy. Restarting stack for {name}".format(containers=result.unhealthy, name=result.name))
+    print("Container '{container_name} found unhealthy. Restarting the {name} stack...".format(container_name=result.unhealthy[0], name=result.name))
+    service.restart()
+    result.restarted = True
+    result.action = "stack"
+
+
+def record_healthy(name):
+    """
+    Forget any previous failures of a service that is now healthy
+    """
+    state = State.load(name)
+    changed = state.record_healthy()
+    if state.record_result("healthy") or changed:
+        state.save()
+
+
+def _remediate_compose_services(service, remediation, compose_services):
+    log.info("Running {remediation} on {services} for {name}".format(remediation=remediation, services=compose_services, name=service.name))
+    print("Services {services} found unhealthy. Running {remediation} on them for {name}...".format(services=", ".join(compose_services), remediation=remediation, name=service.name))
+    if remediation == "recreate":
+        command = ["up", "-d", "--no-deps", "--force-recreate"]
+    else:
+        command = ["restart"]
+    return service.compose(command + compose_services)
 
 
 def check_container_health(container):
@@ -30,19 +193,59 @@ def check_container_health(container):
 
 
 def get_monitored_compose_containers(name):
-    compose_container_ids = get_compose_container_ids(name)
-    monitored_containers = get_monitored_containers()
+    """
+    Returns the unhealthy containers belonging to the named service. Only the
+    containers reported as unhealthy by the docker daemon are inspected
+    """
+    import docker
+
+    unhealthy_container_ids = get_unhealthy_container_ids()
+    if not unhealthy_container_ids:
+        return []
+
+    client = get_client()
+    compose_container_ids = set(get_compose_container_ids(name))
     monitored_compose_containers = []
 
-    for container_id in compose_container_ids:
-        valid_container = next((x for x in monitored_containers if x.id == container_id), None)
-        if valid_container: monitored_compose_containers.append(valid_container)
+    for container_id in unhealthy_container_ids:
+        if container_id not in compose_container_ids:
+            continue
+        try:
+            monitored_compose_containers.append(client.containers.get(container_id))
+        except docker.errors.NotFound:
+            log.debug("Container {container_id} no longer exists".format(container_id=container_id))
 
-    log.debug("Found {count} monitored containers from docker-compose".format(count=len(monitored_compose_containers)))
+    log.debug("Found {count} unhealthy containers from docker-compose".format(count=len(monitored_compose_containers)))
     return monitored_compose_containers
 
 
 def get_compose_container_ids(name):
+    import docker
+
+    try:
+        container_ids = get_project_container_ids(name)
+    except docker.errors.DockerException as e:
+        log.warning("Failed to list containers by label for {name}: {error}".format(name=name, error=e))
+        container_ids = []
+
+    if not container_ids:
+        log.debug("Falling back to docker-compose to find the containers for {name}".format(name=name))
+        container_ids = get_compose_ps_container_ids(name)
+    return container_ids
+
+
+def get_project_container_ids(name):
+    client = get_client()
+    label = "{label}={project}".format(label=PROJECT_LABEL, project=get_project_name(name))
+
+    containers = client.api.containers(all=True, quiet=True, filters={"label": label})
+    container_ids = [x["Id"] for x in containers]
+
+    log.debug("Found {count} total containers with label '{label}'".format(count=len(container_ids), label=label))
+    return container_ids
+
+
+def get_compose_ps_container_ids(name):
     compose_source = portinus.ComposeSource(name)
     service_script = str(compose_source.service_script)
 
@@ -55,16 +258,11 @@ def get_compose_container_ids(name):
     return filtered_container_list
 
 
-def get_monitored_containers():
-    client = docker.from_env()
-
-    all_containers = client.containers.list()
-
-    monitored_containers = []
+def get_unhealthy_container_ids():
+    client = get_client()
 
-    for container in all_containers:
-        if 'Health' in container.attrs['State']:
-            monitored_containers.append(container)
+    containers = client.api.containers(filters={"health": "unhealthy"})
+    container_ids = [x["Id"] for x in containers]
 
-    log.debug("Found {count} monitored containers from docker".format(count=len(monitored_containers)))
-    return monitored_containers
+    log.debug("Found {count} unhealthy containers from docker".format(count=len(container_ids)))
+    return container_ids
@@ -21,13 +21,82 @@ def task(verbose):
 
 
 @task.command()
-@click.option('--name', required=True, help="The name of the service to remove")
-def check(name):
+@click.option('--name', help="The name of the service to check")
+@click.option('--all', 'check_all', is_flag=True, help="Check every installed service in one pass")
+@click.option('--concurrency', type=click.IntRange(min=1), default=portinus.monitor.engine.DEFAULT_CONCURRENCY, show_default=True, help="How many services to check at once with --all")
+@click.option('--timeout', type=click.IntRange(min=1), default=portinus.monitor.engine.DEFAULT_TIMEOUT, show_default=True, help="How long, in seconds, to wait for each service with --all")
+@click.option('--textfile-dir', type=click.Path(file_okay=False, exists=True), envvar="PORTINUS_MONITOR_TEXTFILE_DIR", help="Write prometheus metrics about the check to this node_exporter textfile collector directory")
+def check(name, check_all, concurrency, timeout, textfile_dir):
+    if bool(name) == check_all:
+        raise click.UsageError("Exactly one of --name or --all is required")
     try:
-        portinus.monitor.checker.run(name)
+        if name:
+            results = [portinus.monitor.checker.run_one(name)]
+        else:
+            results = portinus.monitor.checker.run_all(concurrency=concurrency, timeout=timeout)
     except PermissionError:
         sys.exit(1)
 
+    if textfile_dir:
+        registry = portinus.monitor.metrics.Registry()
+        registry.update(results)
+        file_name = "portinus_monitor_{name}.prom".format(name=name) if name else "portinus_monitor.prom"
+        portinus.monitor.metrics.write_textfile(textfile_dir, file_name, registry)
+
+    if name:
+        return
+    for result in results:
+        click.echo(str(result))
+    if not all(x.healthy for x in results):
+        sys.exit(1)
+
+
+@task.command()
+@click.option('--interval', type=click.IntRange(min=1), default=300, show_default=True, help="How often, in seconds, to check every service regardless of docker events")
+@click.option('--metrics-port', type=int, help="Serve prometheus metrics at /metrics on this port")
+@click.option('--metrics-address', default="127.0.0.1", show_default=True, help="The address to serve prometheus metrics on")
+@click.option('--textfile-dir', type=click.Path(file_okay=False, exists=True), envvar="PORTINUS_MONITOR_TEXTFILE_DIR", help="Write prometheus metrics to this node_exporter textfile collector directory")
+def daemon(interval, metrics_port, metrics_address, textfile_dir):
+    portinus.monitor.daemon.run(interval, metrics_port=metrics_port, metrics_address=metrics_address, textfile_dir=textfile_dir)
+
+
+@task.command('enable-daemon')
+@click.option('--interval', type=click.IntRange(min=1), default=300, show_default=True, help="How often, in seconds, the daemon checks every service regardless of docker events")
+def enable_daemon(interval):
+    try:
+        portinus.monitor.enable_daemon(interval)
+    except PermissionError:
+        click.echo("Failed to enable the monitor daemon due to a permissions error")
+        sys.exit(1)
+
+
+@task.command('disable-daemon')
+def disable_daemon():
+    try:
+        portinus.monitor.disable_daemon()
+    except PermissionError:
+        click.echo("Failed to disable the monitor daemon due to a permissions error")
+        sys.exit(1)
+
+
+@task.command('enable-timer')
+@click.option('--interval', type=click.IntRange(min=1), default=300, show_default=True, help="How often, in seconds, to check every service")
+def enable_timer(interval):
+    try:
+        portinus.monitor.enable_host_timer(interval)
+    except PermissionError:
+        click.echo("Failed to enable the host monitor timer due to a permissions error")
+        sys.exit(1)
+
+
+@task.command('disable-timer')
+def disable_timer():
+    try:
+        portinus.monitor.disable_host_timer()
+    except PermissionError:
+        click.echo("Failed to disable the host monitor timer due to a permissions error")
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     task()
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+import portinus
+from . import checker, metrics
+
+log = logging.getLogger(__name__)
+
+HEALTH_EVENT = "health_status"
+TEXTFILE_NAME = "portinus_monitor.prom"
+
+_lock = threading.Lock()
+_registry = metrics.Registry()
+_textfile_dir = None
+
+
+def run(interval=300, metrics_port=None, metrics_address="127.0.0.1", textfile_dir=None):
+    """
+    Monitor every portinus service from a single process. All services are
+    checked once on startup and then again every 'interval' seconds, while
+    containers reporting as unhealthy through the docker events stream are
+    acted on as soon as the event arrives.
+
+    The result of each check is exported as prometheus metrics, served at
+    /metrics on 'metrics_port' and/or written to 'textfile_dir'
+    """
+    global _textfile_dir
+    _textfile_dir = textfile_dir
+    if metrics_port is not None:
+        metrics.serve(_registry, metrics_port, metrics_address)
+
+    client = checker.get_client()
+    since = int(time.time())
+
+    rescan = threading.Thread(target=_rescan_forever, args=(interval,), daemon=True)
+    rescan.start()
+
+    log.info("Watching docker events since {since}".format(since=since))
+    events = client.events(since=since, decode=True, filters={"type": "container", "event": HEALTH_EVENT})
+    for event in events:
+        handle_event(event)
+
+
+def check_all():
+    """
+    Check every installed portinus service
+    """
+    with _lock:
+        try:
+            results = checker.run_all()
+        except Exception:
+            log.exception("Failed to check all services")
+            return None
+        _record(results)
+        return results
+
+
+def check(name):
+    """
+    Check a single service. Checks are serialized so that a service is never
+    restarted by two checks at once
+    """
+    with _lock:
+        try:
+            result = checker.run_one(name)
+        except Exception:
+            log.exception("Failed to check {name}".format(name=name))
+            return None
+        _record([result])
+        return result.healthy
+
+
+def handle_event(event):
+    """
+    Check the service that owns the container from a docker health_status event.
+    Returns the result of the check, or None if the event was ignored
+    """
+    action = event.get("Action") or event.get("status") or ""
+    if not action.startswith(HEALTH_EVENT) or not action.endswith("unhealthy"):
+        return None
+
+    attributes = event.get("Actor", {}).get("Attributes", {})
+    name = get_service_name(attributes.get(checker.PROJECT_LABEL))
+    if name is None:
+        log.debug("Ignoring event for a container outside of portinus: {event}".format(event=event))
+        return None
+
+    log.info("Container '{container}' of {name} reported as unhealthy".format(container=attributes.get("name"), name=name))
+    return check(name)
+
+
+def get_service_name(project):
+    """
+    Returns the portinus service that runs the given docker-compose project
+    """
+    if not project:
+        return None
+    for name in portinus.get_service_names():
+        if checker.get_project_name(name) == project:
+            return name
+    return None
+
+
+def _record(results):
+    _registry.update(results)
+    if _textfile_dir:
+        try:
+            metrics.write_textfile(_textfile_dir, TEXTFILE_NAME, _registry)
+        except OSError:
+            log.exception("Failed to write metrics to {directory}".format(directory=_textfile_dir))
+
+
+def _rescan_forever(interval):
+    while True:
+        check_all()
+        time.sleep(interval)
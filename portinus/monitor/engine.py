@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+
+from .result import CheckResult
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 60
+
+
+def run(names, check, remediate, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """
+    Check the named services concurrently and return their results in order.
+
+    'check' is called with each name and must return a CheckResult without
+    acting on it. At most 'concurrency' checks run at once and a check that
+    takes longer than 'timeout' seconds from when it started is reported as
+    failed instead of holding up the others. The thread of a check that
+    timed out is replaced and left to finish on its own; it does not stop
+    the process from exiting. 'remediate' is called for every unhealthy
+    result and runs alongside the remaining checks
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = list(names)
+    loop = asyncio.new_event_loop()
+    workers = _Workers(loop, min(concurrency, len(names)))
+    remediate_executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        return loop.run_until_complete(_run(loop, workers, remediate_executor, names, check, remediate, concurrency, timeout))
+    finally:
+        workers.shutdown()
+        remediate_executor.shutdown(wait=True)
+        loop.close()
+
+
+async def _run(loop, workers, remediate_executor, names, check, remediate, concurrency, timeout):
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+    remediations = []
+
+    async def check_one(name):
+        async with semaphore:
+            result = await _check(workers, check, name, timeout)
+        if not result.healthy and result.error is None:
+            remediations.append(loop.run_in_executor(remediate_executor, _remediate, remediate, result))
+        return result
+
+    results = await asyncio.gather(*[check_one(x) for x in names])
+    if remediations:
+        await asyncio.gather(*remediations)
+    return results
+
+
+async def _check(workers, check, name, timeout):
+    import asyncio
+
+    started, done = workers.submit(check, name)
+    start = await started
+    try:
+        result = await asyncio.wait_for(done, timeout - (time.monotonic() - start))
+    except asyncio.TimeoutError:
+        log.error("Timed out checking {name} after {timeout} seconds".format(name=name, timeout=timeout))
+        workers.add()
+        result = CheckResult(name)
+        result.error = "timed out after {timeout} seconds".format(timeout=timeout)
+    except Exception as e:
+        log.exception("Failed to check {name}".format(name=name))
+        result = CheckResult(name)
+        result.error = e
+    result.duration = time.monotonic() - start
+    log.debug("Checked {name} in {duration:.3f} seconds".format(name=name, duration=result.duration))
+    return result
+
+
+class _Workers(object):
+    """
+    Daemon threads that make calls for an event loop. Unlike an executor's
+    workers they are not waited for when the process exits, so a worker
+    stuck on a call that timed out can be replaced and left behind
+    """
+
+    def __init__(self, loop, count):
+        import queue
+
+        self._loop = loop
+        self._queue = queue.Queue()
+        self._count = 0
+        for i in range(count):
+            self.add()
+
+    def add(self):
+        threading.Thread(target=self._work, daemon=True).start()
+        self._count += 1
+
+    def submit(self, function, *args):
+        """
+        Returns a future for the time a worker starts calling 'function', and
+        one for its result
+        """
+        started = self._loop.create_future()
+        done = self._loop.create_future()
+        self._queue.put((function, args, started, done))
+        return started, done
+
+    def shutdown(self):
+        """
+        Stop every worker once it is idle, including the ones left behind
+        """
+        for i in range(self._count):
+            self._queue.put(None)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            function, args, started, done = item
+            self._resolve(started, time.monotonic())
+            try:
+                self._resolve(done, function(*args))
+            except Exception as e:
+                self._resolve(done, error=e)
+
+    def _resolve(self, future, result=None, error=None):
+        try:
+            self._loop.call_soon_threadsafe(_set_result, future, result, error)
+        except RuntimeError:
+            # The loop has closed since the call timed out
+            pass
+
+
+def _set_result(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _remediate(remediate, result):
+    try:
+        remediate(result)
+    except Exception as e:
+        log.exception("Failed to restart {name}".format(name=result.name))
+        result.error = e
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+
+from .state import State
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS = (
+    ("check_duration_seconds", "gauge", "How long the last check of the service took"),
+    ("check_timestamp_seconds", "gauge", "When the service was last checked"),
+    ("check_success", "gauge", "Whether the last check found the service healthy"),
+    ("containers", "gauge", "How many containers were checked"),
+    ("unhealthy_containers", "gauge", "How many containers were found unhealthy"),
+    ("restarts_total", "counter", "How many restarts the monitor has triggered"),
+    ("last_restart_timestamp_seconds", "gauge", "When the monitor last restarted the service"),
+    ("seconds_since_last_restart", "gauge", "How long ago the monitor last restarted the service"),
+)
+
+
+class Registry(object):
+    """
+    The latest check result of every service, rendered in the prometheus
+    text exposition format
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def update(self, results, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for result in results:
+                self._results[result.name] = result
+                self._checked_at[result.name] = now
+
+    def render(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            samples = {name: _get_samples(result, self._checked_at[name], now) for name, result in self._results.items()}
+
+        lines = []
+        for metric, metric_type, description in METRICS:
+            full_name = "portinus_monitor_{metric}".format(metric=metric)
+            lines.append("# HELP {full_name} {description}".format(full_name=full_name, description=description))
+            lines.append("# TYPE {full_name} {metric_type}".format(full_name=full_name, metric_type=metric_type))
+            for name in sorted(samples):
+                value = samples[name].get(metric)
+                if value is None:
+                    continue
+                lines.append('{full_name}{{service="{name}"}} {value}'.format(full_name=full_name, name=_escape(name), value=_format(value)))
+        return "\n".join(lines) + "\n"
+
+
+def write_textfile(directory, file_name, registry):
+    """
+    Atomically write the registry to a file for node_exporter's textfile
+    collector
+    """
+    path = os.path.join(directory, file_name)
+    temporary_path = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+    with open(temporary_path, "w") as f:
+        f.write(registry.render())
+    os.replace(temporary_path, path)
+    log.debug("Wrote metrics to {path}".format(path=path))
+
+
+def serve(registry, port, address="127.0.0.1"):
+    """
+    Serve the registry over HTTP at /metrics from a background thread
+    """
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info("Serving metrics on http://{address}:{port}/metrics".format(address=address, port=server.server_port))
+    return server
+
+
+def _get_samples(result, checked_at, now):
+    state = State.load(result.name)
+    samples = {
+        "check_duration_seconds": result.duration,
+        "check_timestamp_seconds": checked_at,
+        "check_success": 1 if result.healthy else 0,
+        "containers": result.containers,
+        "unhealthy_containers": len(result.unhealthy),
+        "restarts_total": state.restart_count,
+    }
+    if state.last_restart:
+        samples["last_restart_timestamp_seconds"] = state.last_restart
+        samples["seconds_since_last_restart"] = now - state.last_restart
+    return samples
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return "{:.6f}".format(value).rstrip("0").rstrip(".")
+    return str(value)
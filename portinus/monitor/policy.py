@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import pathlib
+import time
+
+import portinus
+
+log = logging.getLogger(__name__)
+
+REMEDIATIONS = ("stack", "service", "recreate")
+
+DEFAULTS = {
+    "remediation": "stack",
+    "escalate_after": 3,
+    "max_restarts": 3,
+    "restart_window": 3600,
+    "restart_backoff": 900,
+    "max_restart_backoff": 86400,
+    "interval": 300,
+    "adaptive": False,
+}
+
+# With adaptive scheduling, services are checked more often for this many
+# intervals after a deploy or a failure, and less often once they have been
+# stable for STABLE_AFTER seconds
+SETTLE_INTERVALS = 3
+STABLE_AFTER = 86400
+FAST_FACTOR = 5
+SLOW_FACTOR = 4
+MIN_INTERVAL = 30
+
+
+class Policy(object):
+    """
+    How the monitor responds to unhealthy containers in the named service.
+    This is set at 'portinus ensure' time and read back by every check
+
+    remediation: 'stack' restarts the whole systemd service, 'service'
+        restarts only the unhealthy compose services and 'recreate'
+        recreates only the unhealthy compose services
+    escalate_after: how many consecutive failed checks of a compose service
+        are remediated on their own before the whole stack is restarted
+    max_restarts: how many restarts are allowed within restart_window
+        seconds before restarts are paused
+    restart_backoff: how long, in seconds, restarts are first paused for.
+        This doubles each time restarts resume and do not fix the service,
+        up to max_restart_backoff
+    interval: how often, in seconds, the service is checked
+    adaptive: check more often right after a deploy or a failure and less
+        often once the service has been stable for a while
+    """
+
+    def __init__(self, name, **settings):
+        unknown_settings = set(settings) - set(DEFAULTS)
+        if unknown_settings:
+            raise ValueError("Unknown monitor settings: {}".format(", ".join(sorted(unknown_settings))))
+
+        self.name = name
+        self.path = pathlib.Path("{}.monitor".format(portinus.get_instance_dir(name)))
+        for key, default in DEFAULTS.items():
+            value = settings.get(key)
+            setattr(self, key, default if value is None else value)
+
+        if self.remediation not in REMEDIATIONS:
+            raise ValueError("Invalid remediation '{}'. Expected one of: {}".format(self.remediation, ", ".join(REMEDIATIONS)))
+        log.debug("Initialized monitor Policy for '{name}' with settings: {settings}".format(name=name, settings=self.settings))
+
+    @classmethod
+    def load(cls, name):
+        """
+        Returns the installed policy for the named service, or the defaults
+        if there is none
+        """
+        policy = cls(name)
+        try:
+            with policy.path.open() as f:
+                settings = json.load(f)
+        except FileNotFoundError:
+            return policy
+        return cls(name, **{k: v for k, v in settings.items() if k in DEFAULTS})
+
+    def get_interval(self, state, now=None):
+        """
+        Returns how often, in seconds, the service should be checked given
+        its monitor state
+        """
+        if not self.adaptive:
+            return self.interval
+
+        now = time.time() if now is None else now
+        since_last_event = now - (state.last_event or 0)
+        if since_last_event < self.interval * SETTLE_INTERVALS:
+            # Never slower than the normal interval, even when that is below
+            # MIN_INTERVAL
+            return min(self.interval, max(self.interval // FAST_FACTOR, MIN_INTERVAL))
+        if since_last_event > STABLE_AFTER:
+            return self.interval * SLOW_FACTOR
+        return self.interval
+
+    @property
+    def settings(self):
+        return {key: getattr(self, key) for key in DEFAULTS}
+
+    def ensure(self):
+        log.info("Creating/updating monitor policy for '{name}' at '{path}'".format(name=self.name, path=self.path))
+        with self.path.open("w") as f:
+            json.dump(self.settings, f, indent=2, sort_keys=True)
+
+    def remove(self):
+        log.info("Removing monitor policy for {name}".format(name=self.name))
+        try:
+            os.remove(str(self.path))
+            log.debug("Successfully removed monitor policy")
+        except FileNotFoundError:
+            log.debug("No monitor policy found")
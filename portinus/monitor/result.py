@@ -0,0 +1,31 @@
+class CheckResult(object):
+    """
+    The outcome of checking a single service
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.containers = 0
+        self.unhealthy = []
+        self.unhealthy_services = []
+        self.restarted = False
+        self.action = None
+        self.error = None
+        self.duration = None
+
+    @property
+    def healthy(self):
+        return not self.unhealthy and self.error is None
+
+    def __str__(self):
+        if self.error is not None:
+            status = "failed ({error})".format(error=self.error)
+        elif self.unhealthy:
+            status = "unhealthy containers {containers}".format(containers=", ".join(self.unhealthy))
+            if self.action:
+                status += ", ran {action}".format(action=self.action)
+        else:
+            status = "healthy ({count} containers)".format(count=self.containers)
+        if self.duration is not None:
+            status += " in {duration:.2f}s".format(duration=self.duration)
+        return "{name}: {status}".format(name=self.name, status=status)
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import pathlib
+import time
+
+import portinus
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class State(object):
+    """
+    What the monitor remembers about the named service between checks.
+
+    Restarts go through a circuit breaker. While 'closed' restarts are
+    allowed until the policy's max_restarts have happened within its
+    restart_window, at which point the circuit opens and no restarts are
+    made until the backoff has passed. The circuit is then 'half-open' and
+    a single restart is allowed: if the service is healthy at the next check
+    the circuit closes, otherwise it opens again with the backoff doubled
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = pathlib.Path("{}.monitor-state".format(portinus.get_instance_dir(name)))
+        self.failures = {}
+        self.restarts = []
+        self.circuit = CLOSED
+        self.opened_at = None
+        self.backoff = None
+        self.last_event = None
+        self.scheduled_interval = None
+        self.restart_count = 0
+        self.last_restart = None
+        self.result = None
+        self.result_since = None
+
+    @classmethod
+    def load(cls, name):
+        """
+        Returns the saved state of the named service, or an empty state if
+        the service has not been checked yet
+        """
+        state = cls(name)
+        try:
+            with state.path.open() as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return state
+        except ValueError:
+            log.warning("Ignoring corrupt monitor state at '{path}'".format(path=state.path))
+            return state
+
+        state.failures = data.get("failures", {})
+        state.restarts = data.get("restarts", [])
+        state.circuit = data.get("circuit", CLOSED)
+        state.opened_at = data.get("opened_at")
+        state.backoff = data.get("backoff")
+        state.last_event = data.get("last_event")
+        state.scheduled_interval = data.get("scheduled_interval")
+        state.restart_count = data.get("restart_count", 0)
+        state.last_restart = data.get("last_restart")
+        state.result = data.get("result")
+        state.result_since = data.get("result_since")
+        return state
+
+    def to_dict(self):
+        return {
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "circuit": self.circuit,
+            "opened_at": self.opened_at,
+            "backoff": self.backoff,
+            "last_event": self.last_event,
+            "scheduled_interval": self.scheduled_interval,
+            "restart_count": self.restart_count,
+            "last_restart": self.last_restart,
+            "result": self.result,
+            "result_since": self.result_since,
+        }
+
+    def record_event(self, now=None):
+        """
+        Record a deploy or a failure, which adaptive scheduling reacts to
+        """
+        self.last_event = time.time() if now is None else now
+
+    def record_result(self, result, now=None):
+        """
+        Remember the outcome of the latest check, and when the service first
+        had that outcome. Returns True if it changed, so that a service that
+        stays healthy does not have its state saved on every check
+        """
+        if result == self.result:
+            return False
+        self.result = result
+        self.result_since = time.time() if now is None else now
+        return True
+
+    def record_failures(self, services):
+        """
+        Count another consecutive failure for each of the given compose
+        services and forget the ones that have recovered. Returns the
+        highest count
+        """
+        self.failures = {x: self.failures.get(x, 0) + 1 for x in services}
+        return max(self.failures.values(), default=0)
+
+    def allow_restart(self, policy, now=None):
+        """
+        Returns True if the circuit breaker allows the service to be restarted
+        now, moving the circuit to its next state as needed
+        """
+        now = time.time() if now is None else now
+
+        if self.circuit == OPEN:
+            if now < self.opened_at + self.backoff:
+                return False
+            log.info("Backoff for {name} has passed. Allowing a single restart".format(name=self.name))
+            self.circuit = HALF_OPEN
+            return True
+
+        if self.circuit == HALF_OPEN:
+            self._open(now, min(self.backoff * 2, policy.max_restart_backoff))
+            return False
+
+        recent_restarts = [x for x in self.restarts if x > now - policy.restart_window]
+        if len(recent_restarts) >= policy.max_restarts:
+            self._open(now, policy.restart_backoff)
+            return False
+        return True
+
+    def record_restart(self, policy, now=None):
+        now = time.time() if now is None else now
+        self.restarts = [x for x in self.restarts if x > now - policy.restart_window] + [now]
+        self.restart_count += 1
+        self.last_restart = now
+
+    def record_healthy(self):
+        """
+        Forget previous failures and close the circuit. Returns True if
+        anything changed
+        """
+        if not self.failures and self.circuit == CLOSED:
+            return False
+        if self.circuit != CLOSED:
+            log.info("{name} is healthy again. Closing the restart circuit".format(name=self.name))
+        self.failures = {}
+        self.circuit = CLOSED
+        self.opened_at = None
+        self.backoff = None
+        return True
+
+    def describe(self, now=None):
+        now = time.time() if now is None else now
+        if self.circuit == OPEN:
+            retry_in = max(0, int(self.opened_at + self.backoff - now))
+            description = "restarts paused for another {retry_in}s (circuit open)".format(retry_in=retry_in)
+        elif self.circuit == HALF_OPEN:
+            description = "waiting to see if the last restart worked (circuit half-open)"
+        else:
+            description = "restarts allowed (circuit closed)"
+        if self.last_restart:
+            last_restart = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_restart))
+            description += ", last restart at {last_restart}".format(last_restart=last_restart)
+        return description
+
+    def _open(self, now, backoff):
+        log.warning("Too many restarts of {name}. Pausing restarts for {backoff} seconds".format(name=self.name, backoff=backoff))
+        self.circuit = OPEN
+        self.opened_at = now
+        self.backoff = backoff
+
+    def save(self):
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with temporary_path.open("w") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        os.replace(str(temporary_path), str(self.path))
+
+    def remove(self):
+        log.info("Removing monitor state for {name}".format(name=self.name))
+        try:
+            os.remove(str(self.path))
+            log.debug("Successfully removed monitor state")
+        except FileNotFoundError:
+            log.debug("No monitor state found")
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+import portinus
+
+log = logging.getLogger(__name__)
+
+DEFAULT_KEEP = 3
+STAGING_NAME = ".staging"
+RELEASE_TAG_PREFIX = "portinus-release-"
+
+
+class Releases(object):
+    """
+    The deployed releases of a service. Each deployment is kept in its own
+    numbered directory under '.releases/<name>' in the services folder, and
+    the instance directory is a symlink to the active one, so switching
+    between releases is a single atomic rename. The newest 'keep' releases
+    are kept, along with the image IDs and build hashes each was deployed
+    with, so that the service can be rolled back without copying or building
+    anything. Each release's copy of the environment file is kept next to it
+    as '<release>.environment', outside of the build context
+    """
+
+    def __init__(self, name, keep=DEFAULT_KEEP):
+        if keep < 2:
+            raise ValueError("At least 2 releases must be kept")
+        self.name = name
+        self.keep = keep
+        self.link_path = portinus.get_instance_dir(name)
+        self.path = self.link_path.parent.joinpath(".releases", name)
+        self.staging_path = self.path.joinpath(STAGING_NAME)
+        self.staging_environment_path = self.get_environment_path(STAGING_NAME)
+
+    def list(self):
+        """
+        Returns the IDs of every release, oldest first
+        """
+        try:
+            names = os.listdir(str(self.path))
+        except FileNotFoundError:
+            return []
+        return sorted((x for x in names if x.isdigit() and os.path.isdir(str(self.path.joinpath(x)))), key=int)
+
+    def active(self):
+        """
+        Returns the ID of the active release, or None if there is none
+        """
+        try:
+            target = os.readlink(str(self.link_path))
+        except OSError:
+            return None
+        return os.path.basename(target)
+
+    def previous(self):
+        """
+        Returns the ID of the newest release older than the active one, or
+        None if there is none
+        """
+        active = self.active()
+        if active is None:
+            return None
+        older = [x for x in self.list() if int(x) < int(active)]
+        return older[-1] if older else None
+
+    def prepare_staging(self):
+        """
+        Make sure there is a staging directory to sync the next release into.
+        Once 'keep' releases exist, the oldest one that is not active is
+        reused, so that the sync only has to copy what changed since then
+        """
+        if self.staging_path.exists():
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        releases = self.list()
+        spare = [x for x in releases if x != self.active()]
+        if len(releases) >= self.keep and spare:
+            log.debug("Reusing release {release} of {name} for staging".format(release=spare[0], name=self.name))
+            self._untag_images(spare[0])
+            os.rename(str(self.path.joinpath(spare[0])), str(self.staging_path))
+            self._remove_release_files(spare[0])
+
+    def commit(self, metadata=None):
+        """
+        Turn the staging directory into a new release, with 'metadata'
+        describing it, and make it the active one. Returns its ID
+        """
+        release = self._new_id()
+        if self.staging_environment_path.exists():
+            os.replace(str(self.staging_environment_path), str(self.get_environment_path(release)))
+        os.rename(str(self.staging_path), str(self.path.joinpath(release)))
+        metadata = dict(metadata or {}, deployed=time.time())
+        metadata["images"] = _pin_images(metadata.get("images") or {}, release)
+        self._save_metadata(release, metadata)
+        self.activate(release)
+        self.prune()
+        return release
+
+    def activate(self, release):
+        """
+        Atomically point the instance directory at 'release'
+        """
+        release_path = self.path.joinpath(release)
+        if not release_path.is_dir():
+            raise ValueError("{name} has no release {release}".format(name=self.name, release=release))
+        log.info("Switching {name} to release {release}".format(name=self.name, release=release))
+        temporary_path = self.link_path.parent.joinpath(".{}.link".format(self.name))
+        if os.path.lexists(str(temporary_path)):
+            os.remove(str(temporary_path))
+        os.symlink(os.path.relpath(str(release_path), str(self.link_path.parent)), str(temporary_path))
+        os.replace(str(temporary_path), str(self.link_path))
+
+    def prune(self):
+        """
+        Remove the oldest releases that are not active, until only 'keep'
+        are left
+        """
+        active = self.active()
+        releases = self.list()
+        for release in [x for x in releases if x != active][:max(len(releases) - self.keep, 0)]:
+            log.info("Removing release {release} of {name}".format(release=release, name=self.name))
+            self._untag_images(release)
+            shutil.rmtree(str(self.path.joinpath(release)))
+            self._remove_release_files(release)
+
+    def get_environment_path(self, release):
+        """
+        Returns the path of the copy of the environment file kept for
+        'release', which the service script of the release sources
+        """
+        return self.path.joinpath("{}.environment".format(release))
+
+    def load_metadata(self, release):
+        """
+        Returns what was recorded about 'release' when it was deployed
+        """
+        try:
+            with self._metadata_path(release).open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning("Ignoring the corrupt metadata of release {release} of {name}".format(release=release, name=self.name))
+            return {}
+
+    def remove(self):
+        """
+        Remove every release and the instance directory. Returns True if
+        anything was removed
+        """
+        removed = False
+        for release in self.list():
+            self._untag_images(release)
+        if os.path.islink(str(self.link_path)):
+            os.remove(str(self.link_path))
+            removed = True
+        elif self.link_path.is_dir():
+            shutil.rmtree(str(self.link_path))
+            removed = True
+        try:
+            shutil.rmtree(str(self.path))
+            removed = True
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(str(self.path.parent))
+        except OSError:
+            pass
+        return removed
+
+    def migrate(self):
+        """
+        Move an instance directory deployed before releases existed into
+        place as the oldest release, along with its environment file. Returns
+        the ID of that release, whose service script still has to be brought
+        up to date, or None if there was nothing to move
+        """
+        if not self.link_path.is_dir() or os.path.islink(str(self.link_path)):
+            return None
+        self.path.mkdir(parents=True, exist_ok=True)
+        release = self._new_id()
+        log.info("Moving the existing deployment of {name} to release {release}".format(name=self.name, release=release))
+        environment_path = "{}.environment".format(self.link_path)
+        if os.path.isfile(environment_path) and not os.path.islink(environment_path):
+            shutil.copy(environment_path, str(self.get_environment_path(release)))
+        self._save_metadata(release, dict(deployed=os.stat(str(self.link_path)).st_mtime))
+        os.rename(str(self.link_path), str(self.path.joinpath(release)))
+        os.symlink(os.path.relpath(str(self.path.joinpath(release)), str(self.link_path.parent)), str(self.link_path))
+        return release
+
+    def _new_id(self):
+        releases = self.list()
+        return "{:04d}".format(int(releases[-1]) + 1 if releases else 1)
+
+    def _metadata_path(self, release):
+        return self.path.joinpath("{}.json".format(release))
+
+    def _save_metadata(self, release, metadata):
+        temporary_path = self.path.joinpath(".{}.json.tmp".format(release))
+        with temporary_path.open("w") as f:
+            json.dump(metadata, f, indent=2, sort_keys=True)
+        os.replace(str(temporary_path), str(self._metadata_path(release)))
+
+    def _remove_release_files(self, release):
+        for path in (self._metadata_path(release), self.get_environment_path(release)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _untag_images(self, release):
+        images = self.load_metadata(release).get("images") or {}
+        if not images:
+            return
+        try:
+            client = portinus.monitor.checker.get_client()
+            for name in images:
+                client.images.remove(_release_tag(name, release), noprune=True)
+        except Exception as e:
+            log.debug("Unable to untag the images of release {release} of {name}: {error}".format(release=release, name=self.name, error=e))
+
+
+def get_image_ids(names):
+    """
+    Returns the ID of every image in 'names' that exists, keyed by name
+    """
+    if not names:
+        return {}
+    import docker
+
+    images = {}
+    try:
+        client = portinus.monitor.checker.get_client()
+        for name in names:
+            try:
+                images[name] = client.images.get(name).id
+            except docker.errors.ImageNotFound:
+                log.debug("No image named {name}".format(name=name))
+    except Exception as e:
+        log.warning("Unable to record the images to roll back to: {error}".format(error=e))
+    return images
+
+
+def restore_images(images):
+    """
+    Tag every image ID in 'images' with its name again. Returns the names of
+    the images that no longer exist
+    """
+    missing = []
+    if not images:
+        return missing
+    import docker
+
+    client = portinus.monitor.checker.get_client()
+    for name, image_id in sorted(images.items()):
+        repository, tag = _split_tag(name)
+        try:
+            client.images.get(image_id).tag(repository, tag)
+            log.debug("Tagged {image_id} as {name}".format(image_id=image_id, name=name))
+        except docker.errors.ImageNotFound:
+            missing.append(name)
+    return missing
+
+
+def _pin_images(images, release):
+    """
+    Give every image of a release a tag of its own, so that it is not removed
+    as dangling once newer builds take over its name
+    """
+    if not images:
+        return images
+    try:
+        client = portinus.monitor.checker.get_client()
+        for name, image_id in images.items():
+            repository, tag = _split_tag(_release_tag(name, release))
+            client.images.get(image_id).tag(repository, tag)
+    except Exception as e:
+        log.warning("Unable to tag the images of release {release}: {error}".format(release=release, error=e))
+    return images
+
+
+def _release_tag(name, release):
+    repository = _split_tag(name)[0]
+    return "{repository}:{prefix}{release}".format(repository=repository, prefix=RELEASE_TAG_PREFIX, release=release)
+
+
+def _split_tag(name):
+    repository, separator, tag = name.rpartition(":")
+    if not separator or "/" in tag:
+        return name, "latest"
+    return repository, tag
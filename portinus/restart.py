@@ -1,7 +1,7 @@
 import logging
 
 import portinus
-from systemd_unit import Unit
+from portinus.systemd import Unit
 
 log = logging.getLogger(__name__)
 
@@ -11,9 +11,9 @@ class Timer(object):
     def __init__(self, name, restart_schedule):
         self.name = name
         self.restart_schedule = restart_schedule
-        systemd_service_name = portinus.Service(name).service_name
-        self._systemd_service = Unit(systemd_service_name + "-restart")
-        self._systemd_timer = Unit(systemd_service_name + "-restart", type="timer")
+        self.service_name = portinus.service.get_service_name(name)
+        self._systemd_service = Unit(self.service_name + "-restart")
+        self._systemd_timer = Unit(self.service_name + "-restart", type="timer")
         log.debug("Initialized restart.Timer for '{name}' with restart_schedule: '{restart_schedule}'".format(name=name, restart_schedule=restart_schedule))
 
     def __bool__(self):
@@ -21,11 +21,10 @@ class Timer(object):
 
     def _generate_service_file(self):
         template_file = portinus.get_template("restart.service")
-        instance_service = Unit(self.name)
 
         return template_file.render(
                 name=self.name,
-                service_name=instance_service.service_name,
+                service_name=self.service_name + ".service",
                 )
 
     def _generate_timer_file(self):
@@ -36,16 +35,18 @@ class Timer(object):
                 restart_schedule=self.restart_schedule,
                 )
 
-    def ensure(self):
+    def ensure(self, transaction=None):
         if self:
             log.info("Creating/updating {name} restart timer".format(name=self.name))
-            self._systemd_service.ensure(content=self._generate_service_file(), restart=False, enable=False)
-            self._systemd_timer.ensure(content=self._generate_timer_file())
+            with portinus.systemd.transaction(transaction) as t:
+                t.ensure(self._systemd_service, content=self._generate_service_file(), restart=False, enable=False)
+                t.ensure(self._systemd_timer, content=self._generate_timer_file())
         else:
             log.info("No restart schedule specified for {name}. Removing any existing restart timers".format(name=self.name))
-            self.remove()
+            self.remove(transaction)
 
-    def remove(self):
-        log.info("Removing {name} restart timer. Errors from systemctl may occur".format(name=self.name))
-        self._systemd_timer.remove()
-        self._systemd_service.remove()
+    def remove(self, transaction=None):
+        log.info("Removing {name} restart timer".format(name=self.name))
+        with portinus.systemd.transaction(transaction) as t:
+            t.remove(self._systemd_timer)
+            t.remove(self._systemd_service)
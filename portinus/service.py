@@ -2,23 +2,52 @@ import subprocess
 import os
 import logging
 
-import systemd_unit
-
 import portinus
 
 log = logging.getLogger(__name__)
 
+BUILD_WORKERS = 4
+
+
+def get_service_name(name):
+    """
+    Returns the name of the systemd service that runs the named portinus
+    service
+    """
+    return "portinus-{}".format(name)
+
+
 class Service(object):
 
-    def __init__(self, name, source=None):
+    def __init__(self, name, source=None, snapshot=None, keep_releases=None, exclude=()):
         if not name:
             raise ValueError("Invalid value for 'name'")
         self.name = name
-        self.service_name = "{}-{}".format("portinus", name)
-        self._source = portinus.ComposeSource(name, source)
-        self._systemd_service = systemd_unit.Unit(self.service_name)
+        self.service_name = get_service_name(name)
+        self._source = portinus.ComposeSource(name, source, snapshot=snapshot or portinus.sync.COPY,
+                                              keep_releases=keep_releases or portinus.releases.DEFAULT_KEEP,
+                                              exclude=exclude or ())
+        self._systemd_service = portinus.systemd.Unit(self.service_name)
         log.debug("Initialized Service for '{name}' with source: '{source}'".format(name=name, source=source))
 
+    @property
+    def source(self):
+        return self._source.source
+
+    @property
+    def snapshot(self):
+        return self._source.snapshot
+
+    @property
+    def exclude(self):
+        return self._source.exclude
+
+    def get_ignore_rules(self):
+        return self._source.get_ignore_rules()
+
+    def _generate_service_script(self):
+        return self._source._generate_service_script()
+
     def exists(self):
         return os.path.isdir(str(portinus.get_instance_dir(self.name)))
 
@@ -33,20 +62,124 @@ class Service(object):
             stop_command=stop_command,
             )
 
-    def ensure(self):
+    def _build(self, service_script, environment_file_path, rebuild=False):
+        """
+        Build the compose services whose build inputs have changed since they
+        were last built, in parallel. Everything is built if the build inputs
+        cannot be worked out or 'rebuild' is set
+        """
+        cache = portinus.buildcache.BuildCache(self.name)
+        hashes = portinus.buildcache.get_build_hashes(self._source.staging_path, environment_file_path)
+        if hashes is None or rebuild:
+            log.info("Building {name}".format(name=self.name))
+            cache.remove()
+            subprocess.check_call([str(service_script), "build"])
+            if hashes is not None:
+                cache.save(hashes)
+            return
+
+        built = cache.load()
+        services = sorted(x for x in hashes if built.get(x) != hashes[x])
+        if not services:
+            log.info("Nothing to build for {name}".format(name=self.name))
+            return
+
+        log.info("Building {services} for {name}".format(services=", ".join(services), name=self.name))
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=BUILD_WORKERS) as executor:
+            exit_codes = list(executor.map(lambda x: subprocess.call([str(service_script), "build", x]), services))
+
+        failed = []
+        for service, exit_code in zip(services, exit_codes):
+            if exit_code == 0:
+                built[service] = hashes[service]
+            else:
+                built.pop(service, None)
+                failed.append((service, exit_code))
+        cache.save({x: built[x] for x in hashes if x in built})
+        if failed:
+            service, exit_code = failed[0]
+            raise subprocess.CalledProcessError(exit_code, [str(service_script), "build", service])
+
+    def ensure(self, transaction=None, rebuild=False, environment_file=None):
+        """
+        Build the new source files and 'environment_file' alongside the
+        running deployment, and only stop it and switch over once the build
+        has succeeded. If the build fails the running deployment, including
+        its environment file, is left as it is
+        """
         log.info("Creating/updating {name} portinus instance".format(name=self.name))
+        environment_file = environment_file or portinus.EnvironmentFile(self.name)
+        service_script = self._source.stage()
+        environment_file_path = environment_file.stage()
+        try:
+            self._build(service_script, environment_file_path, rebuild)
+        except subprocess.CalledProcessError:
+            log.error("Failed to build {name}, leaving the running deployment as it is".format(name=self.name))
+            raise
+        metadata = dict(images=self._get_images(self._source.staging_path, environment_file_path),
+                        build_hashes=portinus.buildcache.BuildCache(self.name).load())
+        try:
+            self._systemd_service.stop()
+        except FileNotFoundError:
+            pass
+        self._source.switch(metadata)
+        environment_file.ensure()
+        with portinus.systemd.transaction(transaction) as t:
+            t.ensure(self._systemd_service, content=self._generate_service_file())
+
+    def rollback(self):
+        """
+        Switch back to the release before the active one, with the images and
+        environment file it was deployed with, and restart the service.
+        Nothing is copied, and nothing is built unless its images have since
+        been removed. Returns the ID of the release that is now active
+        """
+        releases = self._source.releases
+        release = releases.previous()
+        if release is None:
+            raise ValueError("There is no earlier release of {name} to roll back to".format(name=self.name))
+        metadata = releases.load_metadata(release)
+        log.info("Rolling {name} back to release {release}".format(name=self.name, release=release))
         try:
             self._systemd_service.stop()
         except FileNotFoundError:
             pass
-        self._source.ensure()
-        self.compose(["build"])
-        self._systemd_service.ensure(content=self._generate_service_file())
+        releases.activate(release)
+        portinus.EnvironmentFile(self.name).ensure()
 
-    def remove(self):
+        cache = portinus.buildcache.BuildCache(self.name)
+        missing = portinus.releases.restore_images(metadata.get("images"))
+        if missing or "images" not in metadata:
+            log.warning("The images of release {release} of {name} are not available, rebuilding".format(release=release, name=self.name))
+            cache.remove()
+            subprocess.check_call([str(self._source.service_script), "build"])
+        elif metadata.get("build_hashes"):
+            cache.save(metadata["build_hashes"])
+        else:
+            cache.remove()
+        self._systemd_service.restart()
+        return release
+
+    def _get_images(self, compose_dir, environment_file_path=None):
+        """
+        Returns the IDs of the images built for the compose services in
+        'compose_dir', keyed by image name
+        """
+        project_name = portinus.monitor.checker.get_project_name(self.name, environment_file_path)
+        names = portinus.buildcache.get_image_names(compose_dir, project_name, environment_file_path)
+        return portinus.releases.get_image_ids(sorted((names or {}).values()))
+
+    def remove(self, transaction=None):
         log.info("Removing {name} portinus instance".format(name=self.name))
-        self._systemd_service.remove()
+        try:
+            self._systemd_service.stop()
+        except (portinus.systemd.SystemdError, FileNotFoundError):
+            pass
+        with portinus.systemd.transaction(transaction) as t:
+            t.remove(self._systemd_service)
         self._source.remove()
+        portinus.buildcache.BuildCache(self.name).remove()
 
     def restart(self):
         log.info("Restarting {name}".format(name=self.name))
@@ -60,4 +193,4 @@ class Service(object):
         log.info("Running compose for {name} with command: '{command}'".format(name=self.name, command=command))
         if not self.exists():
             raise ValueError("The specified service does not exist")
-        subprocess.call([str(self._source.service_script)] + list(command))
+        return subprocess.call([str(self._source.service_script)] + list(command))
@@ -0,0 +1,280 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Snapshot modes. 'copy' copies every changed file, as a reflink where the
+# filesystem supports it. 'link' also hardlinks files from a content
+# addressed object store, so identical files are only ever stored once
+COPY = "copy"
+LINK = "link"
+SNAPSHOT_MODES = (COPY, LINK)
+
+# From linux/fs.h
+FICLONE = 0x40049409
+REFLINK_UNSUPPORTED_ERRORS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS)
+
+_reflink_unsupported = set()
+
+
+class SyncStats(object):
+
+    def __init__(self):
+        self.copied = 0
+        self.unchanged = 0
+        self.deleted = 0
+
+    def __str__(self):
+        return "{copied} copied, {unchanged} unchanged, {deleted} deleted".format(
+                copied=self.copied, unchanged=self.unchanged, deleted=self.deleted)
+
+
+class ObjectStore(object):
+    """
+    Content addressed copies of files. Files are hardlinked into place from
+    here, so every copy of the same content and mode shares one inode. Files
+    linked from the store must never be modified in place
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def link(self, source_path, destination_path):
+        """
+        Hardlink a copy of 'source_path' from the store to 'destination_path',
+        adding it to the store first if needed
+        """
+        key = "{hash}-{mode:o}".format(hash=file_hash(source_path), mode=stat.S_IMODE(os.stat(source_path).st_mode))
+        object_path = os.path.join(self.path, key[:2], key)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temporary_path = "{path}.{pid}-{thread}.tmp".format(path=object_path, pid=os.getpid(), thread=threading.get_ident())
+            copy_file(source_path, temporary_path)
+            os.replace(temporary_path, object_path)
+        os.link(object_path, destination_path)
+
+    def collect(self):
+        """
+        Remove every object that is no longer linked from anywhere else.
+        Returns how many were removed
+        """
+        removed = 0
+        for root, dirs, files in os.walk(self.path, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.lstat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+            if root != self.path and not os.listdir(root):
+                os.rmdir(root)
+        log.debug("Removed {removed} unused objects from {path}".format(removed=removed, path=self.path))
+        return removed
+
+
+def sync_tree(source, destination, keep=(), snapshot=COPY, object_dir=None, ignore=None):
+    """
+    Make 'destination' an exact copy of 'source', copying only the files that
+    have changed and deleting anything that is no longer in 'source'. Files
+    are treated as unchanged when their size and modification time match, or
+    failing that, when their contents hash the same. Top level names in
+    'keep' are never deleted from 'destination'. Paths matched by the
+    IgnoreRules in 'ignore' are left out, as if they were not in 'source'.
+
+    With the 'link' snapshot mode, changed files are hardlinked from the
+    object store in 'object_dir' instead of being copied
+    """
+    if snapshot not in SNAPSHOT_MODES:
+        raise ValueError("Invalid snapshot mode '{snapshot}'".format(snapshot=snapshot))
+    if snapshot == LINK and object_dir is None:
+        raise ValueError("The 'link' snapshot mode needs an object_dir")
+    source = str(source)
+    destination = str(destination)
+    stats = SyncStats()
+    if snapshot == LINK:
+        store = ObjectStore(object_dir)
+        create_file = lambda source_path, destination_path: _link_file(store, source_path, destination_path)
+    else:
+        create_file = copy_file
+
+    _ensure_directory(source, destination)
+    _sync_directory(source, destination, set(keep), stats, create_file, ignore or None, "")
+
+    log.debug("Synced '{source}' to '{destination}': {stats}".format(source=source, destination=destination, stats=stats))
+    return stats
+
+
+def file_hash(path):
+    """
+    Returns the sha256 hex digest of the file at 'path'
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file(source_path, destination_path):
+    """
+    Copy a file along with its metadata, as a reflink if the filesystem
+    supports it so that the copy shares its data blocks with the original
+    until either is modified
+    """
+    if _reflink(source_path, destination_path):
+        shutil.copystat(source_path, destination_path)
+    else:
+        shutil.copy2(source_path, destination_path)
+
+
+def tree_fingerprint(path, ignore=None):
+    """
+    Returns a digest of the names, types, sizes, modes and modification times
+    of everything under 'path', except the paths matched by the IgnoreRules
+    in 'ignore'. No file contents are read, so this is cheap enough to run on
+    every deploy
+    """
+    digest = hashlib.sha256()
+    path = str(path)
+    for root, dirs, files in os.walk(path):
+        relative_root = os.path.relpath(root, path)
+        if ignore and not ignore.has_exceptions:
+            dirs[:] = [x for x in dirs if not ignore.ignored(os.path.join(relative_root, x), is_dir=True)]
+        dirs.sort()
+        for name in sorted(dirs + files):
+            full_path = os.path.join(root, name)
+            if ignore and ignore.ignored(os.path.join(relative_root, name), is_dir=name in dirs):
+                continue
+            entry_stat = os.lstat(full_path)
+            if stat.S_ISLNK(entry_stat.st_mode):
+                details = "link {target}".format(target=os.readlink(full_path))
+            elif stat.S_ISDIR(entry_stat.st_mode):
+                details = "dir {mode:o}".format(mode=entry_stat.st_mode)
+            else:
+                details = "file {mode:o} {size} {mtime}".format(mode=entry_stat.st_mode, size=entry_stat.st_size, mtime=entry_stat.st_mtime_ns)
+            digest.update("{path}\0{details}\n".format(path=os.path.relpath(full_path, path), details=details).encode())
+    return digest.hexdigest()
+
+
+def _sync_directory(source, destination, keep, stats, create_file, ignore, relative_root):
+    source_names = set()
+    for entry in os.scandir(source):
+        relative_path = os.path.join(relative_root, entry.name)
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if ignore and ignore.ignored(relative_path, is_dir=is_dir) and not (is_dir and ignore.has_exceptions):
+            continue
+        source_names.add(entry.name)
+        destination_path = os.path.join(destination, entry.name)
+        if entry.is_symlink():
+            _sync_symlink(entry.path, destination_path, stats)
+        elif is_dir:
+            _ensure_directory(entry.path, destination_path)
+            _sync_directory(entry.path, destination_path, set(), stats, create_file, ignore, relative_path)
+        else:
+            _sync_file(entry, destination_path, stats, create_file)
+
+    for entry in os.scandir(destination):
+        if entry.name not in source_names and entry.name not in keep:
+            log.debug("Deleting '{path}'".format(path=entry.path))
+            _remove(entry.path)
+            stats.deleted += 1
+
+
+def _sync_file(entry, destination_path, stats, create_file):
+    source_stat = entry.stat(follow_symlinks=False)
+    try:
+        destination_stat = os.lstat(destination_path)
+    except FileNotFoundError:
+        destination_stat = None
+
+    if destination_stat is not None and stat.S_ISREG(destination_stat.st_mode) \
+            and destination_stat.st_size == source_stat.st_size:
+        if destination_stat.st_mtime_ns == source_stat.st_mtime_ns \
+                and destination_stat.st_mode == source_stat.st_mode:
+            stats.unchanged += 1
+            return
+        # A hardlinked file shares its inode with the object store and other
+        # releases, so its metadata is only ever updated by relinking it
+        if destination_stat.st_nlink == 1 and create_file is copy_file \
+                and file_hash(destination_path) == file_hash(entry.path):
+            shutil.copystat(entry.path, destination_path)
+            stats.unchanged += 1
+            return
+
+    log.debug("Copying '{source}' to '{destination}'".format(source=entry.path, destination=destination_path))
+    _replace(destination_path, lambda path: create_file(entry.path, path))
+    stats.copied += 1
+
+
+def _sync_symlink(source_path, destination_path, stats):
+    target = os.readlink(source_path)
+    if os.path.islink(destination_path) and os.readlink(destination_path) == target:
+        stats.unchanged += 1
+        return
+    _replace(destination_path, lambda path: os.symlink(target, path))
+    stats.copied += 1
+
+
+def _reflink(source_path, destination_path):
+    if fcntl is None:
+        return False
+    device = os.stat(os.path.dirname(os.path.abspath(destination_path))).st_dev
+    if device in _reflink_unsupported:
+        return False
+    with open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError as e:
+            if e.errno in REFLINK_UNSUPPORTED_ERRORS:
+                log.debug("Reflinks are not supported for {path}".format(path=destination_path))
+                _reflink_unsupported.add(device)
+            return False
+    return True
+
+
+def _link_file(store, source_path, destination_path):
+    try:
+        store.link(source_path, destination_path)
+    except OSError as e:
+        log.debug("Unable to hardlink {path}, copying it instead: {error}".format(path=source_path, error=e))
+        copy_file(source_path, destination_path)
+
+
+def _ensure_directory(source_path, destination_path):
+    if os.path.lexists(destination_path) and not (os.path.isdir(destination_path) and not os.path.islink(destination_path)):
+        _remove(destination_path)
+    if not os.path.exists(destination_path):
+        os.mkdir(destination_path)
+    shutil.copystat(source_path, destination_path)
+
+
+def _replace(destination_path, create):
+    """
+    Create a new file next to 'destination_path' and move it into place, so
+    that the destination is never left half written
+    """
+    temporary_path = os.path.join(os.path.dirname(destination_path), ".portinus-sync-" + os.path.basename(destination_path))
+    if os.path.lexists(temporary_path):
+        _remove(temporary_path)
+    create(temporary_path)
+    if os.path.isdir(destination_path) and not os.path.islink(destination_path):
+        shutil.rmtree(destination_path)
+    os.replace(temporary_path, destination_path)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
@@ -0,0 +1,437 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import logging
+import os
+import subprocess
+import threading
+
+import systemd_unit
+
+log = logging.getLogger(__name__)
+
+UNIT_DIR = "/etc/systemd/system"
+BACKEND_ENVVAR = "PORTINUS_SYSTEMD_BACKEND"
+
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+NOT_FOUND_ERRORS = ("org.freedesktop.systemd1.NoSuchUnit", "org.freedesktop.DBus.Error.FileNotFound")
+UNIT_PROPERTIES = ("Id", "LoadState", "ActiveState", "SubState", "UnitFileState")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class SystemdError(Exception):
+    """
+    A systemd job or command failed
+    """
+
+
+class SystemctlBackend(object):
+    """
+    Runs every systemd command by forking systemctl
+    """
+
+    def reload(self):
+        self._systemctl(["daemon-reload"])
+
+    def start(self, names):
+        self._systemctl(["start"] + names, stderr=subprocess.DEVNULL)
+
+    def stop(self, names):
+        self._systemctl(["stop"] + names, stderr=subprocess.DEVNULL)
+
+    def restart(self, names):
+        self._systemctl(["restart"] + names)
+
+    def enable(self, names):
+        self._systemctl(["enable"] + names)
+
+    def disable(self, names):
+        self._systemctl(["disable"] + names, stderr=subprocess.DEVNULL)
+
+    def get_unit_states(self, names):
+        if not names:
+            return {}
+        output = self._systemctl(["show", "--property=" + ",".join(UNIT_PROPERTIES), "--"] + list(names))
+        states = {}
+        for block in output.decode().split("\n\n"):
+            properties = dict(x.split("=", 1) for x in block.splitlines() if "=" in x)
+            if properties.get("Id"):
+                states[properties["Id"]] = get_unit_state(properties.get("LoadState"), properties.get("ActiveState"),
+                                                          properties.get("SubState"), properties.get("UnitFileState"))
+        return {x: states.get(x, get_unit_state()) for x in names}
+
+    def _systemctl(self, args, stderr=None):
+        try:
+            return subprocess.check_output(["systemctl"] + args, stderr=stderr)
+        except subprocess.CalledProcessError as e:
+            log.warning("Failed to run systemctl with parameters {args}".format(args=args))
+            if e.returncode == 5:
+                raise FileNotFoundError("Unable to find specified system service (args: {})".format(args)) from None
+            raise SystemdError("systemctl {args} exited with {code}".format(args=" ".join(args), code=e.returncode)) from e
+
+
+class DBusBackend(object):
+    """
+    Talks to systemd over one persistent connection to the system bus. The
+    jobs for every unit in a call are submitted before waiting for any of
+    them, so they run in parallel, and each call returns once systemd has
+    signalled that all of its jobs are finished. Requires jeepney
+    """
+
+    def __init__(self, bus="SYSTEM", timeout=600):
+        from jeepney import DBusAddress, MatchRule, message_bus
+        from jeepney.io.blocking import open_dbus_connection
+
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connection = open_dbus_connection(bus=bus)
+        self._manager = DBusAddress(SYSTEMD_PATH, bus_name=SYSTEMD_BUS_NAME, interface=MANAGER_INTERFACE)
+        self._job_removed = MatchRule(type="signal", interface=MANAGER_INTERFACE, member="JobRemoved", path=SYSTEMD_PATH)
+        self._connection.send_and_get_reply(message_bus.AddMatch(self._job_removed))
+        self._call("Subscribe")
+        log.debug("Connected to systemd over the {bus} bus".format(bus=bus.lower()))
+
+    def reload(self):
+        with self._lock:
+            self._call("Reload")
+
+    def start(self, names):
+        self._run_jobs("StartUnit", names)
+
+    def stop(self, names):
+        self._run_jobs("StopUnit", names)
+
+    def restart(self, names):
+        self._run_jobs("RestartUnit", names)
+
+    def enable(self, names):
+        with self._lock:
+            self._call("EnableUnitFiles", "asbb", (names, False, True))
+            self._call("Reload")
+
+    def disable(self, names):
+        with self._lock:
+            self._call("DisableUnitFiles", "asb", (names, False))
+            self._call("Reload")
+
+    def get_unit_states(self, names):
+        if not names:
+            return {}
+        with self._lock:
+            units, = self._call("ListUnitsByNames", "as", (list(names),))
+            unit_files, = self._call("ListUnitFilesByPatterns", "asas", ([], list(names)))
+        enabled = {os.path.basename(path): state for path, state in unit_files}
+        states = {x: get_unit_state(enabled=enabled.get(x)) for x in names}
+        for unit in units:
+            name, description, load, active, sub = unit[:5]
+            states[name] = get_unit_state(load, active, sub, enabled.get(name))
+        return states
+
+    def close(self):
+        self._connection.close()
+
+    def _run_jobs(self, method, names):
+        with self._lock, self._connection.filter(self._job_removed, queue=deque()) as signals:
+            jobs = {}
+            for name in names:
+                job, = self._call(method, "ss", (name, "replace"))
+                jobs[job] = name
+
+            failed = []
+            while jobs:
+                try:
+                    signal = self._connection.recv_until_filtered(signals, timeout=self.timeout)
+                except TimeoutError:
+                    raise SystemdError("Timed out waiting for {method} of {units}".format(method=method, units=", ".join(jobs.values()))) from None
+                job_id, job, unit, result = signal.body
+                if jobs.pop(job, None) is not None and result != "done":
+                    failed.append("{unit} ({result})".format(unit=unit, result=result))
+
+        if failed:
+            raise SystemdError("{method} failed for {units}".format(method=method, units=", ".join(failed)))
+
+    def _call(self, method, signature=None, body=()):
+        from jeepney import DBusErrorResponse, new_method_call
+        from jeepney.wrappers import unwrap_msg
+
+        reply = self._connection.send_and_get_reply(new_method_call(self._manager, method, signature, body))
+        try:
+            return unwrap_msg(reply)
+        except DBusErrorResponse as e:
+            if e.name in NOT_FOUND_ERRORS:
+                raise FileNotFoundError("Unable to find specified system service ({method} {body})".format(method=method, body=body)) from None
+            raise SystemdError(str(e)) from None
+
+
+class FakeBackend(object):
+    """
+    Keeps track of systemd in memory without touching the system. Every call
+    is recorded in 'calls'
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.active = set()
+        self.enabled = set()
+
+    def reload(self):
+        self.calls.append(("reload", []))
+
+    def start(self, names):
+        self.calls.append(("start", list(names)))
+        self.active.update(names)
+
+    def stop(self, names):
+        self.calls.append(("stop", list(names)))
+        self.active.difference_update(names)
+
+    def restart(self, names):
+        self.calls.append(("restart", list(names)))
+        self.active.update(names)
+
+    def enable(self, names):
+        self.calls.append(("enable", list(names)))
+        self.enabled.update(names)
+
+    def disable(self, names):
+        self.calls.append(("disable", list(names)))
+        self.enabled.difference_update(names)
+
+    def get_unit_states(self, names):
+        self.calls.append(("get_unit_states", list(names)))
+        states = {}
+        for name in names:
+            if not os.path.exists(os.path.join(UNIT_DIR, name)):
+                states[name] = get_unit_state()
+                continue
+            running = name in self.active
+            states[name] = get_unit_state("loaded", "active" if running else "inactive", "running" if running else "dead",
+                                          "enabled" if name in self.enabled else "disabled")
+        return states
+
+
+BACKENDS = {
+    "systemctl": SystemctlBackend,
+    "dbus": DBusBackend,
+    "fake": FakeBackend,
+}
+
+
+def get_backend():
+    """
+    Returns the backend used for every systemd call. This is the one named by
+    $PORTINUS_SYSTEMD_BACKEND if set, otherwise D-Bus when jeepney is
+    installed and the system bus is reachable, falling back to systemctl
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _create_backend(os.environ.get(BACKEND_ENVVAR))
+        return _backend
+
+
+def get_unit_state(load=None, active=None, sub=None, enabled=None):
+    """
+    Returns the state of a unit as reported by systemd. Units that systemd
+    does not know about are 'not-found'
+    """
+    return {
+        "load": load or "not-found",
+        "active": active or "inactive",
+        "sub": sub or "dead",
+        "enabled": enabled or None,
+    }
+
+
+def set_backend(backend):
+    """
+    Replace the backend used for every systemd call, e.g. with a FakeBackend
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _create_backend(name):
+    if name:
+        if name not in BACKENDS:
+            raise ValueError("Unknown systemd backend '{name}'. Use one of: {backends}".format(name=name, backends=", ".join(sorted(BACKENDS))))
+        return BACKENDS[name]()
+    try:
+        return DBusBackend()
+    except Exception as e:
+        log.debug("Unable to connect to systemd over D-Bus, using systemctl instead: {error}".format(error=e))
+        return SystemctlBackend()
+
+
+class Unit(systemd_unit.Unit):
+    """
+    A systemd_unit.Unit that runs its jobs through the systemd backend instead
+    of forking systemctl for each one
+    """
+
+    def __init__(self, name, type="service", content=None):
+        # systemd_unit.Unit.__init__ forks systemctl to check that it exists.
+        # The backend finds that out on first use instead
+        self.name = name
+        self.service_name = "{name}.{type}".format(name=name, type=type)
+        self.service_file_path = os.path.join(UNIT_DIR, self.service_name)
+        self.content = content
+        log.debug("Initialized Unit for '{name}' with type '{type}'".format(name=name, type=type))
+
+    def reload(self):
+        log.info("Reloading daemon files")
+        get_backend().reload()
+
+    def restart(self):
+        log.info("Restarting {service_name}".format(service_name=self.service_name))
+        get_backend().restart([self.service_name])
+
+    def stop(self):
+        log.info("Stopping {service_name}".format(service_name=self.service_name))
+        get_backend().stop([self.service_name])
+
+    def start(self):
+        log.info("Starting {service_name}".format(service_name=self.service_name))
+        get_backend().start([self.service_name])
+
+    def enable(self):
+        log.info("Enabling {service_name}".format(service_name=self.service_name))
+        get_backend().enable([self.service_name])
+
+    def disable(self):
+        log.info("Disabling {service_name}".format(service_name=self.service_name))
+        get_backend().disable([self.service_name])
+
+    def ensure(self, restart=True, enable=True, content=None):
+        with Transaction() as transaction:
+            transaction.ensure(self, content=content, restart=restart, enable=enable)
+
+    def remove(self):
+        with Transaction() as transaction:
+            transaction.remove(self)
+
+
+class Transaction(object):
+    """
+    A batch of systemd unit changes. Nothing happens until commit(), which
+    stops and disables the removed units, writes every unit file, reloads
+    systemd once and then restarts and enables the ensured units with one
+    backend call each
+    """
+
+    def __init__(self):
+        self._ensured = OrderedDict()
+        self._removed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def ensure(self, unit, content=None, restart=True, enable=True):
+        """
+        Write 'unit' with the given content, restarting and/or enabling it
+        """
+        if content:
+            unit.content = content
+        with self._lock:
+            self._removed.pop(unit.service_name, None)
+            self._ensured[unit.service_name] = (unit, restart, enable)
+
+    def remove(self, unit):
+        """
+        Stop, disable and delete 'unit'
+        """
+        with self._lock:
+            self._ensured.pop(unit.service_name, None)
+            self._removed[unit.service_name] = unit
+
+    def commit(self):
+        with self._lock:
+            ensured = list(self._ensured.values())
+            removed = list(self._removed.values())
+            self._ensured.clear()
+            self._removed.clear()
+        if not ensured and not removed:
+            return
+
+        backend = get_backend()
+        changed = _remove_units(backend, removed)
+        for unit, restart, enable in ensured:
+            changed = _write_unit(unit) or changed
+
+        if changed:
+            log.info("Reloading daemon files")
+            backend.reload()
+
+        restart = [unit.service_name for unit, restart, enable in ensured if restart]
+        if restart:
+            log.info("Restarting {units}".format(units=", ".join(restart)))
+            backend.restart(restart)
+
+        enable = [unit.service_name for unit, restart, enable in ensured if enable]
+        if enable:
+            log.info("Enabling {units}".format(units=", ".join(enable)))
+            backend.enable(enable)
+
+
+@contextmanager
+def transaction(parent=None):
+    """
+    Yields 'parent' if one is given, so that the caller's changes join an
+    outer transaction. Otherwise yields a new transaction that is committed
+    when the block exits without an error
+    """
+    if parent is not None:
+        yield parent
+        return
+    with Transaction() as new_transaction:
+        yield new_transaction
+
+
+def _remove_units(backend, units):
+    installed = [x for x in units if os.path.exists(x.service_file_path)]
+    if not installed:
+        return False
+
+    names = [x.service_name for x in installed]
+    log.info("Stopping and disabling {units}".format(units=", ".join(names)))
+    for command in (backend.stop, backend.disable):
+        try:
+            command(names)
+        except (SystemdError, FileNotFoundError):
+            pass
+
+    for unit in installed:
+        log.info("Removing service file for {name} from {path}".format(name=unit.name, path=unit.service_file_path))
+        try:
+            os.remove(unit.service_file_path)
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def _write_unit(unit):
+    """
+    Write the unit file if its content has changed. Returns True if it was
+    written
+    """
+    try:
+        with open(unit.service_file_path) as f:
+            if f.read() == unit.content:
+                log.debug("Service file for {name} is up to date".format(name=unit.name))
+                return False
+    except FileNotFoundError:
+        pass
+
+    log.info("Creating/updating service file for '{name}' at '{path}'".format(name=unit.name, path=unit.service_file_path))
+    with open(unit.service_file_path, "w") as f:
+        f.write(unit.content)
+    return True
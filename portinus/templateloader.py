@@ -0,0 +1,20 @@
+import os
+
+import jinja2
+
+
+class TemplateLoader(jinja2.FileSystemLoader):
+    """
+    A FileSystemLoader whose templates are also out of date once a file that
+    would override them appears earlier in the search path
+    """
+
+    def get_source(self, environment, template):
+        source, file_name, uptodate = super().get_source(environment, template)
+        overrides = []
+        for search_path in self.searchpath:
+            path = os.path.join(search_path, template)
+            if os.path.abspath(path) == os.path.abspath(file_name):
+                break
+            overrides.append(path)
+        return source, file_name, lambda: uptodate() and not any(os.path.exists(x) for x in overrides)
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
+import re
+
 from setuptools import setup, find_packages
 
+with open("portinus/__init__.py") as f:
+    version = re.search(r'^__version__ = "(.*)"$', f.read(), re.MULTILINE).group(1)
+
 setup(
     name="portinus",
-    version="1.0.17",
+    version=version,
     author="Justin Dray",
     author_email="justin@dray.be",
     url="https://github.com/justin8/portinus",
@@ -11,13 +16,18 @@ setup(
     packages=find_packages(),
     package_data={'portinus': ['templates/*']},
     license="MIT",
+    python_requires=">=3.5",
     install_requires=[
         "click",
         "docker==2.7.0",
         "docker-compose==1.17.0",
         "jinja2",
+        "PyYAML",
         "systemd_unit"
     ],
+    extras_require={
+        "dbus": ["jeepney"],
+    },
     tests_require=[
         "nose",
         "coverage",
@@ -34,6 +44,8 @@ setup(
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3 :: Only",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3.6",
         "Environment :: Console",
         "License :: OSI Approved :: MIT License",
         "Development Status :: 5 - Production/Stable",
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import portinus
+from portinus import buildcache
+
+
+class testBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.work_dir))
+
+    def test_load_save(self):
+        with patch.object(portinus, 'service_dir', self.work_dir):
+            cache = buildcache.BuildCache('foo')
+            self.assertEqual(cache.load(), {})
+            cache.save({"web": "abc"})
+            self.assertEqual(buildcache.BuildCache('foo').load(), {"web": "abc"})
+
+            cache.path.write_text("{")
+            self.assertEqual(cache.load(), {})
+
+            cache.remove()
+            cache.remove()
+            self.assertFalse(cache.path.exists())
+
+
+class testBuildHashes(unittest.TestCase):
+
+    def setUp(self):
+        self.compose_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.compose_dir))
+        self.compose_dir.joinpath("web", "src").mkdir(parents=True)
+        self.compose_dir.joinpath("web", "Dockerfile").write_text("FROM alpine\n")
+        self.compose_dir.joinpath("web", "src", "app.py").write_text("print('hi')\n")
+        self.compose_dir.joinpath("worker").mkdir()
+        self.compose_dir.joinpath("worker", "Dockerfile.worker").write_text("FROM alpine\n")
+        self.write_compose("version: '2'\n"
+                           "services:\n"
+                           "  web:\n"
+                           "    build: ./web\n"
+                           "  worker:\n"
+                           "    build:\n"
+                           "      context: worker\n"
+                           "      dockerfile: Dockerfile.worker\n"
+                           "  db:\n"
+                           "    image: postgres\n")
+
+    def write_compose(self, contents):
+        self.compose_dir.joinpath("docker-compose.yml").write_text(contents)
+
+    def hashes(self, environment_file=None):
+        return buildcache.get_build_hashes(self.compose_dir, environment_file)
+
+    def test_services(self):
+        hashes = self.hashes()
+        self.assertEqual(sorted(hashes), ["web", "worker"])
+        self.assertEqual(self.hashes(), hashes)
+
+    def test_version_1(self):
+        self.write_compose("web:\n  build: web\n")
+        self.assertEqual(sorted(self.hashes()), ["web"])
+
+    def test_context_changed(self):
+        hashes = self.hashes()
+        self.compose_dir.joinpath("web", "src", "app.py").write_text("print('bye')\n")
+        changed = self.hashes()
+        self.assertNotEqual(changed["web"], hashes["web"])
+        self.assertEqual(changed["worker"], hashes["worker"])
+
+    def test_dockerfile_changed(self):
+        hashes = self.hashes()
+        self.compose_dir.joinpath("worker", "Dockerfile.worker").write_text("FROM debian\n")
+        self.assertNotEqual(self.hashes()["worker"], hashes["worker"])
+
+    def test_mode_changed(self):
+        hashes = self.hashes()
+        os.chmod(str(self.compose_dir.joinpath("web", "src", "app.py")), 0o755)
+        self.assertNotEqual(self.hashes()["web"], hashes["web"])
+
+    def test_dockerignore(self):
+        self.compose_dir.joinpath("web", ".dockerignore").write_text("*.log\nsrc/cache\n")
+        hashes = self.hashes()
+        self.compose_dir.joinpath("web", "debug.log").write_text("qwe")
+        self.compose_dir.joinpath("web", "src", "cache").mkdir()
+        self.compose_dir.joinpath("web", "src", "cache", "foo").write_text("qwe")
+        self.assertEqual(self.hashes()["web"], hashes["web"])
+
+        self.compose_dir.joinpath("web", "src", "new.py").write_text("")
+        self.assertNotEqual(self.hashes()["web"], hashes["web"])
+
+    def test_environment_file(self):
+        self.write_compose("services:\n"
+                           "  web:\n"
+                           "    build:\n"
+                           "      context: web\n"
+                           "      args:\n"
+                           "        - VERSION\n"
+                           "        - MODE=fixed\n"
+                           "  worker:\n"
+                           "    build:\n"
+                           "      context: worker\n"
+                           "      dockerfile: Dockerfile.worker\n"
+                           "      args:\n"
+                           "        TOKEN:\n")
+        environment_file = self.compose_dir.joinpath("environment")
+        environment_file.write_text("VERSION=1\nTOKEN=a\nUNUSED=1\n")
+        hashes = self.hashes(environment_file)
+
+        environment_file.write_text("VERSION=1\nTOKEN=a\nUNUSED=2\n")
+        self.assertEqual(self.hashes(environment_file), hashes)
+
+        environment_file.write_text("VERSION=2\nTOKEN=a\nUNUSED=2\n")
+        changed = self.hashes(environment_file)
+        self.assertNotEqual(changed["web"], hashes["web"])
+        self.assertEqual(changed["worker"], hashes["worker"])
+
+        environment_file.write_text("VERSION=2\n")
+        self.compose_dir.joinpath(".env").write_text("TOKEN=b\n")
+        self.assertNotEqual(self.hashes(environment_file)["worker"], changed["worker"])
+        with patch.dict(os.environ, {"TOKEN": "a"}):
+            self.assertEqual(self.hashes(environment_file)["worker"], changed["worker"])
+
+    def test_unknown_context(self):
+        for contents in ("services:\n  web:\n    build: ${WEB_DIR}\n",
+                         "services:\n  web:\n    build: ./missing\n",
+                         "- qwe\n",
+                         "services: [\n"):
+            self.write_compose(contents)
+            self.assertIsNone(self.hashes())
+        os.remove(str(self.compose_dir.joinpath("docker-compose.yml")))
+        self.assertIsNone(self.hashes())
+
+    def test_override_file(self):
+        self.assertIsNotNone(self.hashes())
+        for name in buildcache.OVERRIDE_FILES:
+            self.compose_dir.joinpath(name).write_text("services:\n  web:\n    build: ./worker\n")
+            self.assertIsNone(self.hashes())
+            self.assertIsNone(buildcache.get_image_names(self.compose_dir, "foo"))
+            os.remove(str(self.compose_dir.joinpath(name)))
+
+    def test_compose_file_setting(self):
+        environment_file = self.compose_dir.joinpath(".env")
+        environment_file.write_text("FOO=1\n")
+        self.assertIsNotNone(self.hashes(environment_file))
+        environment_file.write_text("COMPOSE_FILE=docker-compose.yml:docker-compose.prod.yml\n")
+        self.assertIsNone(self.hashes(environment_file))
+        self.assertIsNone(buildcache.get_image_names(self.compose_dir, "foo", environment_file))
+        with patch.dict(os.environ, {"COMPOSE_FILE": "docker-compose.prod.yml"}):
+            self.assertIsNone(self.hashes())
+
+    def test_get_image_names(self):
+        self.assertEqual(buildcache.get_image_names(self.compose_dir, "foo"), {"web": "foo_web", "worker": "foo_worker"})
+        self.write_compose("web:\n  build: web\n  image: registry/web:1.0\n")
+        self.assertEqual(buildcache.get_image_names(self.compose_dir, "foo"), {"web": "registry/web:1.0"})
+        self.write_compose("- qwe\n")
+        self.assertIsNone(buildcache.get_image_names(self.compose_dir, "foo"))
@@ -1,6 +1,8 @@
 from pathlib import Path
 from unittest.mock import patch
+import json
 import logging
+import subprocess
 import unittest
 
 
@@ -36,6 +38,32 @@ class testCli(unittest.TestCase):
         self.assertFalse(result.exception)
         fake_list.assert_called_with()
 
+    @patch.object(portinus.inventory, "get_statuses", return_value=[portinus.inventory.ServiceStatus("foo")])
+    @patch("portinus.list")
+    def test_list_long(self, fake_list, fake_get_statuses):
+        result = self.runner.invoke(cli.list, ["--long"])
+        self.assertFalse(result.exception)
+        self.assertFalse(fake_list.called)
+        self.assertEqual(result.output.splitlines()[0].split()[:2], ["NAME", "SERVICE"])
+        self.assertTrue(result.output.splitlines()[1].startswith("foo "))
+
+    @patch.object(portinus.inventory, "get_statuses", return_value=[portinus.inventory.ServiceStatus("foo")])
+    def test_list_json(self, fake_get_statuses):
+        result = self.runner.invoke(cli.list, ["--json"])
+        self.assertFalse(result.exception)
+        self.assertEqual(json.loads(result.output)[0]["name"], "foo")
+
+    @patch.object(portinus.inventory, "get_statuses", return_value=[])
+    def test_ls_long(self, fake_get_statuses):
+        result = self.runner.invoke(cli.ls, ["-l"])
+        self.assertFalse(result.exception)
+        self.assertTrue(fake_get_statuses.called)
+
+    @patch.object(portinus.inventory, "get_statuses", side_effect=portinus.systemd.SystemdError("qwe"))
+    def test_list_long_systemd_error(self, fake_get_statuses):
+        result = self.runner.invoke(cli.list, ["--long"])
+        self.assertEqual(result.exit_code, 1)
+
     @patch.object(portinus, "Application")
     def test_stop_success(self, fake_application):
         result = self.runner.invoke(cli.stop, ["foo"])
@@ -103,6 +131,21 @@ class testCli(unittest.TestCase):
         result = self.runner.invoke(cli.remove, ["foo"])
         self.assertTrue(result.exception)
 
+    @patch.object(portinus, "Application")
+    def test_rollback(self, fake_application):
+        fake_application().rollback.return_value = '0001'
+        result = self.runner.invoke(cli.rollback, ["foo"])
+        self.assertFalse(result.exception)
+        fake_application.assert_called_with('foo')
+        self.assertIn("Rolled foo back to release 0001", result.output)
+
+    @patch.object(portinus, "Application")
+    def test_rollback_no_release(self, fake_application):
+        fake_application().rollback.side_effect = ValueError("There is no earlier release of foo to roll back to")
+        result = self.runner.invoke(cli.rollback, ["foo"])
+        self.assertIsInstance(result.exception, SystemExit)
+        self.assertIn("no earlier release", result.output)
+
     @patch.object(portinus, "Application")
     def test_compose_no_args(self, fake_application):
         result = self.runner.invoke(cli.compose, [])
@@ -129,6 +172,37 @@ class testCli(unittest.TestCase):
         fake_application.assert_called_with('foo')
         fake_application().service.compose.assert_called_with(('logs', 'bar', 'baz', 'qwe'))
 
+    @patch.object(portinus.fleet, "apply")
+    def test_apply(self, fake_apply):
+        manifest = str(test_data_dir.joinpath('fleet.yml'))
+        result = portinus.fleet.AppResult("foo")
+        result.action = "deployed"
+        fake_apply.return_value = [result]
+        result = self.runner.invoke(cli.apply, [manifest, '--workers', '2', '--prune'])
+        self.assertFalse(result.exception)
+        self.assertEqual(result.output, "foo: deployed\n")
+        apps = fake_apply.call_args[0][0]
+        self.assertEqual(apps[0]["source"], str(test_data_dir.joinpath('real_app')))
+        self.assertEqual(fake_apply.call_args[1], {"workers": 2, "prune": True, "force": False})
+
+    @patch.object(portinus.fleet, "apply")
+    def test_apply_failure(self, fake_apply):
+        manifest = str(test_data_dir.joinpath('fleet.yml'))
+        result = portinus.fleet.AppResult("foo")
+        result.error = "denied"
+        fake_apply.return_value = [result]
+        result = self.runner.invoke(cli.apply, [manifest])
+        self.assertIsInstance(result.exception, SystemExit)
+        self.assertEqual(result.exit_code, 1)
+
+    @patch.object(portinus.fleet, "apply")
+    def test_apply_invalid_manifest(self, fake_apply):
+        manifest = str(test_data_dir.joinpath('real_app', 'docker-compose.yml'))
+        result = self.runner.invoke(cli.apply, [manifest])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Invalid manifest", result.output)
+        self.assertFalse(fake_apply.called)
+
     @patch.object(portinus, "Application")
     def test_ensure_no_args(self, fake_application):
         result = self.runner.invoke(cli.ensure, [])
@@ -154,6 +228,14 @@ class testCli(unittest.TestCase):
         result = self.runner.invoke(cli.ensure, ['--source', real_app, 'foo'])
         self.assertIsInstance(result.exception, SystemExit)
 
+    @patch.object(portinus, "Application")
+    def test_ensure_build_failed(self, fake_application):
+        fake_application().ensure.side_effect = subprocess.CalledProcessError(1, 'build')
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, 'foo'])
+        self.assertIsInstance(result.exception, SystemExit)
+        self.assertIn("Failed to build foo", result.output)
+
     @patch.object(portinus, "Application")
     def test_ensure_success(self, fake_application):
         real_app = str(test_data_dir.joinpath('real_app'))
@@ -170,16 +252,78 @@ class testCli(unittest.TestCase):
                 )
         self.assertTrue(fake_application().ensure.called)
 
+    @patch.object(portinus, "Application")
+    def test_ensure_snapshot(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--snapshot', 'link', 'foo'])
+        self.assertFalse(result.exception)
+        self.assertEqual(fake_application.call_args[1]["snapshot"], "link")
+
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--snapshot', 'qwe', 'foo'])
+        self.assertTrue(result.exception)
+
+    @patch.object(portinus, "Application")
+    def test_ensure_keep_releases(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--keep-releases', '5', 'foo'])
+        self.assertFalse(result.exception)
+        self.assertEqual(fake_application.call_args[1]["keep_releases"], 5)
+
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--keep-releases', '1', 'foo'])
+        self.assertTrue(result.exception)
+
+    @patch.object(portinus, "Application")
+    def test_ensure_remediation(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--remediation', 'service', '--escalate-after', '2', 'foo'])
+        self.assertFalse(result.exception)
+        monitor_settings = fake_application.call_args[1]["monitor_settings"]
+        self.assertEqual(monitor_settings["remediation"], "service")
+        self.assertEqual(monitor_settings["escalate_after"], 2)
+        self.assertIsNone(monitor_settings["max_restarts"])
+
+    @patch.object(portinus, "Application")
+    def test_ensure_circuit_breaker(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--max-restarts', '5', '--restart-window', '600',
+                                                 '--restart-backoff', '60', '--max-restart-backoff', '3600', 'foo'])
+        self.assertFalse(result.exception)
+        monitor_settings = fake_application.call_args[1]["monitor_settings"]
+        self.assertEqual(monitor_settings["max_restarts"], 5)
+        self.assertEqual(monitor_settings["restart_window"], 600)
+        self.assertEqual(monitor_settings["restart_backoff"], 60)
+        self.assertEqual(monitor_settings["max_restart_backoff"], 3600)
+
+    @patch.object(portinus, "Application")
+    def test_ensure_monitor_interval(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--monitor-interval', '60', '--adaptive-monitor', 'foo'])
+        self.assertFalse(result.exception)
+        monitor_settings = fake_application.call_args[1]["monitor_settings"]
+        self.assertEqual(monitor_settings["interval"], 60)
+        self.assertTrue(monitor_settings["adaptive"])
+
+    @patch.object(portinus, "Application")
+    def test_ensure_invalid_remediation(self, fake_application):
+        real_app = str(test_data_dir.joinpath('real_app'))
+        result = self.runner.invoke(cli.ensure, ['--source', real_app, '--remediation', 'qwe', 'foo'])
+        self.assertTrue(result.exception)
+        self.assertFalse(fake_application.called)
+
     @patch.object(portinus, "Application")
     def test_ps(self, fake_application):
         result = self.runner.invoke(cli.ps, ['foo'])
         self.assertFalse(result.exception)
         fake_application().service.compose.assert_called_with(['ps'])
 
+    @patch.object(portinus.monitor.State, "load")
     @patch.object(portinus, "Application")
-    def test_status(self, fake_application):
+    def test_status(self, fake_application, fake_state_load):
+        fake_state_load.return_value.describe.return_value = "restarts allowed"
         result = self.runner.invoke(cli.status, ['foo'])
         self.assertFalse(result.exception)
+        fake_state_load.assert_called_with('foo')
+        self.assertIn("Monitor: restarts allowed", result.output)
         fake_application().service.compose.assert_called_with(['ps'])
 
     @patch('logging.basicConfig')
@@ -1,7 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import patch
 
+import portinus
 from portinus import ComposeSource
 
 class testComposeSource(unittest.TestCase):
@@ -51,20 +55,121 @@ class testComposeSource(unittest.TestCase):
         with self.assertRaises(IOError):
             cs.ensure()
 
-    @patch.object(ComposeSource, 'remove')
+    @patch.object(ComposeSource, 'switch')
     @patch.object(ComposeSource, '_ensure_service_script')
-    @patch('shutil.copytree')
-    def test_ensure_with_source(self, fake_copytree, fake__ensure_service_script, fake_remove):
+    @patch.object(portinus.releases.Releases, 'prepare_staging')
+    @patch('portinus.sync.sync_tree')
+    def test_stage_with_source(self, fake_sync_tree, fake_prepare_staging, fake__ensure_service_script, fake_switch):
         cs = ComposeSource('foo', source=self.real_app)
-        cs.ensure()
-        self.assertTrue(fake_remove.called)
-        self.assertTrue(fake_copytree.called)
-        self.assertTrue(fake__ensure_service_script.called)
-
-    @patch('shutil.copy')
-    @patch('os.chmod')
-    def test__ensure_service_script(self, fake_chmod, fake_shutil_copy):
-        cs = ComposeSource('foo')
-        cs._ensure_service_script()
-        fake_chmod.called_with(cs.service_script, 0o755)
-        self.assertEqual(fake_shutil_copy.called, 1)
+        cs.stage()
+        self.assertFalse(fake_switch.called)
+        self.assertTrue(fake_prepare_staging.called)
+        self.assertEqual(fake_sync_tree.call_args[0], (self.real_app, cs.staging_path))
+        self.assertEqual(fake_sync_tree.call_args[1]["keep"], ['foo'])
+        self.assertEqual(fake_sync_tree.call_args[1]["snapshot"], 'copy')
+        self.assertEqual(fake_sync_tree.call_args[1]["object_dir"], cs.object_store.path)
+        fake__ensure_service_script.assert_called_with(cs.staging_path)
+
+    def test_stage_and_switch(self):
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        with patch.object(portinus, 'service_dir', service_dir):
+            cs = ComposeSource('foo', source=self.real_app, keep_releases=2)
+            service_script = cs.stage()
+            self.assertEqual(service_script, cs.staging_path.joinpath('foo'))
+            self.assertFalse(cs.path.exists())
+
+            self.assertEqual(cs.switch({"images": {}}), '0001')
+            self.assertTrue(os.path.islink(str(cs.path)))
+            self.assertTrue(cs.path.joinpath('docker-compose.yml').exists())
+            self.assertFalse(cs.staging_path.exists())
+
+            cs.path.joinpath('generated').write_text('')
+            cs.ensure()
+            cs.ensure()
+            self.assertEqual(cs.releases.list(), ['0002', '0003'])
+            self.assertEqual(cs.releases.active(), '0003')
+            self.assertTrue(cs.path.joinpath('foo').exists())
+            self.assertFalse(cs.path.joinpath('generated').exists())
+            self.assertEqual(portinus.get_service_names(), ['foo'])
+
+            cs.remove()
+            self.assertEqual(os.listdir(str(service_dir)), [])
+
+    def test_stage_reuses_old_release(self):
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        with patch.object(portinus, 'service_dir', service_dir):
+            cs = ComposeSource('foo', source=self.real_app, keep_releases=2)
+            cs.ensure()
+            cs.ensure()
+            oldest = os.stat(str(cs.releases.path.joinpath('0001'))).st_ino
+            cs.stage()
+            self.assertEqual(os.stat(str(cs.staging_path)).st_ino, oldest)
+            self.assertEqual(cs.releases.list(), ['0002'])
+
+    def test_switch_existing_deployment(self):
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        with patch.object(portinus, 'service_dir', service_dir):
+            cs = ComposeSource('foo', source=self.real_app)
+            cs.path.mkdir()
+            cs.path.joinpath('old').write_text('')
+            cs.service_script.write_text('old script')
+            service_dir.joinpath('foo.environment').write_text('SECRET=1\n')
+
+            cs.stage()
+            self.assertTrue(cs.staging_path.joinpath('docker-compose.yml').exists())
+            self.assertIn('COMPOSE_PROJECT_NAME="foo"', cs.releases.path.joinpath('0001', 'foo').read_text())
+            self.assertEqual(cs.releases.get_environment_path('0001').read_text(), 'SECRET=1\n')
+            self.assertIn('deployed', cs.releases.load_metadata('0001'))
+            self.assertNotIn('images', cs.releases.load_metadata('0001'))
+            cs.switch()
+            self.assertEqual(cs.releases.list(), ['0001', '0002'])
+            self.assertEqual(cs.releases.previous(), '0001')
+            self.assertTrue(cs.releases.path.joinpath('0001', 'old').exists())
+
+    def test_get_ignore_rules(self):
+        source = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(source))
+        source.joinpath('docker-compose.yml').write_text('')
+        source.joinpath('.portinusignore').write_text('.git/\n*.log\n')
+        cs = ComposeSource('foo', source=str(source), exclude=['data/', '!keep.log'])
+        rules = cs.get_ignore_rules()
+        self.assertTrue(rules.ignored('.git', is_dir=True))
+        self.assertTrue(rules.ignored('app/debug.log'))
+        self.assertTrue(rules.ignored('app/data/db', is_dir=True))
+        self.assertFalse(rules.ignored('keep.log'))
+        self.assertFalse(rules.ignored('docker-compose.yml'))
+        self.assertFalse(ComposeSource('foo').get_ignore_rules())
+
+    def test_init_invalid_snapshot(self):
+        with self.assertRaises(ValueError):
+            ComposeSource('foo', snapshot='qwe')
+
+    def test_stage_and_switch_link(self):
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        with patch.object(portinus, 'service_dir', service_dir):
+            cs = ComposeSource('foo', source=self.real_app, snapshot='link')
+            cs.ensure()
+            cs.ensure()
+            live = os.stat(str(cs.path.joinpath('docker-compose.yml')))
+            previous = os.stat(str(cs.releases.path.joinpath('0001', 'docker-compose.yml')))
+            self.assertEqual(live.st_ino, previous.st_ino)
+            self.assertEqual(live.st_nlink, 3)
+
+            cs.remove()
+            self.assertEqual(os.listdir(str(service_dir)), ['.objects'])
+            self.assertEqual(os.listdir(str(service_dir.joinpath('.objects'))), [])
+
+    def test__ensure_service_script(self):
+        path = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(path))
+        cs = ComposeSource('foo-bar')
+        service_script = cs._ensure_service_script(path)
+        self.assertEqual(os.stat(str(service_script)).st_mode & 0o777, 0o755)
+        self.assertEqual(os.listdir(str(path)), ['foo-bar'])
+        contents = service_script.read_text()
+        self.assertIn('COMPOSE_PROJECT_NAME="foobar"', contents)
+        self.assertIn('environment_file="../$(basename "$PWD").environment"', contents)
@@ -1,8 +1,11 @@
+import os
+import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import patch
 import shutil
 
+import portinus
 from portinus import EnvironmentFile
 
 
@@ -49,16 +52,55 @@ class testEnvironmentFile(unittest.TestCase):
         env.remove()
         fake_remove.assert_called_with(str(env.path))
 
-    @patch.object(shutil, 'copy')
-    def test_ensure(self, fake_copy):
+    def _service_dir(self):
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        patcher = patch.object(portinus, 'service_dir', service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return service_dir
+
+    def test_stage(self):
+        service_dir = self._service_dir()
+        env = EnvironmentFile('foo', source_environment_file=self.real_environment_file)
+        staged_path = env.stage()
+        self.assertEqual(staged_path, service_dir.joinpath('.releases', 'foo', '.staging.environment'))
+        self.assertEqual(env.read(staged_path), {"foo": "bar", "bar": "baz"})
+        self.assertFalse(os.path.lexists(str(env.path)))
+
+        EnvironmentFile('foo').stage()
+        self.assertFalse(staged_path.exists())
+
+    def test_ensure(self):
+        service_dir = self._service_dir()
+        releases = portinus.releases.Releases('foo')
+        releases.prepare_staging()
+        releases.staging_path.mkdir()
         env = EnvironmentFile('foo', source_environment_file=self.real_environment_file)
+        env.stage()
+        releases.commit()
         env.ensure()
-        self.assertTrue(env)
-        self.assertTrue(fake_copy.called)
+        self.assertEqual(os.readlink(str(env.path)), os.path.join('.releases', 'foo', '0001.environment'))
+        self.assertEqual(env.read(), {"foo": "bar", "bar": "baz"})
+        self.assertEqual(os.listdir(str(releases.path.joinpath('0001'))), [])
 
-    @patch.object(EnvironmentFile, 'remove')
-    def test_ensure_no_source(self, fake_remove):
-        env = EnvironmentFile('foo')
+        releases.prepare_staging()
+        releases.staging_path.mkdir()
+        EnvironmentFile('foo').stage()
+        releases.commit()
         env.ensure()
-        self.assertTrue(fake_remove.called)
+        self.assertFalse(os.path.lexists(str(env.path)))
 
+        releases.activate('0001')
+        env.ensure()
+        self.assertEqual(env.read(), {"foo": "bar", "bar": "baz"})
+
+    def test_read(self):
+        env = EnvironmentFile('foo')
+        env.path = Path(self.real_environment_file)
+        self.assertEqual(env.read(), {"foo": "bar", "bar": "baz"})
+
+    def test_read_no_file(self):
+        env = EnvironmentFile('foo')
+        env.path = self.test_data_dir.joinpath('i-dont-exist')
+        self.assertEqual(env.read(), {})
@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import portinus
+from portinus import fleet
+
+
+class testFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.work_dir))
+        self.manifest = self.work_dir.joinpath("fleet.yml")
+
+    def load(self, contents):
+        self.manifest.write_text(contents)
+        return fleet.load_manifest(str(self.manifest))
+
+    def test_load_manifest(self):
+        apps = self.load("apps:\n"
+                         "  - name: foo\n"
+                         "    source: foo\n"
+                         "    env: /etc/foo.env\n"
+                         "    restart: daily\n"
+                         "    monitor:\n"
+                         "      remediation: service\n"
+                         "  - name: bar\n"
+                         "    source: ./bar\n")
+        self.assertEqual(apps, [
+            {"name": "foo", "source": str(self.work_dir.joinpath("foo")), "env": "/etc/foo.env",
+             "restart": "daily", "monitor": {"remediation": "service"}},
+            {"name": "bar", "source": str(self.work_dir.joinpath("bar"))},
+        ])
+
+    def test_load_manifest_invalid(self):
+        for contents in ("", "apps: foo\n", "- name: foo\n", "apps: [\n",
+                         "apps:\n  - source: foo\n",
+                         "apps:\n  - name: foo\n",
+                         "apps:\n  - name: foo\n    source: foo\n    qwe: 1\n",
+                         "apps:\n  - name: foo\n    source: foo\n  - name: foo\n    source: bar\n"):
+            with self.assertRaises(ValueError):
+                self.load(contents)
+
+    @patch.object(portinus, 'Application')
+    def test_apply(self, fake_application):
+        fake_application().ensure.side_effect = [True, False]
+        apps = [{"name": "foo", "source": "/foo", "restart": "daily"}, {"name": "bar", "source": "/bar"}]
+        results = fleet.apply(apps, workers=1, force=True)
+
+        self.assertEqual([x.name for x in results], ["foo", "bar"])
+        self.assertEqual([x.action for x in results], ["deployed", "unchanged"])
+        self.assertFalse(any(x.failed for x in results))
+        fake_application.assert_any_call("foo", source="/foo", environment_file=None,
+                                         restart_schedule="daily", monitor_settings=None, snapshot=None, keep_releases=None, exclude=())
+        fake_application().ensure.assert_called_with(force=True)
+        self.assertEqual(str(results[1])[:17], "bar: unchanged in")
+
+    @patch.object(portinus, 'Application')
+    def test_apply_failure(self, fake_application):
+        fake_application().ensure.side_effect = [PermissionError("denied"), True]
+        apps = [{"name": "foo", "source": "/foo"}, {"name": "bar", "source": "/bar"}]
+        results = fleet.apply(apps, workers=1)
+
+        self.assertTrue(results[0].failed)
+        self.assertEqual(str(results[0])[:22], "foo: failed (denied) i")
+        self.assertEqual(results[1].action, "deployed")
+
+    @patch.object(portinus, 'get_service_names', return_value=["bar", "old"])
+    @patch.object(portinus, 'Application')
+    def test_apply_prune(self, fake_application, fake_get_service_names):
+        apps = [{"name": "bar", "source": "/bar"}]
+        results = fleet.apply(apps)
+        self.assertEqual(len(results), 1)
+
+        results = fleet.apply(apps, prune=True)
+        self.assertEqual([(x.name, x.action) for x in results], [("bar", "deployed"), ("old", "removed")])
+        fake_application.assert_called_with("old")
+        transaction = fake_application().remove.call_args[0][0]
+        self.assertIsInstance(transaction, portinus.systemd.Transaction)
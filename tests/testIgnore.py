@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from portinus.ignore import IgnoreRules
+
+
+class testIgnoreRules(unittest.TestCase):
+
+    def test_empty(self):
+        rules = IgnoreRules(["", "# comment", "  "])
+        self.assertFalse(rules)
+        self.assertFalse(rules.ignored("foo"))
+
+    def test_patterns(self):
+        rules = IgnoreRules(["*.pyc", "/build", "docs/*.md", "data?"])
+        self.assertTrue(rules)
+        self.assertTrue(rules.ignored("foo.pyc"))
+        self.assertFalse(rules.ignored("src/foo.pyc"))
+        self.assertTrue(rules.ignored("build"))
+        self.assertTrue(rules.ignored("build/lib/foo.py"))
+        self.assertTrue(rules.ignored("docs/index.md"))
+        self.assertFalse(rules.ignored("docs/api/index.md"))
+        self.assertTrue(rules.ignored("data1"))
+        self.assertFalse(rules.ignored("data10"))
+        self.assertFalse(rules.ignored("README.md"))
+
+    def test_double_star(self):
+        rules = IgnoreRules(["**/*.log", "cache/**"])
+        self.assertTrue(rules.ignored("debug.log"))
+        self.assertTrue(rules.ignored("logs/app/debug.log"))
+        self.assertTrue(rules.ignored("cache/a/b"))
+        self.assertFalse(rules.ignored("cache"))
+        self.assertFalse(rules.ignored("debug.txt"))
+
+    def test_exceptions(self):
+        rules = IgnoreRules(["*.md", "!README.md", "README.md.bak"])
+        self.assertTrue(rules.has_exceptions)
+        self.assertTrue(rules.ignored("CHANGES.md"))
+        self.assertFalse(rules.ignored("README.md"))
+        self.assertTrue(rules.ignored("README.md.bak"))
+        self.assertFalse(IgnoreRules(["*.md"]).has_exceptions)
+
+    def test_character_class(self):
+        rules = IgnoreRules(["file[0-9]", "tmp[!a]"])
+        self.assertTrue(rules.ignored("file1"))
+        self.assertFalse(rules.ignored("filex"))
+        self.assertTrue(rules.ignored("tmpb"))
+        self.assertFalse(rules.ignored("tmpa"))
+
+    def test_add(self):
+        rules = IgnoreRules(["*.md"]) + IgnoreRules(["!README.md"])
+        self.assertTrue(rules.ignored("CHANGES.md"))
+        self.assertFalse(rules.ignored("README.md"))
+
+    def test_gitignore(self):
+        rules = IgnoreRules(["*.log", "/build", "node_modules/", "docs/*.md"], gitignore=True)
+        self.assertTrue(rules.ignored("debug.log"))
+        self.assertTrue(rules.ignored("app/logs/debug.log"))
+        self.assertTrue(rules.ignored("build"))
+        self.assertFalse(rules.ignored("app/build"))
+        self.assertTrue(rules.ignored("app/node_modules", is_dir=True))
+        self.assertTrue(rules.ignored("app/node_modules/foo/index.js"))
+        self.assertFalse(rules.ignored("node_modules"))
+        self.assertTrue(rules.ignored("docs/README.md"))
+        self.assertFalse(rules.ignored("app/docs/README.md"))
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp).joinpath(".dockerignore")
+            self.assertFalse(IgnoreRules.load(path))
+            path.write_text("*.pyc\n# comment\n")
+            self.assertTrue(IgnoreRules.load(path).ignored("foo.pyc"))
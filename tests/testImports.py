@@ -0,0 +1,36 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# Modules that are slow to import and only needed by some commands
+HEAVY_MODULES = ("asyncio", "concurrent.futures", "docker", "http.server", "jeepney", "jinja2", "requests", "yaml")
+
+
+def get_imported(code):
+    """
+    Returns which of the heavy modules are loaded after running 'code' in a
+    fresh interpreter
+    """
+    script = "import sys\n{code}\nimport json\nprint(json.dumps([x for x in {modules!r} if x in sys.modules]))".format(
+        code=code, modules=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    return json.loads(output.decode().splitlines()[-1])
+
+
+class testImports(unittest.TestCase):
+
+    def test_import_portinus(self):
+        self.assertEqual(get_imported("import portinus"), [])
+
+    def test_import_cli(self):
+        self.assertEqual(get_imported("import portinus.cli"), [])
+
+    def test_import_monitor_cli(self):
+        self.assertEqual(get_imported("import portinus.monitor.cli"), [])
+
+    def test_application(self):
+        self.assertEqual(get_imported("import portinus\nportinus.Application('foo')"), [])
+
+    def test_get_template(self):
+        self.assertEqual(get_imported("import portinus\nportinus.get_template('instance.service')"), ["jinja2"])
@@ -1,5 +1,7 @@
+import os
 from pathlib import Path
-from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, ANY
 import unittest
 
 import jinja2
@@ -25,18 +27,48 @@ class testInit(unittest.TestCase):
         self.assertEqual(str(fake_print.mock_calls[-2]), "call('bar')")
         self.assertEqual(str(fake_print.mock_calls[-1]), "call('baz')")
 
+    @patch.object(portinus, 'service_dir', portinus_dir)
+    def test_get_service_names(self):
+        self.assertEqual(portinus.get_service_names(), ['bar', 'baz'])
+
+    @patch.object(portinus, 'service_dir', test_data_dir.joinpath('i-dont-exist'))
+    def test_get_service_names_no_dir(self):
+        self.assertEqual(portinus.get_service_names(), [])
+
     def test_get_instance_dir(self):
         portinus.get_instance_dir('foo')
 
     def test_get_template(self):
         template = portinus.get_template('instance.service')
         self.assertTrue(isinstance(template, jinja2.Template))
+        self.assertIs(portinus.get_template('instance.service'), template)
+
+    def test_get_template_override(self):
+        with TemporaryDirectory() as tmp, \
+                patch.object(portinus, 'template_override_dir', Path(tmp)), \
+                patch.object(portinus, '_template_environment', None):
+            template = portinus.get_template('restart.timer')
+            self.assertIs(portinus.get_template('restart.timer'), template)
+
+            override = Path(tmp).joinpath('restart.timer')
+            override.write_text("custom {{ name }}")
+            self.assertEqual(portinus.get_template('restart.timer').render(name="foo"), "custom foo")
+
+            override.write_text("changed {{ name }}")
+            os.utime(str(override), (0, 0))
+            self.assertEqual(portinus.get_template('restart.timer').render(name="foo"), "changed foo")
+
+            override.unlink()
+            self.assertEqual(portinus.get_template('restart.timer').filename, str(portinus.template_dir.joinpath('restart.timer')))
 
 
 class testApplication(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.source = TemporaryDirectory()
+
+    def tearDown(self):
+        self.source.cleanup()
 
     @patch.object(portinus.restart, 'Timer')
     @patch.object(portinus.monitor, 'Service')
@@ -51,33 +83,174 @@ class testApplication(unittest.TestCase):
         self.assertTrue(fake_environment_file.called)
 
     @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Policy')
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(portinus, 'Service')
+    @patch.object(portinus, 'EnvironmentFile')
+    def test_init_monitor_settings(self, fake_environment_file, fake_service,
+                                   fake_monitor_service, fake_monitor_policy,
+                                   fake_restart_timer):
+        Application('foo', monitor_settings={"remediation": "service"})
+        fake_monitor_policy.assert_called_with('foo', remediation="service")
+
+    @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Policy')
     @patch.object(portinus.monitor, 'Service')
     @patch.object(portinus, 'Service')
     @patch.object(portinus, 'EnvironmentFile')
     @patch.object(portinus, '_ensure_service_dir')
-    def test_ensure(self, fake__ensure_service_dir, fake_environment_file,
-                    fake_service, fake_monitor_service, fake_restart_timer):
-        app = Application('foo')
-        app.ensure()
+    @patch.object(Application, 'fingerprint', return_value="abc")
+    def test_ensure(self, fake_fingerprint, fake__ensure_service_dir, fake_environment_file,
+                    fake_service, fake_monitor_service, fake_monitor_policy,
+                    fake_restart_timer):
+        with TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            app = Application('foo')
+            self.assertTrue(app.ensure())
+            self.assertEqual(app.deployed_fingerprint(), "abc")
 
         self.assertTrue(fake__ensure_service_dir.called)
-        self.assertTrue(fake_environment_file().ensure.called)
-        self.assertTrue(fake_service().ensure.called)
+        self.assertFalse(fake_environment_file().ensure.called)
+        fake_service().ensure.assert_called_with(ANY, rebuild=False, environment_file=fake_environment_file())
+        self.assertTrue(fake_monitor_service().record_deploy.called)
         self.assertTrue(fake_monitor_service().ensure.called)
+        self.assertTrue(fake_monitor_policy().ensure.called)
         self.assertTrue(fake_restart_timer().ensure.called)
 
+        transaction = fake_service().ensure.call_args[0][0]
+        self.assertIsInstance(transaction, portinus.systemd.Transaction)
+        fake_restart_timer().ensure.assert_called_with(transaction)
+        fake_monitor_service().ensure.assert_called_with(transaction)
+
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Policy')
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(portinus, 'Service')
+    @patch.object(portinus, 'EnvironmentFile')
+    @patch.object(portinus, '_ensure_service_dir')
+    @patch.object(Application, 'fingerprint', return_value="abc")
+    def test_ensure_failure_starts_service(self, fake_fingerprint, fake__ensure_service_dir, fake_environment_file,
+                                           fake_service, fake_monitor_service, fake_monitor_policy,
+                                           fake_restart_timer, fake_commit):
+        fake_monitor_policy().ensure.side_effect = OSError("qwe")
+        with TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            app = Application('foo')
+            with self.assertRaises(OSError):
+                app.ensure()
+            self.assertIsNone(app.deployed_fingerprint())
+        self.assertTrue(fake_service().ensure.called)
+        fake_commit.assert_called_once_with()
+
+    @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Policy')
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(portinus, 'Service')
+    @patch.object(portinus, 'EnvironmentFile')
+    @patch.object(portinus, '_ensure_service_dir')
+    @patch.object(Application, 'fingerprint', return_value="abc")
+    def test_ensure_unchanged(self, fake_fingerprint, fake__ensure_service_dir, fake_environment_file,
+                              fake_service, fake_monitor_service, fake_monitor_policy,
+                              fake_restart_timer):
+        with TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            app = Application('foo')
+            app.fingerprint_path.write_text("abc\n")
+            self.assertFalse(app.ensure())
+            self.assertFalse(fake_service().ensure.called)
+
+            self.assertTrue(app.ensure(force=True))
+            self.assertTrue(fake_service().ensure.called)
+
+    @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Policy')
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(portinus, 'Service')
+    @patch.object(portinus, 'EnvironmentFile')
+    @patch.object(portinus, '_ensure_service_dir')
+    @patch.object(Application, 'fingerprint', return_value="abc")
+    def test_ensure_not_deployed(self, fake_fingerprint, fake__ensure_service_dir, fake_environment_file,
+                                 fake_service, fake_monitor_service, fake_monitor_policy,
+                                 fake_restart_timer):
+        fake_service().exists.return_value = False
+        with TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            app = Application('foo')
+            app.fingerprint_path.write_text("abc\n")
+            self.assertTrue(app.ensure())
+            self.assertTrue(fake_service().ensure.called)
+
+    @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(portinus, 'Service')
+    def test_fingerprint(self, fake_service, fake_monitor_service, fake_restart_timer):
+        fake_service().source = str(Path(self.source.name))
+        fake_service().exclude = ()
+        fake_service().get_ignore_rules.return_value = portinus.ignore.IgnoreRules(["*.log"], gitignore=True)
+        fake_service()._generate_service_file.return_value = "[Unit]"
+        fake_service()._generate_service_script.return_value = "#!/bin/bash"
+        fake_restart_timer().restart_schedule = None
+        fake_restart_timer().__bool__.return_value = False
+        fake_monitor_service()._generate_service_file.return_value = "[Unit]"
+        fake_monitor_service()._generate_timer_file.return_value = "[Timer]"
+        with patch.object(portinus, 'service_dir', Path(self.source.name)):
+            app = Application('foo')
+            fingerprint = app.fingerprint()
+            self.assertEqual(app.fingerprint(), fingerprint)
+
+            Path(self.source.name, "docker-compose.yml").write_text("version: '3'\n")
+            self.assertNotEqual(app.fingerprint(), fingerprint)
+            fingerprint = app.fingerprint()
+
+            Path(self.source.name, "debug.log").write_text("qwe")
+            self.assertEqual(app.fingerprint(), fingerprint)
+
+            fake_service().exclude = ("data/",)
+            self.assertNotEqual(app.fingerprint(), fingerprint)
+            fingerprint = app.fingerprint()
+
+            app.monitor_policy = portinus.monitor.Policy('foo', remediation="service")
+            self.assertNotEqual(app.fingerprint(), fingerprint)
+            fingerprint = app.fingerprint()
+            fake_monitor_service()._generate_timer_file.assert_called_with(app.monitor_policy.interval)
+
+            fake_service()._generate_service_script.return_value = "#!/bin/bash\nset -x"
+            self.assertNotEqual(app.fingerprint(), fingerprint)
+            fingerprint = app.fingerprint()
+
+            fake_monitor_service()._generate_timer_file.return_value = "[Timer]\nPersistent=true"
+            self.assertNotEqual(app.fingerprint(), fingerprint)
+
+    @patch.object(portinus, 'ComposeSource')
+    def test_init_builds_one_service(self, fake_compose_source):
+        app = Application('foo')
+        self.assertEqual(fake_compose_source.call_count, 1)
+        self.assertEqual(app.restart_timer._systemd_timer.service_name, "portinus-foo-restart.timer")
+        self.assertEqual(app.monitor_service._systemd_timer.service_name, "portinus-foo-monitor.timer")
+
+    @patch.object(portinus, 'Service')
+    def test_rollback(self, fake_service):
+        fake_service().rollback.return_value = '0001'
+        with TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            app = Application('foo')
+            app.fingerprint_path.write_text("abc\n")
+            self.assertEqual(app.rollback(), '0001')
+            self.assertIsNone(app.deployed_fingerprint())
+
     @patch.object(portinus.restart, 'Timer')
+    @patch.object(portinus.monitor, 'State')
+    @patch.object(portinus.monitor, 'Policy')
     @patch.object(portinus.monitor, 'Service')
     @patch.object(portinus, 'Service')
     @patch.object(portinus, 'EnvironmentFile')
     def test_remove(self, fake_environment_file,
-                    fake_service, fake_monitor_service, fake_restart_timer):
+                    fake_service, fake_monitor_service, fake_monitor_policy,
+                    fake_monitor_state, fake_restart_timer):
         app = Application('foo')
         app.remove()
 
         self.assertTrue(fake_environment_file().remove.called)
         self.assertTrue(fake_service().remove.called)
         self.assertTrue(fake_monitor_service().remove.called)
+        self.assertTrue(fake_monitor_policy().remove.called)
+        self.assertTrue(fake_monitor_state().remove.called)
         self.assertTrue(fake_restart_timer().remove.called)
 
     def test__ensure_service_dir(self):
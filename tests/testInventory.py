@@ -0,0 +1,92 @@
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import portinus
+from portinus import inventory, systemd
+from portinus.monitor.state import State
+
+
+class testInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.service_dir))
+        self.unit_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.unit_dir))
+        for patcher in (patch.object(portinus, 'service_dir', self.service_dir),
+                        patch.object(systemd, 'UNIT_DIR', str(self.unit_dir))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.backend = systemd.FakeBackend()
+        systemd.set_backend(self.backend)
+        self.addCleanup(systemd.set_backend, None)
+
+    def _install(self, *units):
+        for unit in units:
+            self.unit_dir.joinpath(unit).write_text("qwe")
+        self.backend.start([x for x in units if not x.endswith("-restart.timer")])
+        self.backend.enable(list(units))
+
+    def _deploy(self, name):
+        releases = portinus.releases.Releases(name)
+        releases.prepare_staging()
+        releases.staging_path.mkdir()
+        return releases.commit()
+
+    def test_get_unit_names(self):
+        self.assertEqual(inventory.get_unit_names('foo'),
+                         ('portinus-foo.service', 'portinus-foo-restart.timer', 'portinus-foo-monitor.timer'))
+
+    def test_get_statuses(self):
+        self._install('portinus-foo.service', 'portinus-foo-restart.timer', 'portinus-foo-monitor.timer')
+        self._deploy('foo')
+        state = State('foo')
+        state.record_result("healthy", now=1000)
+        state.save()
+
+        foo, = inventory.get_statuses(['foo'])
+        self.assertEqual([x[0] for x in self.backend.calls].count("get_unit_states"), 1)
+        self.assertEqual(foo.service, "active (running)")
+        self.assertEqual(foo.enabled, "enabled")
+        self.assertEqual(foo.restart_timer, "inactive")
+        self.assertEqual(foo.monitor, "active")
+        self.assertEqual((foo.monitor_result, foo.monitor_result_since), ("healthy", 1000))
+        self.assertEqual(foo.release, "0001")
+        self.assertIsNotNone(foo.deployed)
+
+    def test_get_statuses_not_installed(self):
+        foo, = inventory.get_statuses(['foo'])
+        self.assertEqual(foo.service, "not-found")
+        self.assertIsNone(foo.monitor)
+        self.assertIsNone(foo.release)
+        self.assertEqual(foo.to_row(), ['foo', 'not-found', '-', '-', '-', '-', '-', '-'])
+
+    def test_get_statuses_host_monitor(self):
+        self._install('portinus-foo.service', 'portinus-monitor-daemon.service')
+        foo, = inventory.get_statuses(['foo'])
+        self.assertEqual(foo.monitor, "host")
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar', 'foo'])
+    def test_get_statuses_installed(self, fake_get_service_names):
+        self.assertEqual([x.name for x in inventory.get_statuses()], ['bar', 'foo'])
+        self.assertEqual(len(self.backend.calls), 1)
+
+    def test_format_table(self):
+        foo = inventory.ServiceStatus('foo')
+        foo.service = "active (running)"
+        foo.monitor_result, foo.monitor_result_since = "healthy", 1000
+        bar = inventory.ServiceStatus('a-longer-name')
+        lines = inventory.format_table([foo, bar]).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("NAME           SERVICE"))
+        self.assertIn("healthy since ", lines[1])
+        self.assertEqual(lines[1].index("active"), lines[0].index("SERVICE"))
+
+    def test_format_json(self):
+        foo = inventory.ServiceStatus('foo')
+        foo.deployed = 1000
+        self.assertEqual(json.loads(inventory.format_json([foo])), [foo.to_dict()])
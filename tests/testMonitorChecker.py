@@ -1,6 +1,12 @@
+import shutil
+import tempfile
+import time
 import unittest
+from pathlib import Path
 from unittest.mock import patch
 
+import docker
+
 import portinus
 from portinus.monitor import checker
 
@@ -8,6 +14,12 @@ from portinus.monitor import checker
 class testMonitorChecker(unittest.TestCase):
 
     def setUp(self):
+        checker._client = None
+        service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(service_dir))
+        patcher = patch.object(portinus, 'service_dir', service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.container_string = \
             "containerid1\n" \
             "containerid2\n" \
@@ -41,48 +53,113 @@ class testMonitorChecker(unittest.TestCase):
         container.attrs = {"State": {"Health":{"Status": "unhealthy"}}}
         self.assertFalse(checker.check_container_health(container))
 
+    @patch.object(portinus.EnvironmentFile, 'read', return_value={})
+    def test_get_project_name(self, fake_read):
+        self.assertEqual(checker.get_project_name('foo'), 'foo')
+        self.assertEqual(checker.get_project_name('Foo-Bar_1.2'), 'foobar12')
+
+    @patch.object(portinus.EnvironmentFile, 'read', return_value={"COMPOSE_PROJECT_NAME": "Qwe-1"})
+    def test_get_project_name_from_environment(self, fake_read):
+        self.assertEqual(checker.get_project_name('foo'), 'qwe1')
+
+    @patch.object(checker, 'get_project_name', return_value='foo')
+    @patch.object(checker, 'get_client')
+    def test_get_project_container_ids(self, fake_get_client, fake_get_project_name):
+        fake_get_client().api.containers.return_value = [{"Id": x} for x in self.container_list]
+
+        result = checker.get_project_container_ids('foo')
+        self.assertEqual(result, self.container_list)
+        fake_get_client().api.containers.assert_called_with(
+                all=True, quiet=True, filters={"label": "com.docker.compose.project=foo"})
+
+    @patch.object(checker, 'get_compose_ps_container_ids')
+    @patch.object(checker, 'get_project_container_ids')
+    def test_get_compose_container_ids_from_labels(self, fake_get_project_container_ids,
+                                                   fake_get_compose_ps_container_ids):
+        fake_get_project_container_ids.return_value = self.container_list
+
+        result = checker.get_compose_container_ids('foo')
+        self.assertEqual(result, self.container_list)
+        self.assertFalse(fake_get_compose_ps_container_ids.called)
+
+    @patch.object(checker, 'get_compose_ps_container_ids')
+    @patch.object(checker, 'get_project_container_ids', return_value=[])
+    def test_get_compose_container_ids_fallback(self, fake_get_project_container_ids,
+                                                fake_get_compose_ps_container_ids):
+        fake_get_compose_ps_container_ids.return_value = self.container_list
+
+        result = checker.get_compose_container_ids('foo')
+        self.assertEqual(result, self.container_list)
+        fake_get_compose_ps_container_ids.assert_called_with('foo')
+
+    @patch.object(checker, 'get_compose_ps_container_ids')
+    @patch.object(checker, 'get_project_container_ids', side_effect=docker.errors.DockerException)
+    def test_get_compose_container_ids_docker_error(self, fake_get_project_container_ids,
+                                                    fake_get_compose_ps_container_ids):
+        fake_get_compose_ps_container_ids.return_value = self.container_list
+
+        result = checker.get_compose_container_ids('foo')
+        self.assertEqual(result, self.container_list)
+
     @patch.object(portinus, 'ComposeSource')
     @patch('subprocess.check_output')
-    def test_get_comopse_container_ids(self, fake_check_output, fake_compose_source):
+    def test_get_comopse_ps_container_ids(self, fake_check_output, fake_compose_source):
         fake_check_output().decode.return_value = self.container_string
         expected_result = self.container_list
 
-        result = checker.get_compose_container_ids('foo')
+        result = checker.get_compose_ps_container_ids('foo')
         self.assertEqual(result, expected_result)
 
     @patch('docker.from_env')
-    def test_get_monitored_containers(self, fake_docker):
-        fake_docker().containers.list.return_value = [
-            lambda: None,
-            lambda: None,
-            lambda: None,]
-        fake_docker().containers.list.return_value[0].attrs = {"State":{"Health"}}
-        fake_docker().containers.list.return_value[1].attrs = {"State":{"Health"}}
-        fake_docker().containers.list.return_value[2].attrs = {"State":{}}
-
-        monitored_containers = checker.get_monitored_containers()
-        self.assertEqual(len(monitored_containers),2)
+    def test_get_unhealthy_container_ids(self, fake_docker):
+        fake_docker().api.containers.return_value = [{"Id": "containerid1"}, {"Id": "containerid2"}]
 
+        unhealthy_container_ids = checker.get_unhealthy_container_ids()
+        self.assertEqual(unhealthy_container_ids, ["containerid1", "containerid2"])
+        fake_docker().api.containers.assert_called_with(filters={"health": "unhealthy"})
+
+    @patch.object(checker, 'get_client')
     @patch.object(checker, 'get_compose_container_ids')
-    @patch.object(checker, 'get_monitored_containers')
-    def test_monitored_compose_containers(self, fake_get_monitored_containers,
-                                          fake_get_compose_container_ids):
+    @patch.object(checker, 'get_unhealthy_container_ids')
+    def test_monitored_compose_containers(self, fake_get_unhealthy_container_ids,
+                                          fake_get_compose_container_ids,
+                                          fake_get_client):
         fake_get_compose_container_ids.return_value = self.container_list
-        fake_get_monitored_containers.return_value = [
-                lambda: None,
-                lambda: None,
-                lambda: None,
-                lambda: None,]
-
-         # Exists in self.container_list
-        fake_get_monitored_containers.return_value[0].id = self.container_list[0]
-        fake_get_monitored_containers.return_value[1].id = self.container_list[1]
-        fake_get_monitored_containers.return_value[2].id = self.container_list[3]
-        # Does not exist
-        fake_get_monitored_containers.return_value[3].id = "unmonitoredcontainerid20"
+        fake_get_unhealthy_container_ids.return_value = [
+                # Exists in self.container_list
+                self.container_list[0],
+                self.container_list[1],
+                self.container_list[3],
+                # Does not exist
+                "unmonitoredcontainerid20",]
 
         monitored_compose_containers = checker.get_monitored_compose_containers('foo')
         self.assertEqual(len(monitored_compose_containers),3)
+        self.assertEqual(fake_get_client().containers.get.call_count, 3)
+
+    @patch.object(checker, 'get_client')
+    @patch.object(checker, 'get_compose_container_ids')
+    @patch.object(checker, 'get_unhealthy_container_ids', return_value=[])
+    def test_monitored_compose_containers_none_unhealthy(self, fake_get_unhealthy_container_ids,
+                                                         fake_get_compose_container_ids,
+                                                         fake_get_client):
+        monitored_compose_containers = checker.get_monitored_compose_containers('foo')
+        self.assertEqual(monitored_compose_containers, [])
+        self.assertFalse(fake_get_compose_container_ids.called)
+        self.assertFalse(fake_get_client().containers.get.called)
+
+    @patch.object(checker, 'get_client')
+    @patch.object(checker, 'get_compose_container_ids')
+    @patch.object(checker, 'get_unhealthy_container_ids')
+    def test_monitored_compose_containers_removed(self, fake_get_unhealthy_container_ids,
+                                                  fake_get_compose_container_ids,
+                                                  fake_get_client):
+        fake_get_compose_container_ids.return_value = self.container_list
+        fake_get_unhealthy_container_ids.return_value = [self.container_list[0]]
+        fake_get_client().containers.get.side_effect = docker.errors.NotFound("gone")
+
+        monitored_compose_containers = checker.get_monitored_compose_containers('foo')
+        self.assertEqual(monitored_compose_containers, [])
 
     @patch.object(checker, 'check_container_health')
     @patch.object(checker, 'get_monitored_compose_containers')
@@ -99,16 +176,21 @@ class testMonitorChecker(unittest.TestCase):
         fake_get_monitored_compose_containers.return_value[1].attrs = {"Name": "bar"}
         fake_get_monitored_compose_containers.return_value[1].id = self.container_list[0]
 
-        ret = checker.run('foo')
+        with patch.object(portinus.monitor, 'Service') as fake_monitor_service, \
+                patch.object(checker, 'get_project_container_ids', return_value=self.container_list):
+            ret = checker.run('foo')
+            self.assertTrue(fake_monitor_service('foo').reschedule.called)
         self.assertTrue(ret)
         self.assertFalse(fake_service().restart.called)
 
+    @patch.object(checker.State, 'save')
     @patch.object(checker, 'check_container_health')
     @patch.object(checker, 'get_monitored_compose_containers')
     @patch.object(portinus, 'Service')
     def test_run_unhealthy(self, fake_service,
                          fake_get_monitored_compose_containers,
-                         fake_check_container_health):
+                         fake_check_container_health,
+                         fake_save):
         fake_check_container_health.return_value = False
         fake_get_monitored_compose_containers.return_value = [
                 lambda: None,
@@ -118,6 +200,207 @@ class testMonitorChecker(unittest.TestCase):
         fake_get_monitored_compose_containers.return_value[1].attrs = {"Name": "bar"}
         fake_get_monitored_compose_containers.return_value[1].id = self.container_list[0]
 
-        ret = checker.run('foo')
+        with patch.object(portinus.monitor, 'Service'), \
+                patch.object(checker, 'get_project_container_ids', side_effect=docker.errors.DockerException):
+            ret = checker.run('foo')
         self.assertFalse(ret)
         self.assertTrue(fake_service().restart.called)
+
+    @patch.object(portinus, 'Service')
+    def test_check_healthy(self, fake_service):
+        container = lambda: None
+        container.id = self.container_list[0]
+        container.attrs = {"Name": "foo", "State": {"Health": {"Status": "healthy"}}}
+
+        result = checker.check('foo', [container])
+        self.assertTrue(result.healthy)
+        self.assertFalse(result.restarted)
+        self.assertFalse(fake_service().restart.called)
+
+    @patch.object(checker.State, 'save')
+    @patch.object(portinus, 'Service')
+    def test_check_unhealthy(self, fake_service, fake_save):
+        container = lambda: None
+        container.id = self.container_list[0]
+        container.attrs = {"Name": "foo", "State": {"Health": {"Status": "unhealthy"}}}
+
+        result = checker.check('foo', [container])
+        self.assertFalse(result.healthy)
+        self.assertTrue(result.restarted)
+        self.assertEqual(result.unhealthy, ["foo"])
+        self.assertTrue(fake_service().restart.called)
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar', 'foo', 'qwe'])
+    @patch.object(checker, 'get_project_name', side_effect=lambda x: x)
+    @patch.object(checker, 'inspect')
+    @patch.object(checker, 'get_client')
+    def test_run_all(self, fake_get_client, fake_inspect, fake_get_project_name, fake_get_service_names):
+        fake_get_client().api.containers.return_value = [
+                {"Id": "containerid1", "Status": "Up 2 hours (healthy)", "Labels": {checker.PROJECT_LABEL: "foo"}},
+                {"Id": "containerid2", "Status": "Up 2 hours (unhealthy)", "Labels": {checker.PROJECT_LABEL: "foo"}},
+                {"Id": "containerid3", "Status": "Up 2 hours", "Labels": {checker.PROJECT_LABEL: "bar"}},
+                {"Id": "containerid4", "Status": "Up 2 hours (unhealthy)", "Labels": {checker.PROJECT_LABEL: "other"}},]
+        fake_inspect.side_effect = lambda name, containers: checker.CheckResult(name)
+
+        results = checker.run_all()
+        self.assertEqual(fake_get_client().api.containers.call_count, 1)
+        self.assertEqual([x.name for x in results], ['bar', 'foo', 'qwe'])
+        self.assertEqual([x.containers for x in results], [1, 2, 0])
+        fake_get_client().containers.get.assert_called_once_with("containerid2")
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar', 'foo'])
+    @patch.object(checker, 'get_project_name', side_effect=lambda x: x)
+    @patch.object(checker, 'inspect')
+    @patch.object(checker, 'get_client')
+    def test_run_all_exception(self, fake_get_client, fake_inspect, fake_get_project_name, fake_get_service_names):
+        fake_get_client().api.containers.return_value = []
+        def inspect(name, containers):
+            if name == 'bar':
+                raise Exception("qwe")
+            return checker.CheckResult(name)
+        fake_inspect.side_effect = inspect
+
+        results = checker.run_all()
+        self.assertFalse(results[0].healthy)
+        self.assertTrue(results[1].healthy)
+
+    @patch.object(portinus, 'get_service_names', return_value=['foo'])
+    @patch.object(checker, 'get_project_name', side_effect=lambda x: x)
+    @patch.object(checker, 'remediate')
+    @patch.object(checker, 'get_client')
+    def test_run_all_unhealthy(self, fake_get_client, fake_remediate, fake_get_project_name, fake_get_service_names):
+        fake_get_client().api.containers.return_value = [
+                {"Id": "containerid1", "Status": "Up 2 hours (unhealthy)", "Labels": {checker.PROJECT_LABEL: "foo"}},]
+        fake_get_client().containers.get.return_value.attrs = {"Name": "foo_web_1", "State": {"Health": {"Status": "unhealthy"}}}
+
+        results = checker.run_all()
+        self.assertEqual(results[0].unhealthy, ["foo_web_1"])
+        fake_remediate.assert_called_with(results[0])
+
+    def unhealthy_result(self):
+        result = checker.CheckResult('foo')
+        result.unhealthy = ['foo_web_1']
+        result.unhealthy_services = ['web']
+        return result
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_stack(self, fake_service, fake_load, fake_save):
+        fake_load.return_value = checker.Policy('foo')
+        result = self.unhealthy_result()
+
+        checker.remediate(result)
+        self.assertTrue(fake_service().restart.called)
+        self.assertFalse(fake_service().compose.called)
+        self.assertEqual(result.action, "stack")
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_service(self, fake_service, fake_policy_load, fake_state_load, fake_save):
+        fake_policy_load.return_value = checker.Policy('foo', remediation="service")
+        fake_state_load.return_value = checker.State('foo')
+        fake_service().compose.return_value = 0
+        result = self.unhealthy_result()
+
+        checker.remediate(result)
+        fake_service().compose.assert_called_with(["restart", "web"])
+        self.assertFalse(fake_service().restart.called)
+        self.assertTrue(result.restarted)
+        self.assertEqual(fake_state_load.return_value.result, "unhealthy (foo_web_1)")
+        self.assertEqual(fake_state_load.return_value.failures, {"web": 1})
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_recreate(self, fake_service, fake_policy_load, fake_state_load, fake_save):
+        fake_policy_load.return_value = checker.Policy('foo', remediation="recreate")
+        fake_state_load.return_value = checker.State('foo')
+        fake_service().compose.return_value = 0
+
+        checker.remediate(self.unhealthy_result())
+        fake_service().compose.assert_called_with(["up", "-d", "--no-deps", "--force-recreate", "web"])
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_service_escalates(self, fake_service, fake_policy_load, fake_state_load, fake_save):
+        fake_policy_load.return_value = checker.Policy('foo', remediation="service", escalate_after=2)
+        fake_state_load.return_value = checker.State('foo')
+        fake_state_load.return_value.failures = {"web": 2}
+        result = self.unhealthy_result()
+
+        checker.remediate(result)
+        self.assertFalse(fake_service().compose.called)
+        self.assertTrue(fake_service().restart.called)
+        self.assertEqual(result.action, "stack")
+        self.assertEqual(fake_state_load.return_value.failures, {})
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_service_failure_escalates(self, fake_service, fake_policy_load, fake_state_load, fake_save):
+        fake_policy_load.return_value = checker.Policy('foo', remediation="service")
+        fake_state_load.return_value = checker.State('foo')
+        fake_service().compose.return_value = 1
+
+        checker.remediate(self.unhealthy_result())
+        self.assertTrue(fake_service().restart.called)
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    @patch.object(checker.Policy, 'load')
+    @patch.object(portinus, 'Service')
+    def test_remediate_circuit_open(self, fake_service, fake_policy_load, fake_state_load, fake_save):
+        fake_policy_load.return_value = checker.Policy('foo')
+        fake_state_load.return_value = checker.State('foo')
+        fake_state_load.return_value.restarts = [time.time()] * 3
+        result = self.unhealthy_result()
+
+        checker.remediate(result)
+        self.assertFalse(fake_service().restart.called)
+        self.assertFalse(result.restarted)
+        self.assertEqual(fake_state_load.return_value.circuit, "open")
+        self.assertTrue(fake_save.called)
+
+    @patch.object(checker.State, 'save')
+    @patch.object(checker.State, 'load')
+    def test_record_healthy(self, fake_state_load, fake_save):
+        fake_state_load.return_value = checker.State('foo')
+        fake_state_load.return_value.failures = {"web": 1}
+        checker.record_healthy('foo')
+        self.assertEqual(fake_state_load.return_value.failures, {})
+        self.assertTrue(fake_save.called)
+
+        fake_save.reset_mock()
+        checker.record_healthy('foo')
+        self.assertFalse(fake_save.called)
+        self.assertEqual(fake_state_load.return_value.result, "healthy")
+
+    def test_inspect_services(self):
+        container = lambda: None
+        container.id = self.container_list[0]
+        container.attrs = {"Name": "foo_web_1",
+                           "Config": {"Labels": {checker.SERVICE_LABEL: "web"}},
+                           "State": {"Health": {"Status": "unhealthy"}}}
+
+        result = checker.inspect('foo', [container, container])
+        self.assertEqual(result.unhealthy_services, ["web"])
+
+    @patch.object(portinus.monitor, 'Service')
+    @patch.object(checker, 'get_project_container_ids')
+    @patch.object(checker, 'check')
+    @patch.object(checker, 'get_monitored_compose_containers')
+    def test_run_one(self, fake_get_monitored_compose_containers, fake_check,
+                     fake_get_project_container_ids, fake_monitor_service):
+        fake_check.return_value = checker.CheckResult('foo')
+        fake_get_project_container_ids.return_value = self.container_list
+
+        result = checker.run_one('foo')
+        self.assertEqual(result.containers, len(self.container_list))
+        self.assertIsNotNone(result.duration)
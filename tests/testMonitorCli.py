@@ -0,0 +1,97 @@
+from unittest.mock import patch
+import unittest
+
+from pathlib import Path
+
+from click.testing import CliRunner
+
+import portinus
+from portinus.monitor import checker, cli, metrics
+
+test_dir = Path(__file__).absolute().parent
+empty_dir = str(test_dir.joinpath("testdata", "empty_dir"))
+
+
+class testMonitorCli(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = CliRunner()
+
+    @patch.object(checker, 'run_one')
+    def test_check_name(self, fake_run_one):
+        result = self.runner.invoke(cli.check, ["--name", "foo"])
+        self.assertFalse(result.exception)
+        fake_run_one.assert_called_with('foo')
+
+    @patch.object(checker, 'run_one')
+    def test_check_no_args(self, fake_run_one):
+        result = self.runner.invoke(cli.check, [])
+        self.assertTrue(result.exception)
+        self.assertFalse(fake_run_one.called)
+
+    @patch.object(metrics, 'write_textfile')
+    @patch.object(checker, 'run_one')
+    def test_check_name_textfile(self, fake_run_one, fake_write_textfile):
+        fake_run_one.return_value = checker.CheckResult('foo')
+        result = self.runner.invoke(cli.check, ["--name", "foo", "--textfile-dir", empty_dir])
+        self.assertFalse(result.exception)
+        self.assertEqual(fake_write_textfile.call_args[0][:2], (empty_dir, "portinus_monitor_foo.prom"))
+
+    @patch.object(metrics, 'write_textfile')
+    @patch.object(checker, 'run_all')
+    def test_check_all_textfile(self, fake_run_all, fake_write_textfile):
+        fake_run_all.return_value = [checker.CheckResult('foo')]
+        result = self.runner.invoke(cli.check, ["--all", "--textfile-dir", empty_dir])
+        self.assertFalse(result.exception)
+        self.assertEqual(fake_write_textfile.call_args[0][:2], (empty_dir, "portinus_monitor.prom"))
+
+    @patch.object(checker, 'run_all')
+    def test_check_name_and_all(self, fake_run_all):
+        result = self.runner.invoke(cli.check, ["--name", "foo", "--all"])
+        self.assertTrue(result.exception)
+        self.assertFalse(fake_run_all.called)
+
+    @patch.object(checker, 'run_all')
+    def test_check_all_healthy(self, fake_run_all):
+        fake_run_all.return_value = [checker.CheckResult('foo'), checker.CheckResult('bar')]
+        result = self.runner.invoke(cli.check, ["--all", "--concurrency", "2", "--timeout", "5"])
+        self.assertEqual(result.exit_code, 0)
+        fake_run_all.assert_called_with(concurrency=2, timeout=5)
+        self.assertIn("foo: healthy", result.output)
+        self.assertIn("bar: healthy", result.output)
+
+    @patch.object(checker, 'run_all')
+    def test_check_all_invalid_limits(self, fake_run_all):
+        for args in (["--concurrency", "0"], ["--timeout", "0"], ["--timeout", "-5"]):
+            result = self.runner.invoke(cli.check, ["--all"] + args)
+            self.assertEqual(result.exit_code, 2)
+        self.assertFalse(fake_run_all.called)
+
+    @patch.object(checker, 'run_all')
+    def test_check_all_unhealthy(self, fake_run_all):
+        unhealthy = checker.CheckResult('bar')
+        unhealthy.unhealthy = ['bar_web_1']
+        fake_run_all.return_value = [checker.CheckResult('foo'), unhealthy]
+        result = self.runner.invoke(cli.check, ["--all"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("bar: unhealthy containers bar_web_1", result.output)
+
+    @patch.object(portinus.monitor, 'enable_daemon')
+    def test_enable_daemon(self, fake_enable_daemon):
+        result = self.runner.invoke(cli.enable_daemon, ["--interval", "60"])
+        self.assertFalse(result.exception)
+        fake_enable_daemon.assert_called_with(60)
+
+    @patch.object(portinus.monitor, 'enable_host_timer')
+    @patch.object(portinus.monitor, 'enable_daemon')
+    def test_invalid_interval(self, fake_enable_daemon, fake_enable_host_timer):
+        for command in (cli.enable_daemon, cli.enable_timer, cli.daemon):
+            result = self.runner.invoke(command, ["--interval", "0"])
+            self.assertEqual(result.exit_code, 2)
+        self.assertFalse(fake_enable_daemon.called)
+        self.assertFalse(fake_enable_host_timer.called)
+
+    @patch.object(portinus.monitor, 'enable_host_timer', side_effect=PermissionError)
+    def test_enable_timer_permission_error(self, fake_enable_host_timer):
+        result = self.runner.invoke(cli.enable_timer, [])
+        self.assertEqual(result.exit_code, 1)
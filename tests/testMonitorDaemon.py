@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import portinus
+from portinus.monitor import checker, daemon, metrics
+
+
+class testMonitorDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.unhealthy_event = {
+            "Type": "container",
+            "Action": "health_status: unhealthy",
+            "Actor": {"ID": "containerid1", "Attributes": {"name": "foo_web_1", "com.docker.compose.project": "foo"}},
+        }
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar', 'foo'])
+    def test_get_service_name(self, fake_get_service_names):
+        self.assertEqual(daemon.get_service_name('foo'), 'foo')
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar', 'foo'])
+    def test_get_service_name_unknown_project(self, fake_get_service_names):
+        self.assertIsNone(daemon.get_service_name('qwe'))
+        self.assertIsNone(daemon.get_service_name(None))
+
+    @patch.object(daemon, '_record')
+    @patch.object(portinus, 'get_service_names', return_value=['foo'])
+    @patch.object(checker, 'run_one')
+    def test_handle_event_unhealthy(self, fake_run_one, fake_get_service_names, fake__record):
+        fake_run_one.return_value.healthy = False
+        self.assertFalse(daemon.handle_event(self.unhealthy_event))
+        fake_run_one.assert_called_with('foo')
+        fake__record.assert_called_with([fake_run_one.return_value])
+
+    @patch.object(portinus, 'get_service_names', return_value=['foo'])
+    @patch.object(checker, 'run_one')
+    def test_handle_event_healthy(self, fake_run_one, fake_get_service_names):
+        self.unhealthy_event["Action"] = "health_status: healthy"
+        self.assertIsNone(daemon.handle_event(self.unhealthy_event))
+        self.assertFalse(fake_run_one.called)
+
+    @patch.object(portinus, 'get_service_names', return_value=['bar'])
+    @patch.object(checker, 'run_one')
+    def test_handle_event_unknown_project(self, fake_run_one, fake_get_service_names):
+        self.assertIsNone(daemon.handle_event(self.unhealthy_event))
+        self.assertFalse(fake_run_one.called)
+
+    @patch.object(checker, 'run_one', side_effect=Exception)
+    def test_check_exception(self, fake_run_one):
+        self.assertIsNone(daemon.check('foo'))
+
+    @patch.object(daemon, '_record')
+    @patch.object(checker, 'run_all')
+    def test_check_all(self, fake_run_all, fake__record):
+        daemon.check_all()
+        self.assertTrue(fake_run_all.called)
+        fake__record.assert_called_with(fake_run_all.return_value)
+
+    @patch.object(metrics, 'write_textfile')
+    @patch.object(daemon, '_textfile_dir', '/qwe')
+    def test__record(self, fake_write_textfile):
+        daemon._record([checker.CheckResult('foo')])
+        fake_write_textfile.assert_called_with('/qwe', daemon.TEXTFILE_NAME, daemon._registry)
+
+    @patch.object(checker, 'run_all', side_effect=Exception)
+    def test_check_all_exception(self, fake_run_all):
+        self.assertIsNone(daemon.check_all())
+
+    @patch.object(daemon, '_rescan_forever')
+    @patch.object(daemon, 'handle_event')
+    @patch.object(checker, 'get_client')
+    def test_run(self, fake_get_client, fake_handle_event, fake__rescan_forever):
+        fake_get_client().events.return_value = [self.unhealthy_event]
+        daemon.run()
+        fake_handle_event.assert_called_with(self.unhealthy_event)
+
+    @patch.object(metrics, 'serve')
+    @patch.object(daemon, '_rescan_forever')
+    @patch.object(checker, 'get_client')
+    def test_run_metrics_port(self, fake_get_client, fake__rescan_forever, fake_serve):
+        fake_get_client().events.return_value = []
+        daemon.run(metrics_port=9100)
+        fake_serve.assert_called_with(daemon._registry, 9100, "127.0.0.1")
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+from portinus.monitor import engine
+from portinus.monitor.result import CheckResult
+
+
+class testMonitorEngine(unittest.TestCase):
+
+    def healthy(self, name):
+        return CheckResult(name)
+
+    def unhealthy(self, name):
+        result = CheckResult(name)
+        result.unhealthy = ["{}_web_1".format(name)]
+        return result
+
+    def remediate(self, result):
+        result.restarted = True
+
+    def test_run_order(self):
+        results = engine.run(['foo', 'bar', 'baz'], self.healthy, self.remediate)
+        self.assertEqual([x.name for x in results], ['foo', 'bar', 'baz'])
+        self.assertTrue(all(x.healthy for x in results))
+        self.assertTrue(all(x.duration is not None for x in results))
+
+    def test_run_remediate(self):
+        results = engine.run(['foo'], self.unhealthy, self.remediate)
+        self.assertTrue(results[0].restarted)
+
+    def test_run_remediate_exception(self):
+        def remediate(result):
+            raise Exception("qwe")
+
+        results = engine.run(['foo'], self.unhealthy, remediate)
+        self.assertFalse(results[0].restarted)
+        self.assertIsNotNone(results[0].error)
+
+    def test_run_check_exception(self):
+        def check(name):
+            raise Exception("qwe")
+
+        results = engine.run(['foo'], check, self.remediate)
+        self.assertFalse(results[0].healthy)
+        self.assertFalse(results[0].restarted)
+
+    def test_run_timeout(self):
+        release = threading.Event()
+
+        def check(name):
+            if name == 'slow':
+                release.wait(5)
+            return self.unhealthy(name)
+
+        results = engine.run(['slow', 'foo'], check, self.remediate, timeout=0.1)
+        release.set()
+        self.assertIn("timed out", results[0].error)
+        self.assertFalse(results[0].restarted)
+        self.assertTrue(results[1].restarted)
+
+    def test_run_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def check(name):
+            with lock:
+                running.append(name)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(name)
+            return self.healthy(name)
+
+        engine.run([str(x) for x in range(6)], check, self.remediate, concurrency=2)
+        self.assertEqual(max(peak), 2)
+
+    def test_run_timeout_frees_slot(self):
+        release = threading.Event()
+
+        def check(name):
+            if name == 'hung':
+                release.wait(5)
+            return self.healthy(name)
+
+        start = time.monotonic()
+        results = engine.run(['hung', 'foo', 'bar', 'baz'], check, self.remediate, concurrency=1, timeout=0.2)
+        elapsed = time.monotonic() - start
+        release.set()
+        self.assertIn("timed out", results[0].error)
+        self.assertTrue(all(x.healthy for x in results[1:]))
+        self.assertLess(elapsed, 2)
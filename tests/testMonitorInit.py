@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import unittest
 
 from jinja2 import Template
@@ -11,11 +11,11 @@ class TestMonitorInit(unittest.TestCase):
     def setUp(self):
         pass
 
-    @patch('systemd_unit.Unit')
+    @patch('portinus.systemd.Unit')
     def test_init(self, fake_unit):
         res = portinus.monitor.Service('foo')
 
-    @patch('systemd_unit.Unit')
+    @patch('portinus.systemd.Unit')
     @patch('portinus.get_template')
     def test__generate_service_file(self, fake_get_template, fake_unit):
         service = portinus.monitor.Service('foo')
@@ -24,7 +24,7 @@ class TestMonitorInit(unittest.TestCase):
         output = service._generate_service_file()
         self.assertEqual(output, expected_output)
 
-    @patch('systemd_unit.Unit')
+    @patch('portinus.systemd.Unit')
     @patch('portinus.get_template')
     def test__generate_timer_file(self, fake_get_template, fake_unit):
         service = portinus.monitor.Service('foo')
@@ -33,14 +33,193 @@ class TestMonitorInit(unittest.TestCase):
         output = service._generate_service_file()
         self.assertEqual(output, expected_output)
         
-    @patch('systemd_unit.Unit')
-    def test_ensure(self, fake_unit):
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    @patch.object(portinus.monitor.State, 'save')
+    def test_ensure(self, fake_save, fake_ensure, fake_commit, fake_unit):
         service = portinus.monitor.Service('foo')
         service.ensure()
-        self.assertEqual(fake_unit().ensure.call_count, 2)
+        self.assertEqual(fake_ensure.call_count, 2)
+        self.assertEqual(fake_commit.call_count, 1)
+        self.assertTrue(fake_save.called)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.State, 'save')
+    def test_ensure_transaction(self, fake_save, fake_unit):
+        transaction = MagicMock()
+        portinus.monitor.Service('foo').ensure(transaction)
+        self.assertEqual(transaction.ensure.call_count, 2)
+        self.assertFalse(transaction.commit.called)
+
+    @patch('portinus.systemd.Unit')
+    @patch('portinus.get_template')
+    def test__generate_timer_file_interval(self, fake_get_template, fake_unit):
+        service = portinus.monitor.Service('foo')
+        fake_get_template.return_value = Template("{{name}} {{interval}}")
+        self.assertEqual(service._generate_timer_file(), "foo 300")
+        self.assertEqual(service._generate_timer_file(60), "foo 60")
+
+    @patch('portinus.systemd.Unit')
+    def test_get_offset(self, fake_unit):
+        foo = portinus.monitor.Service('foo')
+        bar = portinus.monitor.Service('bar')
+        self.assertEqual(foo.get_offset(300), portinus.monitor.Service('foo').get_offset(300))
+        self.assertNotEqual(foo.get_offset(300), bar.get_offset(300))
+        for name in ("app{}".format(x) for x in range(100)):
+            offset = portinus.monitor.Service(name).get_offset(300)
+            self.assertTrue(1 <= offset <= 300)
+        self.assertEqual(portinus.monitor.Service().get_offset(300), 300)
+
+    @patch('portinus.systemd.Unit')
+    def test__generate_timer_file_real_template(self, fake_unit):
+        service = portinus.monitor.Service('foo')
+        output = service._generate_timer_file(300)
+        self.assertIn("OnActiveSec={}\n".format(service.get_offset(300)), output)
+        self.assertIn("OnUnitActiveSec=300\n", output)
+        self.assertIn("RandomizedDelaySec=30\n", output)
+        self.assertIn("AccuracySec=1s\n", output)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Policy, 'load')
+    def test_get_interval(self, fake_load, fake_unit):
+        fake_load.return_value = portinus.monitor.Policy('foo', interval=120)
+        self.assertEqual(portinus.monitor.Service('foo').get_interval(), 120)
+        self.assertEqual(portinus.monitor.Service().get_interval(), 300)
+        self.assertEqual(portinus.monitor.Service(interval=60).get_interval(), 60)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.State, 'save')
+    @patch.object(portinus.monitor.State, 'load')
+    def test_record_deploy(self, fake_load, fake_save, fake_unit):
+        fake_load.return_value = portinus.monitor.State('foo')
+        portinus.monitor.Service('foo').record_deploy()
+        self.assertIsNotNone(fake_load.return_value.last_event)
+        self.assertTrue(fake_save.called)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'exists', return_value=True)
+    @patch.object(portinus.monitor.Service, 'get_interval', return_value=60)
+    @patch.object(portinus.monitor.State, 'save')
+    @patch.object(portinus.monitor.State, 'load')
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    def test_reschedule(self, fake_ensure, fake_commit, fake_load, fake_save, fake_get_interval, fake_exists, fake_unit):
+        fake_load.return_value = portinus.monitor.State('foo')
+        fake_load.return_value.scheduled_interval = 300
+        self.assertTrue(portinus.monitor.Service('foo').reschedule())
+        self.assertEqual(fake_ensure.call_count, 1)
+        self.assertTrue(fake_commit.called)
+        self.assertEqual(fake_load.return_value.scheduled_interval, 60)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'exists', return_value=True)
+    @patch.object(portinus.monitor.Service, 'get_interval', return_value=300)
+    @patch.object(portinus.monitor.State, 'load')
+    def test_reschedule_unchanged(self, fake_load, fake_get_interval, fake_exists, fake_unit):
+        fake_load.return_value = portinus.monitor.State('foo')
+        fake_load.return_value.scheduled_interval = 300
+        self.assertFalse(portinus.monitor.Service('foo').reschedule())
+        self.assertFalse(fake_unit().ensure.called)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'exists', return_value=False)
+    def test_reschedule_no_timer(self, fake_exists, fake_unit):
+        self.assertFalse(portinus.monitor.Service('foo').reschedule())
+        self.assertFalse(fake_unit().ensure.called)
         
-    @patch('systemd_unit.Unit')
-    def test_remove(self, fake_unit):
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'remove')
+    def test_remove(self, fake_remove, fake_commit, fake_unit):
         service = portinus.monitor.Service('foo')
         service.remove()
-        self.assertEqual(fake_unit().remove.call_count, 2)
+        self.assertEqual(fake_remove.call_count, 2)
+        self.assertTrue(fake_commit.called)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Daemon, 'exists', return_value=True)
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'remove')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    def test_ensure_daemon_installed(self, fake_ensure, fake_remove, fake_commit, fake_exists, fake_unit):
+        service = portinus.monitor.Service('foo')
+        service.ensure()
+        self.assertFalse(fake_ensure.called)
+        self.assertEqual(fake_remove.call_count, 2)
+
+
+class TestMonitorDaemon(unittest.TestCase):
+
+    @patch('portinus.systemd.Unit')
+    @patch('portinus.get_template')
+    def test__generate_service_file(self, fake_get_template, fake_unit):
+        fake_get_template.return_value = Template("qwe {{interval}} asd")
+        output = portinus.monitor.Daemon(60)._generate_service_file()
+        self.assertEqual(output, "qwe 60 asd")
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'remove')
+    @patch.object(portinus, 'get_service_names', return_value=['foo', 'bar'])
+    def test_enable_daemon(self, fake_get_service_names, fake_remove, fake_unit):
+        portinus.monitor.enable_daemon()
+        self.assertTrue(fake_unit().ensure.called)
+        self.assertEqual(fake_remove.call_count, 2)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'ensure')
+    @patch.object(portinus, 'get_service_names', return_value=['foo', 'bar'])
+    def test_disable_daemon(self, fake_get_service_names, fake_ensure, fake_unit):
+        portinus.monitor.disable_daemon()
+        self.assertTrue(fake_unit().remove.called)
+        self.assertEqual(fake_ensure.call_count, 2)
+
+
+class TestMonitorPath(unittest.TestCase):
+
+    def setUp(self):
+        portinus.monitor.get_portinus_monitor_path.cache_clear()
+        self.addCleanup(portinus.monitor.get_portinus_monitor_path.cache_clear)
+
+    @patch('shutil.which', return_value="/usr/bin/portinus-monitor")
+    def test_get_portinus_monitor_path(self, fake_which):
+        self.assertEqual(portinus.monitor.get_portinus_monitor_path(), "/usr/bin/portinus-monitor")
+        self.assertEqual(portinus.monitor.get_portinus_monitor_path(), "/usr/bin/portinus-monitor")
+        fake_which.assert_called_once_with("portinus-monitor")
+
+    @patch('shutil.which', return_value=None)
+    def test_get_portinus_monitor_path_missing(self, fake_which):
+        with self.assertRaises(FileNotFoundError):
+            portinus.monitor.get_portinus_monitor_path()
+
+
+class TestMonitorHostTimer(unittest.TestCase):
+
+    @patch('portinus.systemd.Unit')
+    def test_init(self, fake_unit):
+        portinus.monitor.Service()
+        fake_unit.assert_called_with("portinus-monitor", type="timer")
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor, 'get_portinus_monitor_path', return_value="/bin/portinus-monitor")
+    def test__generate_service_file(self, fake_get_portinus_monitor_path, fake_unit):
+        output = portinus.monitor.Service()._generate_service_file()
+        self.assertIn("ExecStart=/bin/portinus-monitor check --all", output)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Daemon, 'exists', return_value=True)
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    def test_ensure_with_daemon(self, fake_ensure, fake_commit, fake_exists, fake_unit):
+        portinus.monitor.Service().ensure()
+        self.assertEqual(fake_ensure.call_count, 2)
+
+    @patch('portinus.systemd.Unit')
+    @patch.object(portinus.monitor.Service, 'remove')
+    @patch.object(portinus, 'get_service_names', return_value=['foo', 'bar'])
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    def test_enable_host_timer(self, fake_ensure, fake_commit, fake_get_service_names, fake_remove, fake_unit):
+        portinus.monitor.enable_host_timer()
+        self.assertEqual(fake_ensure.call_count, 2)
+        self.assertEqual(fake_remove.call_count, 2)
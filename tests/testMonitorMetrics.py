@@ -0,0 +1,72 @@
+import os
+import tempfile
+import shutil
+import unittest
+import urllib.request
+from unittest.mock import patch
+
+from portinus.monitor import metrics
+from portinus.monitor.result import CheckResult
+from portinus.monitor.state import State
+
+
+class testMonitorMetrics(unittest.TestCase):
+
+    def setUp(self):
+        healthy = CheckResult('foo')
+        healthy.containers = 3
+        healthy.duration = 0.25
+        unhealthy = CheckResult('bar')
+        unhealthy.containers = 2
+        unhealthy.unhealthy = ['bar_web_1']
+        unhealthy.duration = 1.5
+        self.registry = metrics.Registry()
+        self.registry.update([healthy, unhealthy], now=1000)
+
+        restarted = State('bar')
+        restarted.restart_count = 4
+        restarted.last_restart = 900
+        patcher = patch.object(State, 'load', side_effect=lambda name: restarted if name == 'bar' else State(name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render(self):
+        output = self.registry.render(now=1000)
+        self.assertIn("# TYPE portinus_monitor_restarts_total counter\n", output)
+        self.assertIn('portinus_monitor_check_duration_seconds{service="foo"} 0.25\n', output)
+        self.assertIn('portinus_monitor_check_duration_seconds{service="bar"} 1.5\n', output)
+        self.assertIn('portinus_monitor_check_timestamp_seconds{service="foo"} 1000\n', output)
+        self.assertIn('portinus_monitor_check_success{service="foo"} 1\n', output)
+        self.assertIn('portinus_monitor_check_success{service="bar"} 0\n', output)
+        self.assertIn('portinus_monitor_containers{service="foo"} 3\n', output)
+        self.assertIn('portinus_monitor_unhealthy_containers{service="bar"} 1\n', output)
+        self.assertIn('portinus_monitor_restarts_total{service="foo"} 0\n', output)
+        self.assertIn('portinus_monitor_restarts_total{service="bar"} 4\n', output)
+        self.assertIn('portinus_monitor_seconds_since_last_restart{service="bar"} 100\n', output)
+        self.assertNotIn('portinus_monitor_seconds_since_last_restart{service="foo"}', output)
+
+    def test_render_empty(self):
+        output = metrics.Registry().render()
+        self.assertIn("# HELP portinus_monitor_containers", output)
+
+    def test_render_escapes_names(self):
+        registry = metrics.Registry()
+        registry.update([CheckResult('qwe"asd')])
+        self.assertIn('{service="qwe\\"asd"}', registry.render())
+
+    def test_write_textfile(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.write_textfile(directory, "portinus.prom", self.registry)
+        self.assertEqual(os.listdir(directory), ["portinus.prom"])
+        with open(os.path.join(directory, "portinus.prom")) as f:
+            self.assertIn('portinus_monitor_containers{service="foo"} 3', f.read())
+
+    def test_serve(self):
+        server = metrics.serve(self.registry, 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "http://127.0.0.1:{port}/metrics".format(port=server.server_port)
+        with urllib.request.urlopen(url) as response:
+            self.assertEqual(response.headers["Content-Type"], metrics.CONTENT_TYPE)
+            self.assertIn(b'portinus_monitor_containers{service="foo"} 3', response.read())
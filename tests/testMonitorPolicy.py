@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import portinus
+from portinus.monitor.policy import Policy
+from portinus.monitor.state import State
+
+
+class testMonitorPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.service_dir = Path(tempfile.mkdtemp())
+        patcher = patch.object(portinus, 'service_dir', self.service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, str(self.service_dir))
+
+    def test_init_defaults(self):
+        policy = Policy('foo')
+        self.assertEqual(policy.remediation, "stack")
+        self.assertEqual(policy.escalate_after, 3)
+        self.assertEqual(policy.path, self.service_dir.joinpath("foo.monitor"))
+
+    def test_init_none_uses_defaults(self):
+        policy = Policy('foo', remediation=None, escalate_after=None)
+        self.assertEqual(policy.remediation, "stack")
+
+    def test_init_invalid_remediation(self):
+        with self.assertRaises(ValueError):
+            Policy('foo', remediation="qwe")
+
+    def test_init_unknown_setting(self):
+        with self.assertRaises(ValueError):
+            Policy('foo', qwe=1)
+
+    def test_load_no_file(self):
+        policy = Policy.load('foo')
+        self.assertEqual(policy.settings, Policy('foo').settings)
+
+    def test_ensure_load(self):
+        Policy('foo', remediation="recreate", escalate_after=5).ensure()
+        policy = Policy.load('foo')
+        self.assertEqual(policy.remediation, "recreate")
+        self.assertEqual(policy.escalate_after, 5)
+
+    def test_remove(self):
+        policy = Policy('foo')
+        policy.ensure()
+        policy.remove()
+        self.assertFalse(policy.path.exists())
+
+    def test_remove_no_file(self):
+        Policy('foo').remove()
+
+    def test_get_interval_not_adaptive(self):
+        policy = Policy('foo', interval=120)
+        self.assertEqual(policy.get_interval(State('foo'), now=1000), 120)
+
+    def test_get_interval_adaptive(self):
+        policy = Policy('foo', interval=300, adaptive=True)
+        state = State('foo')
+        state.last_event = 100000
+        # Just deployed or failed
+        self.assertEqual(policy.get_interval(state, now=100010), 60)
+        # Settled
+        self.assertEqual(policy.get_interval(state, now=101000), 300)
+        # Stable for over a day
+        self.assertEqual(policy.get_interval(state, now=200000), 1200)
+
+    def test_get_interval_adaptive_minimum(self):
+        policy = Policy('foo', interval=60, adaptive=True)
+        state = State('foo')
+        state.last_event = 1000
+        self.assertEqual(policy.get_interval(state, now=1000), 30)
+        policy = Policy('foo', interval=10, adaptive=True)
+        self.assertEqual(policy.get_interval(state, now=1000), 10)
@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import portinus
+from portinus.monitor.policy import Policy
+from portinus.monitor.state import State
+
+
+class testMonitorState(unittest.TestCase):
+
+    def setUp(self):
+        self.service_dir = Path(tempfile.mkdtemp())
+        patcher = patch.object(portinus, 'service_dir', self.service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, str(self.service_dir))
+
+    def test_load_no_file(self):
+        state = State.load('foo')
+        self.assertEqual(state.failures, {})
+
+    def test_load_corrupt_file(self):
+        State('foo').path.write_text("qwe")
+        state = State.load('foo')
+        self.assertEqual(state.failures, {})
+
+    def test_save_load(self):
+        state = State('foo')
+        state.failures = {"web": 2}
+        state.save()
+        self.assertEqual(State.load('foo').failures, {"web": 2})
+
+    def test_record_failures(self):
+        state = State('foo')
+        self.assertEqual(state.record_failures(["web", "db"]), 1)
+        self.assertEqual(state.record_failures(["web"]), 2)
+        self.assertEqual(state.failures, {"web": 2})
+
+    def test_remove(self):
+        state = State('foo')
+        state.save()
+        state.remove()
+        self.assertFalse(state.path.exists())
+        state.remove()
+
+    def test_allow_restart_closed(self):
+        policy = Policy('foo', max_restarts=2, restart_window=100)
+        state = State('foo')
+        state.restarts = [0, 950]
+        self.assertTrue(state.allow_restart(policy, now=1000))
+        self.assertEqual(state.circuit, "closed")
+
+    def test_allow_restart_opens(self):
+        policy = Policy('foo', max_restarts=2, restart_window=100, restart_backoff=60)
+        state = State('foo')
+        state.restarts = [920, 950]
+        self.assertFalse(state.allow_restart(policy, now=1000))
+        self.assertEqual(state.circuit, "open")
+        self.assertEqual(state.opened_at, 1000)
+        self.assertEqual(state.backoff, 60)
+
+    def test_allow_restart_open_backoff(self):
+        policy = Policy('foo')
+        state = State('foo')
+        state.circuit, state.opened_at, state.backoff = "open", 1000, 60
+        self.assertFalse(state.allow_restart(policy, now=1059))
+        self.assertTrue(state.allow_restart(policy, now=1060))
+        self.assertEqual(state.circuit, "half-open")
+
+    def test_allow_restart_half_open_reopens(self):
+        policy = Policy('foo', max_restart_backoff=100)
+        state = State('foo')
+        state.circuit, state.opened_at, state.backoff = "half-open", 1000, 60
+        self.assertFalse(state.allow_restart(policy, now=2000))
+        self.assertEqual(state.circuit, "open")
+        self.assertEqual(state.backoff, 100)
+
+    def test_record_restart(self):
+        policy = Policy('foo', restart_window=100)
+        state = State('foo')
+        state.restarts = [0, 950]
+        state.record_restart(policy, now=1000)
+        self.assertEqual(state.restarts, [950, 1000])
+
+    def test_record_healthy(self):
+        state = State('foo')
+        self.assertFalse(state.record_healthy())
+        state.circuit, state.opened_at, state.backoff = "half-open", 1000, 60
+        self.assertTrue(state.record_healthy())
+        self.assertEqual(state.circuit, "closed")
+        self.assertIsNone(state.backoff)
+
+    def test_record_result(self):
+        state = State('foo')
+        self.assertTrue(state.record_result("healthy", now=1000))
+        self.assertFalse(state.record_result("healthy", now=1300))
+        self.assertEqual(state.result_since, 1000)
+        self.assertTrue(state.record_result("unhealthy (foo_web_1)", now=1600))
+        self.assertEqual(state.result_since, 1600)
+        state.save()
+        loaded = State.load('foo')
+        self.assertEqual((loaded.result, loaded.result_since), ("unhealthy (foo_web_1)", 1600))
+
+    def test_save_load_circuit(self):
+        state = State('foo')
+        state.circuit, state.opened_at, state.backoff = "open", 1000, 60
+        state.restarts = [1000]
+        state.save()
+        loaded = State.load('foo')
+        self.assertEqual(loaded.to_dict(), state.to_dict())
+
+    def test_describe(self):
+        state = State('foo')
+        self.assertIn("circuit closed", state.describe())
+        state.circuit, state.opened_at, state.backoff = "open", 1000, 60
+        self.assertIn("another 30s", state.describe(now=1030))
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import docker
+
+import portinus
+from portinus import releases
+
+
+class FakeImages(object):
+
+    def __init__(self, images):
+        self.images = images
+        self.tags = []
+        self.removed = []
+
+    def get(self, name):
+        if name not in self.images:
+            raise docker.errors.ImageNotFound(name)
+        image = MagicMock(id=self.images[name])
+        image.tag.side_effect = lambda repository, tag: self.tags.append((self.images[name], repository, tag))
+        return image
+
+    def remove(self, name, noprune=False):
+        self.removed.append(name)
+
+
+class testReleases(unittest.TestCase):
+
+    def setUp(self):
+        self.service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.service_dir))
+        patcher = patch.object(portinus, 'service_dir', self.service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _deploy(self, releases, content):
+        releases.prepare_staging()
+        releases.staging_path.mkdir(exist_ok=True)
+        releases.staging_path.joinpath('version').write_text(content)
+        return releases.commit({"images": {}})
+
+    def test_init_keep(self):
+        with self.assertRaises(ValueError):
+            releases.Releases('foo', keep=1)
+
+    def test_commit(self):
+        foo = releases.Releases('foo', keep=2)
+        self.assertIsNone(foo.active())
+        self.assertEqual(self._deploy(foo, '1'), '0001')
+        self.assertEqual(self._deploy(foo, '2'), '0002')
+        self.assertEqual(self._deploy(foo, '3'), '0003')
+        self.assertEqual(foo.list(), ['0002', '0003'])
+        self.assertEqual(foo.active(), '0003')
+        self.assertEqual(foo.previous(), '0002')
+        self.assertEqual(os.readlink(str(foo.link_path)), os.path.join('.releases', 'foo', '0003'))
+        self.assertEqual(foo.link_path.joinpath('version').read_text(), '3')
+        self.assertIn('deployed', foo.load_metadata('0003'))
+        self.assertEqual(foo.load_metadata('0001'), {})
+
+    def test_commit_environment(self):
+        foo = releases.Releases('foo', keep=2)
+        foo.prepare_staging()
+        foo.staging_path.mkdir()
+        foo.staging_environment_path.write_text('FOO=1\n')
+        foo.commit()
+        self.assertEqual(foo.get_environment_path('0001').read_text(), 'FOO=1\n')
+        self.assertFalse(foo.staging_environment_path.exists())
+
+        self._deploy(foo, '2')
+        self._deploy(foo, '3')
+        self.assertFalse(foo.get_environment_path('0001').exists())
+        self.assertFalse(foo.get_environment_path('0002').exists())
+
+    def test_activate(self):
+        foo = releases.Releases('foo')
+        self._deploy(foo, '1')
+        self._deploy(foo, '2')
+        foo.activate(foo.previous())
+        self.assertEqual(foo.link_path.joinpath('version').read_text(), '1')
+        self.assertIsNone(foo.previous())
+        with self.assertRaises(ValueError):
+            foo.activate('0005')
+
+    def test_prune_keeps_active(self):
+        foo = releases.Releases('foo', keep=2)
+        self._deploy(foo, '1')
+        self._deploy(foo, '2')
+        foo.activate('0001')
+        self._deploy(foo, '3')
+        self.assertEqual(foo.list(), ['0001', '0002'])
+        self.assertEqual(foo.link_path.joinpath('version').read_text(), '3')
+        self.assertEqual(foo.previous(), '0001')
+
+        foo.keep = 3
+        self._deploy(foo, '4')
+        foo.keep = 2
+        foo.prune()
+        self.assertEqual(foo.list(), ['0002', '0003'])
+
+    def test_remove(self):
+        foo = releases.Releases('foo')
+        self.assertFalse(foo.remove())
+        self._deploy(foo, '1')
+        self.assertTrue(foo.remove())
+        self.assertEqual(os.listdir(str(self.service_dir)), [])
+
+    def test_corrupt_metadata(self):
+        foo = releases.Releases('foo')
+        self._deploy(foo, '1')
+        foo.path.joinpath('0001.json').write_text('{')
+        self.assertEqual(foo.load_metadata('0001'), {})
+
+    @patch.object(portinus.monitor.checker, 'get_client')
+    def test_commit_pins_images(self, fake_get_client):
+        images = FakeImages({"sha256:1": "sha256:1"})
+        fake_get_client().images = images
+        foo = releases.Releases('foo', keep=2)
+        foo.prepare_staging()
+        foo.staging_path.mkdir()
+        foo.commit({"images": {"foo_web": "sha256:1"}})
+        self.assertEqual(images.tags, [("sha256:1", "foo_web", "portinus-release-0001")])
+
+        self._deploy(foo, '2')
+        self._deploy(foo, '3')
+        self.assertEqual(images.removed, ["foo_web:portinus-release-0001"])
+
+
+class testImages(unittest.TestCase):
+
+    @patch.object(portinus.monitor.checker, 'get_client')
+    def test_get_image_ids(self, fake_get_client):
+        fake_get_client().images = FakeImages({"foo_web": "sha256:1"})
+        self.assertEqual(releases.get_image_ids(["foo_web", "foo_worker"]), {"foo_web": "sha256:1"})
+
+    @patch.object(portinus.monitor.checker, 'get_client', side_effect=docker.errors.DockerException)
+    def test_get_image_ids_no_docker(self, fake_get_client):
+        self.assertEqual(releases.get_image_ids(["foo_web"]), {})
+        self.assertEqual(releases.get_image_ids([]), {})
+
+    @patch.object(portinus.monitor.checker, 'get_client')
+    def test_restore_images(self, fake_get_client):
+        images = FakeImages({"sha256:1": "sha256:1"})
+        fake_get_client().images = images
+        missing = releases.restore_images({"registry:5000/web:1.0": "sha256:1", "foo_worker": "sha256:2"})
+        self.assertEqual(missing, ["foo_worker"])
+        self.assertEqual(images.tags, [("sha256:1", "registry:5000/web", "1.0")])
+
+    def test__split_tag(self):
+        self.assertEqual(releases._split_tag("foo_web"), ("foo_web", "latest"))
+        self.assertEqual(releases._split_tag("web:1.0"), ("web", "1.0"))
+        self.assertEqual(releases._split_tag("registry:5000/web"), ("registry:5000/web", "latest"))
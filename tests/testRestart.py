@@ -2,10 +2,8 @@ import unittest
 from unittest import mock
 from unittest.mock import patch
 
-import systemd_unit
 from jinja2 import Template
-from systemd_unit import Unit
-from portinus import restart
+from portinus import restart, systemd
 
 class testRestart(unittest.TestCase):
 
@@ -22,9 +20,8 @@ class testRestart(unittest.TestCase):
 
     @patch("subprocess.check_output")
     def test_generate_service_file(self, fake_check_output):
-        service_name = Unit(self.name).service_name
         template = "qwe {{ name }} {{service_name}}"
-        expected_output = "qwe {} {}".format(self.name, service_name)
+        expected_output = "qwe foo portinus-foo.service"
         with patch("portinus.get_template", return_value=Template(template)) as fake_get_template:
             output = self.timer._generate_service_file()
             fake_get_template.assert_called_with("restart.service")
@@ -42,28 +39,43 @@ class testRestart(unittest.TestCase):
     @patch.object(restart.Timer, "remove")
     def test_ensure_remove(self, fake_remove):
         self.notimer.ensure()
-        fake_remove.assert_called_with()
+        fake_remove.assert_called_with(None)
 
     @patch.object(restart.Timer, "_generate_service_file", return_value="qwe")
     @patch.object(restart.Timer, "_generate_timer_file", return_value="qwe")
-    @patch.object(systemd_unit.Unit, "ensure")
+    @patch.object(systemd.Transaction, "commit")
+    @patch.object(systemd.Transaction, "ensure")
     def test_ensure_create(self,
-                           fake_unit_ensure,
+                           fake_transaction_ensure,
+                           fake_transaction_commit,
                            fake_generate_timer_file,
                            fake_generate_service_file):
         self.timer.ensure()
         fake_generate_timer_file.assert_called_with()
         fake_generate_service_file.assert_called_with()
+        self.assertEqual(fake_transaction_ensure.call_count, 2)
+        self.assertEqual(fake_transaction_commit.call_count, 1)
 
-    @patch.object(systemd_unit.Unit, "remove")
-    def test_remove_timer(self, fake_remove):
+    @patch.object(restart.Timer, "_generate_service_file", return_value="qwe")
+    @patch.object(restart.Timer, "_generate_timer_file", return_value="qwe")
+    def test_ensure_transaction(self, fake_generate_timer_file, fake_generate_service_file):
+        transaction = mock.MagicMock()
+        self.timer.ensure(transaction)
+        self.assertEqual(transaction.ensure.call_count, 2)
+        self.assertFalse(transaction.commit.called)
+
+    @patch.object(systemd.Transaction, "commit")
+    @patch.object(systemd.Transaction, "remove")
+    def test_remove_timer(self, fake_remove, fake_commit):
         self.timer.remove()
         # Called once for the timer and once for the service.
         # Just checking count to keep it simple
         self.assertEqual(fake_remove.call_count, 2)
+        self.assertEqual(fake_commit.call_count, 1)
 
-    @patch.object(systemd_unit.Unit, "remove")
-    def test_remove_notimer(self, fake_remove):
+    @patch.object(systemd.Transaction, "commit")
+    @patch.object(systemd.Transaction, "remove")
+    def test_remove_notimer(self, fake_remove, fake_commit):
         self.notimer.remove()
         # Called once for the timer and once for the service.
         # Just checking count to keep it simple
@@ -1,8 +1,10 @@
+import shutil
+import subprocess
+import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
-import systemd_unit
 
 import portinus
 from portinus import Service
@@ -16,22 +18,27 @@ class testService(unittest.TestCase):
         self.real_app = str(self.test_data_dir.joinpath('real_app'))
         self.empty_dir = str(self.test_data_dir.joinpath('empty_dir'))
         self.non_existent_dir = str(self.test_data_dir.joinpath('i-dont-exist'))
+        self.service_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.service_dir))
+        patcher = patch.object(portinus, 'service_dir', self.service_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @patch.object(portinus, 'ComposeSource')
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     def test_init_no_source(self, fake_unit, fake_compose_source):
         service = Service('foo')
         fake_unit.assert_called_with('portinus-foo')
-        fake_compose_source.assert_called_with('foo', None)
+        fake_compose_source.assert_called_with('foo', None, snapshot='copy', keep_releases=3, exclude=())
 
     @patch.object(portinus, 'ComposeSource')
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     def test_init_real_source(self, fake_unit, fake_compose_source):
         service = Service('foo', self.real_app)
         fake_unit.assert_called_with('portinus-foo')
-        fake_compose_source.assert_called_with('foo', self.real_app)
+        fake_compose_source.assert_called_with('foo', self.real_app, snapshot='copy', keep_releases=3, exclude=())
 
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     @patch('os.path.isdir', return_value=True)
     def test_exists_non_existent_dir(self, fake_isdir, fake_unit):
         service = Service('foo')
@@ -39,7 +46,7 @@ class testService(unittest.TestCase):
         self.assertTrue(fake_isdir.called)
 
     @patch.object(portinus.Service, 'exists', return_value=True)
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     @patch('subprocess.call')
     def test_compose(self, fake_call, fake_unit, fake_exists):
         service = Service('foo')
@@ -49,7 +56,7 @@ class testService(unittest.TestCase):
         service.compose(['logs', 'foo'])
         fake_call.assert_called_with([str(service._source.service_script), 'logs', 'foo'])
 
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     def test_stop(self, fake_unit):
         service = Service('foo')
         service._systemd_service = MagicMock()
@@ -63,37 +70,181 @@ class testService(unittest.TestCase):
         service.restart()
         self.assertTrue(service._systemd_service.restart.called)
 
-    @patch.object(systemd_unit, 'Unit')
+    @patch.object(portinus.systemd, 'Unit')
     @patch.object(portinus.ComposeSource, 'remove')
     def test_remove(self, fake_compose_remove, fake_unit):
+        calls = MagicMock()
+        calls.attach_mock(fake_unit().stop, 'stop')
+        calls.attach_mock(fake_compose_remove, 'remove_source')
+        transaction = MagicMock()
         service = Service('foo')
-        service._systemd_service.remove = MagicMock()
-        service.remove()
-        self.assertTrue(fake_compose_remove.called)
-        self.assertTrue(service._systemd_service.remove.called)
+        service.remove(transaction)
+        self.assertEqual([x[0] for x in calls.mock_calls], ['stop', 'remove_source'])
+        transaction.remove.assert_called_with(service._systemd_service)
 
     @patch('subprocess.check_output')
-    @patch.object(portinus.ComposeSource, 'ensure')
-    @patch.object(systemd_unit.Unit, 'ensure')
-    @patch.object(portinus.Service, 'compose')
-    def test_ensure_success(self, fake_service_compose, fake_unit_ensure, fake_compose_ensure, fake_check_output):
+    @patch('subprocess.check_call')
+    @patch.object(portinus.ComposeSource, 'switch')
+    @patch.object(portinus.ComposeSource, 'stage', return_value=Path('/staging/foo'))
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    @patch.object(portinus.systemd.Unit, 'stop')
+    def test_ensure_success(self, fake_unit_stop, fake_unit_ensure, fake_commit, fake_stage, fake_switch, fake_check_call, fake_check_output):
+        calls = MagicMock()
+        calls.attach_mock(fake_check_call, 'build')
+        calls.attach_mock(fake_unit_stop, 'stop')
+        calls.attach_mock(fake_switch, 'switch')
         service = Service('foo')
         service.ensure()
-        self.assertTrue(fake_compose_ensure.called)
+        self.assertEqual([x[0] for x in calls.mock_calls], ['build', 'stop', 'switch'])
+        fake_check_call.assert_called_with(['/staging/foo', 'build'])
         self.assertTrue(fake_unit_ensure.called)
-        self.assertTrue(fake_service_compose.called_with(["build"]))
+        self.assertTrue(fake_commit.called)
 
     @patch('subprocess.check_output')
-    @patch.object(portinus.ComposeSource, 'ensure')
-    @patch.object(systemd_unit.Unit, 'ensure')
-    @patch.object(systemd_unit.Unit, 'stop', side_effect=FileNotFoundError)
-    @patch.object(portinus.Service, 'compose')
-    def test_ensure_did_not_exist(self, fake_service_compose, fake_unit_stop, fake_unit_ensure, fake_compose_ensure, fake_check_output):
+    @patch('subprocess.check_call')
+    @patch.object(portinus.ComposeSource, 'switch')
+    @patch.object(portinus.ComposeSource, 'stage', return_value=Path('/staging/foo'))
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    @patch.object(portinus.systemd.Unit, 'stop', side_effect=FileNotFoundError)
+    def test_ensure_did_not_exist(self, fake_unit_stop, fake_unit_ensure, fake_commit, fake_stage, fake_switch, fake_check_call, fake_check_output):
         service = Service('foo')
         service.ensure()
-        self.assertTrue(fake_compose_ensure.called)
+        self.assertTrue(fake_switch.called)
         self.assertTrue(fake_unit_ensure.called)
-        self.assertTrue(fake_service_compose.called_with(["build"]))
+
+    @patch('subprocess.check_output')
+    @patch('subprocess.check_call', side_effect=subprocess.CalledProcessError(1, 'build'))
+    @patch.object(portinus.ComposeSource, 'switch')
+    @patch.object(portinus.ComposeSource, 'stage', return_value=Path('/staging/foo'))
+    @patch.object(portinus.systemd.Transaction, 'ensure')
+    @patch.object(portinus.systemd.Unit, 'stop')
+    def test_ensure_build_failed(self, fake_unit_stop, fake_unit_ensure, fake_stage, fake_switch, fake_check_call, fake_check_output):
+        service = Service('foo')
+        with self.assertRaises(subprocess.CalledProcessError):
+            service.ensure()
+        self.assertFalse(fake_unit_stop.called)
+        self.assertFalse(fake_switch.called)
+        self.assertFalse(fake_unit_ensure.called)
+
+    def _write_environment(self, content):
+        path = self.service_dir.joinpath("source.env")
+        path.write_text(content)
+        return portinus.EnvironmentFile('foo', str(path))
+
+    @patch.object(Service, '_get_images', return_value={})
+    @patch('subprocess.check_call')
+    @patch.object(portinus.buildcache, 'get_build_hashes', return_value=None)
+    @patch.object(portinus.systemd.Transaction, 'commit')
+    @patch.object(portinus.systemd.Unit, 'restart')
+    @patch.object(portinus.systemd.Unit, 'stop')
+    def test_ensure_environment_file(self, fake_unit_stop, fake_unit_restart, fake_commit, fake_get_build_hashes, fake_check_call, fake_get_images):
+        service = Service('foo', self.real_app)
+        service.ensure(environment_file=self._write_environment("FOO=old\n"))
+        self.assertEqual(portinus.EnvironmentFile('foo').read(), {"FOO": "old"})
+        release_dir = portinus.get_instance_dir('foo')
+        self.assertFalse([x for x in release_dir.iterdir() if "FOO=old" in x.read_text()])
+
+        fake_check_call.side_effect = subprocess.CalledProcessError(1, 'build')
+        with self.assertRaises(subprocess.CalledProcessError):
+            service.ensure(environment_file=self._write_environment("FOO=new\n"))
+        self.assertEqual(portinus.EnvironmentFile('foo').read(), {"FOO": "old"})
+        with self.assertRaises(subprocess.CalledProcessError):
+            service.ensure(environment_file=portinus.EnvironmentFile('foo'))
+        self.assertEqual(portinus.EnvironmentFile('foo').read(), {"FOO": "old"})
+
+        fake_check_call.side_effect = None
+        service.ensure(environment_file=self._write_environment("FOO=new\n"))
+        self.assertEqual(portinus.EnvironmentFile('foo').read(), {"FOO": "new"})
+        with patch.object(portinus.releases, 'restore_images', return_value=[]):
+            service.rollback()
+        self.assertEqual(portinus.EnvironmentFile('foo').read(), {"FOO": "old"})
+
+    @patch('subprocess.call', return_value=0)
+    @patch('subprocess.check_call')
+    @patch.object(portinus.buildcache, 'get_build_hashes', return_value={"web": "1", "worker": "2"})
+    def test__build(self, fake_get_build_hashes, fake_check_call, fake_call):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            service = Service('foo')
+            cache = portinus.buildcache.BuildCache('foo')
+            cache.save({"web": "1", "worker": "old"})
+            service._build(Path('/staging/foo'), None)
+            fake_call.assert_called_once_with(['/staging/foo', 'build', 'worker'])
+            self.assertFalse(fake_check_call.called)
+            self.assertEqual(cache.load(), {"web": "1", "worker": "2"})
+
+            fake_call.reset_mock()
+            service._build(Path('/staging/foo'), None)
+            self.assertFalse(fake_call.called)
+
+            service._build(Path('/staging/foo'), None, rebuild=True)
+            fake_check_call.assert_called_once_with(['/staging/foo', 'build'])
+            self.assertEqual(cache.load(), {"web": "1", "worker": "2"})
+
+    @patch('subprocess.call', side_effect=lambda x: 0 if x[-1] == "web" else 2)
+    @patch.object(portinus.buildcache, 'get_build_hashes', return_value={"web": "1", "worker": "2"})
+    def test__build_failed(self, fake_get_build_hashes, fake_call):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            service = Service('foo')
+            cache = portinus.buildcache.BuildCache('foo')
+            cache.save({"worker": "old"})
+            with self.assertRaises(subprocess.CalledProcessError) as e:
+                service._build(Path('/staging/foo'), None)
+            self.assertEqual(e.exception.returncode, 2)
+            self.assertEqual(fake_call.call_count, 2)
+            self.assertEqual(cache.load(), {"web": "1"})
+
+    @patch('subprocess.check_call')
+    @patch.object(portinus.buildcache, 'get_build_hashes', return_value=None)
+    def test__build_unknown_contexts(self, fake_get_build_hashes, fake_check_call):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            portinus.buildcache.BuildCache('foo').save({"web": "1"})
+            Service('foo')._build(Path('/staging/foo'), None)
+            fake_check_call.assert_called_once_with(['/staging/foo', 'build'])
+            self.assertEqual(portinus.buildcache.BuildCache('foo').load(), {})
+
+    @patch('subprocess.check_call')
+    @patch.object(portinus.releases, 'restore_images', return_value=[])
+    @patch.object(portinus.systemd.Unit, 'restart')
+    @patch.object(portinus.systemd.Unit, 'stop')
+    def test_rollback(self, fake_unit_stop, fake_unit_restart, fake_restore_images, fake_check_call):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            service = Service('foo')
+            releases = service._source.releases
+            for build_hashes in ({"web": "1"}, {"web": "2"}):
+                releases.prepare_staging()
+                releases.staging_path.mkdir()
+                releases.commit({"images": {"foo_web": "sha256:" + build_hashes["web"]}, "build_hashes": build_hashes})
+
+            self.assertEqual(service.rollback(), '0001')
+            self.assertEqual(releases.active(), '0001')
+            fake_restore_images.assert_called_with({"foo_web": "sha256:1"})
+            self.assertEqual(portinus.buildcache.BuildCache('foo').load(), {"web": "1"})
+            self.assertTrue(fake_unit_stop.called)
+            self.assertTrue(fake_unit_restart.called)
+            self.assertFalse(fake_check_call.called)
+
+            with self.assertRaises(ValueError):
+                service.rollback()
+
+    @patch('subprocess.check_call')
+    @patch.object(portinus.releases, 'restore_images', return_value=["foo_web"])
+    @patch.object(portinus.systemd.Unit, 'restart')
+    @patch.object(portinus.systemd.Unit, 'stop')
+    def test_rollback_missing_images(self, fake_unit_stop, fake_unit_restart, fake_restore_images, fake_check_call):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(portinus, 'service_dir', Path(tmp)):
+            service = Service('foo')
+            releases = service._source.releases
+            for i in range(2):
+                releases.prepare_staging()
+                releases.staging_path.mkdir()
+                releases.commit({"images": {"foo_web": "sha256:1"}, "build_hashes": {"web": "1"}})
+
+            service.rollback()
+            fake_check_call.assert_called_with([str(service._source.service_script), 'build'])
+            self.assertEqual(portinus.buildcache.BuildCache('foo').load(), {})
+            self.assertTrue(fake_unit_restart.called)
 
     @patch('subprocess.check_output')
     def test__generate_service_file(self, fake_check_output):
@@ -0,0 +1,223 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from portinus import sync
+from portinus.ignore import IgnoreRules
+
+
+class testSync(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.work_dir))
+        self.source = self.work_dir.joinpath("source")
+        self.destination = self.work_dir.joinpath("destination")
+        self.source.joinpath("sub").mkdir(parents=True)
+        self.source.joinpath("docker-compose.yml").write_text("version: '2'\n")
+        self.source.joinpath("sub", "file").write_text("qwe")
+        os.symlink("sub/file", str(self.source.joinpath("link")))
+
+    def tree(self, path):
+        result = {}
+        for root, dirs, files in os.walk(str(path)):
+            for name in dirs + files:
+                full_path = os.path.join(root, name)
+                relative_path = os.path.relpath(full_path, str(path))
+                if os.path.islink(full_path):
+                    result[relative_path] = "-> " + os.readlink(full_path)
+                elif os.path.isfile(full_path):
+                    with open(full_path) as f:
+                        result[relative_path] = f.read()
+                else:
+                    result[relative_path] = None
+        return result
+
+    def test_sync_new(self):
+        stats = sync.sync_tree(self.source, self.destination)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+        self.assertEqual(stats.copied, 3)
+
+    def test_sync_unchanged(self):
+        sync.sync_tree(self.source, self.destination)
+        with patch.object(sync, 'file_hash') as fake_file_hash:
+            stats = sync.sync_tree(self.source, self.destination)
+            self.assertFalse(fake_file_hash.called)
+        self.assertEqual(stats.copied, 0)
+        self.assertEqual(stats.unchanged, 3)
+
+    def test_sync_changed(self):
+        sync.sync_tree(self.source, self.destination)
+        self.source.joinpath("sub", "file").write_text("asdf")
+        stats = sync.sync_tree(self.source, self.destination)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+        self.assertEqual(stats.copied, 1)
+
+    def test_sync_same_size_new_mtime(self):
+        sync.sync_tree(self.source, self.destination)
+        os.utime(str(self.source.joinpath("sub", "file")), (0, 0))
+        stats = sync.sync_tree(self.source, self.destination)
+        self.assertEqual(stats.copied, 0)
+        self.assertEqual(os.stat(str(self.destination.joinpath("sub", "file"))).st_mtime, 0)
+
+    def test_sync_same_size_new_content(self):
+        sync.sync_tree(self.source, self.destination)
+        self.source.joinpath("sub", "file").write_text("asd")
+        os.utime(str(self.source.joinpath("sub", "file")), (0, 0))
+        stats = sync.sync_tree(self.source, self.destination)
+        self.assertEqual(stats.copied, 1)
+        self.assertEqual(self.destination.joinpath("sub", "file").read_text(), "asd")
+
+    def test_sync_deletes_stale(self):
+        sync.sync_tree(self.source, self.destination)
+        self.destination.joinpath("generated").mkdir()
+        self.destination.joinpath("generated", "data").write_text("qwe")
+        self.destination.joinpath("stale").write_text("qwe")
+        stats = sync.sync_tree(self.source, self.destination)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+        self.assertEqual(stats.deleted, 2)
+
+    def test_sync_keep(self):
+        self.destination.mkdir()
+        self.destination.joinpath("foo").write_text("script")
+        sync.sync_tree(self.source, self.destination, keep=["foo"])
+        self.assertEqual(self.destination.joinpath("foo").read_text(), "script")
+
+    def test_sync_type_changes(self):
+        sync.sync_tree(self.source, self.destination)
+        shutil.rmtree(str(self.source.joinpath("sub")))
+        self.source.joinpath("sub").write_text("now a file")
+        os.remove(str(self.source.joinpath("link")))
+        self.source.joinpath("link").mkdir()
+        sync.sync_tree(self.source, self.destination)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+
+    def test_sync_mode_change(self):
+        sync.sync_tree(self.source, self.destination)
+        os.chmod(str(self.source.joinpath("docker-compose.yml")), 0o755)
+        sync.sync_tree(self.source, self.destination)
+        self.assertEqual(os.stat(str(self.destination.joinpath("docker-compose.yml"))).st_mode & 0o777, 0o755)
+
+    def test_sync_ignore(self):
+        self.source.joinpath("node_modules", "foo").mkdir(parents=True)
+        self.source.joinpath("node_modules", "foo", "index.js").write_text("")
+        self.source.joinpath("sub", "debug.log").write_text("qwe")
+        self.destination.mkdir()
+        self.destination.joinpath("debug.log").write_text("qwe")
+        ignore = IgnoreRules(["node_modules/", "*.log"], gitignore=True)
+        stats = sync.sync_tree(self.source, self.destination, ignore=ignore)
+        self.assertEqual(sorted(self.tree(self.destination)), ["docker-compose.yml", "link", "sub", "sub/file"])
+        self.assertEqual(stats.deleted, 1)
+
+    def test_sync_ignore_exceptions(self):
+        self.source.joinpath("sub", "keep").write_text("")
+        ignore = IgnoreRules(["sub/", "!sub/keep"], gitignore=True)
+        sync.sync_tree(self.source, self.destination, ignore=ignore)
+        self.assertEqual(sorted(self.tree(self.destination)), ["docker-compose.yml", "link", "sub", "sub/keep"])
+
+    def test_file_hash(self):
+        self.assertEqual(sync.file_hash(str(self.source.joinpath("sub", "file"))),
+                         "489cd5dbc708c7e541de4d7cd91ce6d0f1613573b7fc5b40d3942ccb9555cf35")
+
+    def test_tree_fingerprint(self):
+        fingerprint = sync.tree_fingerprint(self.source)
+        self.assertEqual(sync.tree_fingerprint(self.source), fingerprint)
+
+        os.utime(str(self.source.joinpath("sub", "file")), (0, 0))
+        self.assertNotEqual(sync.tree_fingerprint(self.source), fingerprint)
+        fingerprint = sync.tree_fingerprint(self.source)
+
+        self.source.joinpath("new").write_text("")
+        self.assertNotEqual(sync.tree_fingerprint(self.source), fingerprint)
+
+    def test_tree_fingerprint_ignore(self):
+        ignore = IgnoreRules([".git/", "*.log"], gitignore=True)
+        fingerprint = sync.tree_fingerprint(self.source, ignore=ignore)
+        self.source.joinpath(".git").mkdir()
+        self.source.joinpath(".git", "HEAD").write_text("")
+        self.source.joinpath("sub", "debug.log").write_text("")
+        self.assertEqual(sync.tree_fingerprint(self.source, ignore=ignore), fingerprint)
+        self.assertNotEqual(sync.tree_fingerprint(self.source), fingerprint)
+
+    def test_copy_file_reflink_unsupported(self):
+        source = str(self.source.joinpath("sub", "file"))
+        destination = str(self.work_dir.joinpath("copy"))
+        with patch.object(sync, '_reflink_unsupported', set()), \
+                patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, "not supported")) as fake_ioctl:
+            sync.copy_file(source, destination)
+            self.assertEqual(Path(destination).read_text(), "qwe")
+            sync.copy_file(source, destination)
+            self.assertEqual(fake_ioctl.call_count, 1)
+
+    def test_copy_file_reflink(self):
+        source = str(self.source.joinpath("sub", "file"))
+        destination = str(self.work_dir.joinpath("copy"))
+        os.utime(source, (0, 0))
+        with patch.object(sync, '_reflink_unsupported', set()), \
+                patch('fcntl.ioctl') as fake_ioctl, patch('shutil.copy2') as fake_copy2:
+            sync.copy_file(source, destination)
+            self.assertEqual(fake_ioctl.call_args[0][1], sync.FICLONE)
+            self.assertFalse(fake_copy2.called)
+            self.assertEqual(os.stat(destination).st_mtime, 0)
+
+    def test_sync_link(self):
+        object_dir = self.work_dir.joinpath("objects")
+        self.source.joinpath("copy").write_text("qwe")
+        sync.sync_tree(self.source, self.destination, snapshot=sync.LINK, object_dir=object_dir)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+        first = os.stat(str(self.destination.joinpath("sub", "file")))
+        self.assertEqual(first.st_ino, os.stat(str(self.destination.joinpath("copy"))).st_ino)
+        self.assertEqual(first.st_nlink, 3)
+
+        other = self.work_dir.joinpath("other")
+        sync.sync_tree(self.source, other, snapshot=sync.LINK, object_dir=object_dir)
+        self.assertEqual(os.stat(str(other.joinpath("sub", "file"))).st_ino, first.st_ino)
+
+        store = sync.ObjectStore(object_dir)
+        self.assertEqual(store.collect(), 0)
+        shutil.rmtree(str(self.destination))
+        shutil.rmtree(str(other))
+        self.assertEqual(store.collect(), 2)
+        self.assertEqual(os.listdir(str(object_dir)), [])
+
+    def test_sync_link_mode_change(self):
+        object_dir = self.work_dir.joinpath("objects")
+        other = self.work_dir.joinpath("other")
+        file_path = self.source.joinpath("sub", "file")
+        os.chmod(str(file_path), 0o644)
+        sync.sync_tree(self.source, self.destination, snapshot=sync.LINK, object_dir=object_dir)
+        sync.sync_tree(self.source, other, snapshot=sync.LINK, object_dir=object_dir)
+
+        os.chmod(str(file_path), 0o755)
+        stats = sync.sync_tree(self.source, other, snapshot=sync.LINK, object_dir=object_dir)
+        self.assertEqual(stats.copied, 1)
+        self.assertEqual(os.stat(str(other.joinpath("sub", "file"))).st_mode & 0o777, 0o755)
+        self.assertEqual(os.stat(str(self.destination.joinpath("sub", "file"))).st_mode & 0o777, 0o644)
+        for root, dirs, files in os.walk(str(object_dir)):
+            for name in files:
+                self.assertEqual("{:o}".format(os.stat(os.path.join(root, name)).st_mode & 0o777), name.rsplit("-", 1)[1])
+
+    def test_sync_hardlinked_copy(self):
+        sync.sync_tree(self.source, self.destination)
+        os.link(str(self.destination.joinpath("sub", "file")), str(self.work_dir.joinpath("shared")))
+        os.chmod(str(self.source.joinpath("sub", "file")), 0o700)
+        sync.sync_tree(self.source, self.destination)
+        self.assertEqual(os.stat(str(self.destination.joinpath("sub", "file"))).st_mode & 0o777, 0o700)
+        self.assertNotEqual(os.stat(str(self.work_dir.joinpath("shared"))).st_mode & 0o777, 0o700)
+
+    def test_sync_link_fallback(self):
+        object_dir = self.work_dir.joinpath("objects")
+        with patch('os.link', side_effect=OSError(errno.EXDEV, "cross device")):
+            sync.sync_tree(self.source, self.destination, snapshot=sync.LINK, object_dir=object_dir)
+        self.assertEqual(self.tree(self.source), self.tree(self.destination))
+        self.assertEqual(os.stat(str(self.destination.joinpath("sub", "file"))).st_nlink, 1)
+
+    def test_sync_invalid_snapshot(self):
+        with self.assertRaises(ValueError):
+            sync.sync_tree(self.source, self.destination, snapshot="qwe")
+        with self.assertRaises(ValueError):
+            sync.sync_tree(self.source, self.destination, snapshot=sync.LINK)
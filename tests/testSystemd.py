@@ -0,0 +1,324 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch, call
+
+try:
+    import jeepney
+    from jeepney import DBusAddress, HeaderFields, new_error, new_method_return, new_signal
+except ImportError:
+    jeepney = None
+
+from portinus import systemd
+
+
+class FakeUnit(object):
+
+    def __init__(self, unit_dir, name, type="service"):
+        self.name = name
+        self.service_name = "{}.{}".format(name, type)
+        self.service_file_path = str(unit_dir.joinpath(self.service_name))
+        self.content = None
+
+
+class FakeConnection(object):
+    """
+    Replies to systemd manager calls the way systemd does, sending a
+    JobRemoved signal for every job that is started
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.results = {}
+        self.errors = {}
+        self.replies = {}
+        self._signals = []
+        self._manager = DBusAddress(systemd.SYSTEMD_PATH, interface=systemd.MANAGER_INTERFACE)
+
+    def send_and_get_reply(self, message):
+        member = message.header.fields[HeaderFields.member]
+        self.calls.append((member, message.body))
+        if member in self.replies:
+            return new_method_return(message, *self.replies[member])
+        if not member.endswith("Unit"):
+            return new_method_return(message)
+
+        unit = message.body[0]
+        if unit in self.errors:
+            return new_error(message, self.errors[unit], "s", ("failed",))
+        job = "/org/freedesktop/systemd1/job/{}".format(len(self.calls))
+        self._signals.append(("/org/freedesktop/systemd1/job/0", "other.service", "done"))
+        self._signals.append((job, unit, self.results.get(unit, "done")))
+        return new_method_return(message, "o", (job,))
+
+    @contextmanager
+    def filter(self, rule, queue):
+        yield queue
+
+    def recv_until_filtered(self, queue, timeout=None):
+        if not self._signals:
+            raise TimeoutError()
+        job, unit, result = self._signals.pop(0)
+        return new_signal(self._manager, "JobRemoved", "uoss", (1, job, unit, result))
+
+
+class testTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.unit_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(self.unit_dir))
+        self.backend = systemd.FakeBackend()
+        systemd.set_backend(self.backend)
+        self.addCleanup(systemd.set_backend, None)
+
+    def test_commit(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        timer = FakeUnit(self.unit_dir, "foo-restart", "timer")
+        restart_service = FakeUnit(self.unit_dir, "foo-restart")
+        with systemd.Transaction() as transaction:
+            transaction.ensure(service, content="service")
+            transaction.ensure(restart_service, content="restart", restart=False, enable=False)
+            transaction.ensure(timer, content="timer")
+            self.assertEqual(self.backend.calls, [])
+
+        self.assertEqual(self.backend.calls, [
+            ("reload", []),
+            ("restart", ["foo.service", "foo-restart.timer"]),
+            ("enable", ["foo.service", "foo-restart.timer"]),
+        ])
+        self.assertEqual(Path(service.service_file_path).read_text(), "service")
+        self.assertEqual(Path(restart_service.service_file_path).read_text(), "restart")
+
+    def test_commit_unchanged(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        Path(service.service_file_path).write_text("service")
+        with systemd.Transaction() as transaction:
+            transaction.ensure(service, content="service", enable=False)
+        self.assertEqual(self.backend.calls, [("restart", ["foo.service"])])
+
+    def test_commit_remove(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        timer = FakeUnit(self.unit_dir, "foo", "timer")
+        missing = FakeUnit(self.unit_dir, "bar")
+        Path(service.service_file_path).write_text("service")
+        Path(timer.service_file_path).write_text("timer")
+
+        with patch.object(self.backend, 'stop', side_effect=systemd.SystemdError()):
+            with systemd.Transaction() as transaction:
+                transaction.remove(service)
+                transaction.remove(timer)
+                transaction.remove(missing)
+
+        self.assertEqual(self.backend.calls, [
+            ("disable", ["foo.service", "foo.timer"]),
+            ("reload", []),
+        ])
+        self.assertEqual(list(self.unit_dir.iterdir()), [])
+
+    def test_commit_nothing_installed(self):
+        with systemd.Transaction() as transaction:
+            transaction.remove(FakeUnit(self.unit_dir, "foo"))
+        self.assertEqual(self.backend.calls, [])
+
+    def test_last_change_wins(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        with systemd.Transaction() as transaction:
+            transaction.remove(service)
+            transaction.ensure(service, content="service", restart=False, enable=False)
+        self.assertEqual(self.backend.calls, [("reload", [])])
+
+    def test_error_discards(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        with self.assertRaises(ValueError):
+            with systemd.Transaction() as transaction:
+                transaction.ensure(service, content="service")
+                raise ValueError()
+        self.assertEqual(self.backend.calls, [])
+        self.assertFalse(Path(service.service_file_path).exists())
+
+    def test_transaction(self):
+        service = FakeUnit(self.unit_dir, "foo")
+        with systemd.Transaction() as outer:
+            with systemd.transaction(outer) as inner:
+                self.assertIs(inner, outer)
+                inner.ensure(service, content="service", restart=False, enable=False)
+            self.assertEqual(self.backend.calls, [])
+        self.assertEqual(self.backend.calls, [("reload", [])])
+
+        with systemd.transaction() as transaction:
+            self.assertIsInstance(transaction, systemd.Transaction)
+            transaction.remove(service)
+        self.assertFalse(Path(service.service_file_path).exists())
+
+
+class testUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = systemd.FakeBackend()
+        systemd.set_backend(self.backend)
+        self.addCleanup(systemd.set_backend, None)
+
+    @patch('subprocess.check_output')
+    def test_init(self, fake_check_output):
+        unit = systemd.Unit("foo", type="timer")
+        self.assertEqual(unit.service_name, "foo.timer")
+        self.assertEqual(unit.service_file_path, "/etc/systemd/system/foo.timer")
+        self.assertFalse(fake_check_output.called)
+
+    def test_jobs(self):
+        unit = systemd.Unit("foo")
+        unit.start()
+        unit.restart()
+        unit.enable()
+        self.assertEqual(self.backend.active, {"foo.service"})
+        self.assertEqual(self.backend.enabled, {"foo.service"})
+        unit.stop()
+        unit.disable()
+        unit.reload()
+        self.assertEqual(self.backend.active, set())
+        self.assertEqual(self.backend.enabled, set())
+        self.assertEqual([x[0] for x in self.backend.calls], ["start", "restart", "enable", "stop", "disable", "reload"])
+
+    @patch.object(systemd.Transaction, 'commit')
+    @patch.object(systemd.Transaction, 'ensure')
+    def test_ensure(self, fake_ensure, fake_commit):
+        unit = systemd.Unit("foo")
+        unit.ensure(content="qwe", restart=False)
+        fake_ensure.assert_called_with(unit, content="qwe", restart=False, enable=True)
+        self.assertTrue(fake_commit.called)
+
+
+class testBackends(unittest.TestCase):
+
+    def tearDown(self):
+        systemd.set_backend(None)
+
+    @patch('subprocess.check_output')
+    def test_systemctl(self, fake_check_output):
+        backend = systemd.SystemctlBackend()
+        backend.restart(["foo.service", "bar.service"])
+        fake_check_output.assert_called_with(["systemctl", "restart", "foo.service", "bar.service"], stderr=None)
+        backend.stop(["foo.service"])
+        fake_check_output.assert_called_with(["systemctl", "stop", "foo.service"], stderr=subprocess.DEVNULL)
+        backend.reload()
+        fake_check_output.assert_called_with(["systemctl", "daemon-reload"], stderr=None)
+
+    @patch('subprocess.check_output')
+    def test_systemctl_get_unit_states(self, fake_check_output):
+        fake_check_output.return_value = (b"Id=foo.service\nLoadState=loaded\nActiveState=active\nSubState=running\nUnitFileState=enabled\n\n"
+                                          b"Id=foo.timer\nLoadState=not-found\nActiveState=inactive\nSubState=dead\nUnitFileState=\n")
+        states = systemd.SystemctlBackend().get_unit_states(["foo.service", "foo.timer"])
+        self.assertEqual(fake_check_output.call_count, 1)
+        self.assertEqual(fake_check_output.call_args[0][0][:2], ["systemctl", "show"])
+        self.assertEqual(states["foo.service"], {"load": "loaded", "active": "active", "sub": "running", "enabled": "enabled"})
+        self.assertEqual(states["foo.timer"], systemd.get_unit_state())
+        self.assertEqual(systemd.SystemctlBackend().get_unit_states([]), {})
+
+    def test_fake_get_unit_states(self):
+        unit_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(unit_dir))
+        unit_dir.joinpath("foo.service").write_text("qwe")
+        backend = systemd.FakeBackend()
+        backend.start(["foo.service"])
+        with patch.object(systemd, 'UNIT_DIR', str(unit_dir)):
+            states = backend.get_unit_states(["foo.service", "foo.timer"])
+        self.assertEqual(states["foo.service"]["active"], "active")
+        self.assertEqual(states["foo.service"]["enabled"], "disabled")
+        self.assertEqual(states["foo.timer"]["load"], "not-found")
+
+    @patch('subprocess.check_output', side_effect=subprocess.CalledProcessError(5, "systemctl"))
+    def test_systemctl_not_found(self, fake_check_output):
+        with self.assertRaises(FileNotFoundError):
+            systemd.SystemctlBackend().restart(["foo.service"])
+
+    @patch('subprocess.check_output', side_effect=subprocess.CalledProcessError(1, "systemctl"))
+    def test_systemctl_failed(self, fake_check_output):
+        with self.assertRaises(systemd.SystemdError):
+            systemd.SystemctlBackend().restart(["foo.service"])
+
+    @patch.dict(os.environ, {systemd.BACKEND_ENVVAR: "fake"})
+    def test_get_backend(self):
+        systemd.set_backend(None)
+        backend = systemd.get_backend()
+        self.assertIsInstance(backend, systemd.FakeBackend)
+        self.assertIs(systemd.get_backend(), backend)
+
+    @patch.dict(os.environ, {systemd.BACKEND_ENVVAR: "qwe"})
+    def test_get_backend_unknown(self):
+        systemd.set_backend(None)
+        with self.assertRaises(ValueError):
+            systemd.get_backend()
+
+    @patch.dict(os.environ, {systemd.BACKEND_ENVVAR: ""})
+    @patch.object(systemd, 'DBusBackend', side_effect=ConnectionRefusedError)
+    def test_get_backend_fallback(self, fake_dbus_backend):
+        systemd.set_backend(None)
+        self.assertIsInstance(systemd.get_backend(), systemd.SystemctlBackend)
+
+
+@unittest.skipIf(jeepney is None, "jeepney is not installed")
+class testDBusBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection()
+        patcher = patch('jeepney.io.blocking.open_dbus_connection', return_value=self.connection)
+        self.fake_open_dbus_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = systemd.DBusBackend()
+
+    def test_init(self):
+        self.fake_open_dbus_connection.assert_called_with(bus="SYSTEM")
+        self.assertEqual([x[0] for x in self.connection.calls], ["AddMatch", "Subscribe"])
+
+    def test_restart(self):
+        self.backend.restart(["foo.service", "bar.service"])
+        self.assertEqual(self.connection.calls[2:], [
+            ("RestartUnit", ("foo.service", "replace")),
+            ("RestartUnit", ("bar.service", "replace")),
+        ])
+
+    def test_job_failed(self):
+        self.connection.results["bar.service"] = "failed"
+        with self.assertRaises(systemd.SystemdError) as e:
+            self.backend.start(["foo.service", "bar.service"])
+        self.assertIn("bar.service (failed)", str(e.exception))
+
+    def test_not_found(self):
+        self.connection.errors["foo.service"] = "org.freedesktop.systemd1.NoSuchUnit"
+        with self.assertRaises(FileNotFoundError):
+            self.backend.stop(["foo.service"])
+
+    def test_error(self):
+        self.connection.errors["foo.service"] = "org.freedesktop.DBus.Error.AccessDenied"
+        with self.assertRaises(systemd.SystemdError):
+            self.backend.stop(["foo.service"])
+
+    def test_timeout(self):
+        with patch.object(self.connection, 'recv_until_filtered', side_effect=TimeoutError):
+            with self.assertRaises(systemd.SystemdError):
+                self.backend.restart(["foo.service"])
+
+    def test_enable(self):
+        self.backend.enable(["foo.service", "foo.timer"])
+        self.backend.disable(["foo.timer"])
+        self.assertEqual(self.connection.calls[2:], [
+            ("EnableUnitFiles", (["foo.service", "foo.timer"], False, True)),
+            ("Reload", ()),
+            ("DisableUnitFiles", (["foo.timer"], False)),
+            ("Reload", ()),
+        ])
+
+    def test_get_unit_states(self):
+        self.connection.replies["ListUnitsByNames"] = ("a(ssssssouso)", ([
+            ("foo.service", "", "loaded", "active", "running", "", "/unit/foo", 0, "", "/"),
+            ("foo.timer", "", "not-found", "inactive", "dead", "", "/unit/foo_timer", 0, "", "/"),
+        ],))
+        self.connection.replies["ListUnitFilesByPatterns"] = ("a(ss)", ([("/etc/systemd/system/foo.service", "enabled")],))
+        states = self.backend.get_unit_states(["foo.service", "foo.timer"])
+        self.assertEqual([x[0] for x in self.connection.calls[2:]], ["ListUnitsByNames", "ListUnitFilesByPatterns"])
+        self.assertEqual(states["foo.service"], {"load": "loaded", "active": "active", "sub": "running", "enabled": "enabled"})
+        self.assertEqual(states["foo.timer"], systemd.get_unit_state())